@@ -0,0 +1,191 @@
+import base64
+import hashlib
+import json
+import random
+import re
+import sys
+import time
+
+import server
+
+LEGACY_CONFIG_PATTERNS = [
+    r'vless://[^\s<>"]+',
+    r'vmess://[^\s<>"]+',
+    r'trojan://[^\s<>"]+',
+    r'ss://[^\s<>"]+',
+]
+
+
+def legacy_extract_configs(text):
+    configs = []
+    for pattern in LEGACY_CONFIG_PATTERNS:
+        configs.extend(re.findall(pattern, text))
+    return list(set(configs))
+
+
+def synthetic_corpus(lines=200_000, config_every=4, seed=1):
+    rng = random.Random(seed)
+    out = []
+    for i in range(lines):
+        if i % config_every == 0:
+            scheme = rng.choice(server.CONFIG_SCHEMES)
+            out.append(f'<p>{scheme}://uuid-{i}@h{i}.example.com:443?security=tls&type=ws&path=%2F#node-{i}</p>')
+        else:
+            out.append('<div class="row">filler text <a href="https://example.com/page">link</a></div>')
+    return "\n".join(out)
+
+
+def sample_configs(count=20_000, seed=1):
+    rng = random.Random(seed)
+    out = []
+    for i in range(count):
+        host, port = f"h{i}.example.com", rng.choice([443, 8443, 2053])
+        kind = i % 4
+        if kind == 0:
+            out.append((f"vless://{i:08x}-0000-4000-8000-000000000000@{host}:{port}?security=tls&type=ws&path=%2Fws#n{i}", "vless"))
+        elif kind == 1:
+            fields = {"v": "2", "ps": f"n{i}", "add": host, "port": str(port), "id": f"{i:08x}", "aid": "0", "net": "ws", "path": "/ws", "tls": "tls"}
+            out.append(("vmess://" + base64.b64encode(json.dumps(fields).encode()).decode(), "vmess"))
+        elif kind == 2:
+            out.append((f"trojan://pass{i}@{host}:{port}?sni={host}#n{i}", "trojan"))
+        else:
+            userinfo = base64.urlsafe_b64encode(f"aes-256-gcm:pw{i}".encode()).decode().rstrip("=")
+            out.append((f"ss://{userinfo}@{host}:{port}#n{i}", "ss"))
+    return out
+
+
+def timed(fn, *args, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_extract():
+    text = synthetic_corpus()
+    print(f"corpus: {len(text) / 1e6:.1f} MB")
+
+    def legacy(t):
+        return [(c, server.detect_config_type(c)) for c in legacy_extract_configs(t)]
+
+    legacy_s, legacy_out = timed(legacy, text)
+    new_s, new_out = timed(server.scan_configs, text)
+    print(f"legacy 4x findall + detect_config_type: {legacy_s * 1000:8.1f} ms  ({len(legacy_out)} configs)")
+    print(f"single-pass scan_configs:               {new_s * 1000:8.1f} ms  ({len(new_out)} configs)")
+    print(f"speedup: {legacy_s / new_s:.2f}x")
+
+
+def legacy_normalize_config(config, config_type=None):
+    config_type = config_type or server.detect_config_type(config)
+    try:
+        if config_type == "vmess":
+            data = json.loads(server.b64decode_loose(config[len("vmess://"):]).decode())
+            fields = {k: str(v).strip() for k, v in data.items() if k not in server.VMESS_COSMETIC_FIELDS and str(v).strip()}
+            for key in ("add", "id", "host"):
+                if key in fields:
+                    fields[key] = fields[key].lower()
+            return json.dumps(["vmess", fields], sort_keys=True, separators=(",", ":"))
+        raw = config.split("#", 1)[0]
+        if config_type == "ss" and "@" not in raw:
+            raw = "ss://" + server.b64decode_loose(raw[len("ss://"):].split("?", 1)[0].rstrip("/")).decode()
+        parts = server.urlsplit(raw)
+        userinfo = server.unquote(parts.netloc.rpartition("@")[0])
+        if config_type == "ss" and ":" not in userinfo:
+            userinfo = server.b64decode_loose(userinfo).decode()
+        if config_type == "ss":
+            method, _, password = userinfo.partition(":")
+            userinfo = f"{method.lower()}:{password}"
+        elif config_type == "vless":
+            userinfo = userinfo.lower()
+        if not parts.hostname or not parts.port:
+            raise ValueError("missing host or port")
+        return json.dumps([config_type, userinfo, parts.hostname, parts.port, server.canonical_params(parts.query)],
+                          separators=(",", ":"))
+    except Exception:
+        return config.split("#", 1)[0]
+
+
+def legacy_extract_server_from_config(config):
+    config_type = server.detect_config_type(config)
+    try:
+        if config_type == "vmess":
+            b64 = config.replace("vmess://", "")
+            padding = 4 - len(b64) % 4
+            if padding != 4:
+                b64 += "=" * padding
+            data = json.loads(base64.b64decode(b64).decode())
+            return data.get("add", ""), int(data.get("port", 443))
+        elif config_type in ("vless", "trojan"):
+            part = config.split("://")[1]
+            at_split = part.split("@")
+            if len(at_split) > 1:
+                host_port = at_split[1].split("?")[0].split("#")[0]
+                if ":" in host_port:
+                    host, port = host_port.rsplit(":", 1)
+                    host = host.strip("[]")
+                    return host, int(port.split("/")[0])
+        elif config_type == "ss":
+            part = config.replace("ss://", "")
+            if "@" in part:
+                at_split = part.split("@")
+                host_port = at_split[1].split("?")[0].split("#")[0]
+                if ":" in host_port:
+                    host, port = host_port.rsplit(":", 1)
+                    return host, int(port.split("/")[0])
+    except Exception:
+        pass
+    return None, None
+
+
+def bench_parsed():
+    configs = sample_configs()
+
+    def legacy(items):
+        # What one fetch_and_distribute iteration did per config before ParsedConfig: a digest for dedup,
+        # four hex hashes (upsert filter, $set, two keyboard buttons), three type detections and two
+        # server parses (probe, message).
+        for config, config_type in items:
+            hashlib.md5(legacy_normalize_config(config, config_type).encode()).digest()
+            for _ in range(4):
+                hashlib.md5(legacy_normalize_config(config, config_type).encode()).hexdigest()
+            for _ in range(3):
+                server.detect_config_type(config)
+            for _ in range(2):
+                legacy_extract_server_from_config(config)
+
+    def parsed_once(items):
+        for config, config_type in items:
+            parsed = server.ParsedConfig(config, config_type)
+            parsed.digest, parsed.hash, parsed.hash, parsed.type, parsed.host, parsed.port, parsed.server
+
+    legacy_s, _ = timed(legacy, configs)
+    new_s, _ = timed(parsed_once, configs)
+    print(f"legacy per-config parsing: {legacy_s / len(configs) * 1e6:6.1f} us/config")
+    print(f"ParsedConfig once:         {new_s / len(configs) * 1e6:6.1f} us/config")
+    print(f"speedup: {legacy_s / new_s:.2f}x")
+
+
+def bench_parse():
+    configs = sample_configs()
+    # One in ten configs is damaged the way scraped sources usually are: truncated mid-token.
+    items = [(c[:len(c) // 2], t) if i % 10 == 9 else (c, t) for i, (c, t) in enumerate(configs)]
+    legacy_s, legacy_out = timed(lambda xs: [legacy_extract_server_from_config(c) for c, _ in xs], items)
+    new_s, (parsed, errors) = timed(server.parse_configs, items)
+    legacy_ok = sum(1 for host, port in legacy_out if host and port)
+    print(f"legacy host/port only:             {len(items) / legacy_s:10,.0f} configs/s  ({legacy_ok} with an endpoint)")
+    print(f"parse_configs (full ParsedConfig): {len(items) / new_s:10,.0f} configs/s  ({len(parsed) - sum(errors.values())} with an endpoint)")
+    print(f"errors: {errors}")
+
+
+BENCHMARKS = {
+    "extract": bench_extract,
+    "parsed": bench_parsed,
+    "parse": bench_parse,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
@@ -0,0 +1,29 @@
+# Standalone probe worker: python probe_worker.py, any number of them on any hosts pointed at the same
+# MONGO_URL and DB_NAME. Workers split the stored configs between themselves (see ProbeWorker in
+# server.py), so re-testing throughput grows with the number of workers; while any are alive the API
+# process leaves re-testing to them.
+import asyncio
+import signal
+
+import server
+
+
+async def main():
+    worker = server.ProbeWorker()
+    task = asyncio.create_task(worker.run())
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, task.cancel)
+    server.logger.info(f"Probe worker {worker.worker_id} started")
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await worker.stop()
+        server.client.close()
+        server.logger.info(f"Probe worker {worker.worker_id} stopped: {worker.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,20 +1,38 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteOne, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import os
 import logging
 import re
 import json
+import base64
+import bisect
+import binascii
 import hashlib
+import math
+import ipaddress
 import asyncio
+import codecs
+import gzip
+import copy
 import httpx
 import socket
+import time
+import uuid
+import dns.asyncresolver
+import dns.exception
+import dns.resolver
+from collections import Counter, OrderedDict, deque
+from dataclasses import dataclass
 from pathlib import Path
+from urllib.parse import urlparse, urlsplit, unquote
 from pydantic import BaseModel, Field
 from typing import List, Optional
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from jose import jwt
 
 ROOT_DIR = Path(__file__).parent
@@ -38,13 +56,74 @@ logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 TELEGRAM_API = f"https://api.telegram.org/bot{BOT_TOKEN}"
-
-CONFIG_PATTERNS = [
-    r'vless://[^\s<>"]+',
-    r'vmess://[^\s<>"]+',
-    r'trojan://[^\s<>"]+',
-    r'ss://[^\s<>"]+',
-]
+TELEGRAM_TIMEOUT = float(os.environ.get('TELEGRAM_TIMEOUT', '30'))
+TELEGRAM_CONCURRENCY = int(os.environ.get('TELEGRAM_CONCURRENCY', '8'))
+TELEGRAM_GLOBAL_RATE = float(os.environ.get('TELEGRAM_GLOBAL_RATE', '30'))
+TELEGRAM_CHAT_RATE = float(os.environ.get('TELEGRAM_CHAT_RATE', '1'))
+TELEGRAM_GROUP_RATE_PER_MIN = float(os.environ.get('TELEGRAM_GROUP_RATE_PER_MIN', '20'))
+TELEGRAM_CHAT_BURST = int(os.environ.get('TELEGRAM_CHAT_BURST', '3'))
+TELEGRAM_MAX_RETRIES = int(os.environ.get('TELEGRAM_MAX_RETRIES', '3'))
+TELEGRAM_MAX_BUCKETS = int(os.environ.get('TELEGRAM_MAX_BUCKETS', '10000'))
+WEBHOOK_CONCURRENCY = int(os.environ.get('WEBHOOK_CONCURRENCY', '16'))
+WEBHOOK_MAX_QUEUED = int(os.environ.get('WEBHOOK_MAX_QUEUED', '5000'))
+WEBHOOK_DEDUP_SIZE = int(os.environ.get('WEBHOOK_DEDUP_SIZE', '10000'))
+
+CONFIG_SCHEMES = ["vless", "vmess", "trojan", "ss"]
+
+FETCH_CONCURRENCY = int(os.environ.get('FETCH_CONCURRENCY', '16'))
+FETCH_PER_HOST_LIMIT = int(os.environ.get('FETCH_PER_HOST_LIMIT', '4'))
+FETCH_TIMEOUT = float(os.environ.get('FETCH_TIMEOUT', '30'))
+HTTP2_ENABLED = os.environ.get('HTTP2_ENABLED', 'true').lower() == 'true'
+FETCH_CHUNK_SIZE = int(os.environ.get('FETCH_CHUNK_SIZE', str(64 * 1024)))
+FETCH_MAX_BYTES = int(os.environ.get('FETCH_MAX_BYTES', str(64 * 1024 * 1024)))
+STREAM_MAX_CONFIG_LENGTH = int(os.environ.get('STREAM_MAX_CONFIG_LENGTH', '8192'))
+STREAM_DELIMITERS = ' \t\n\r\f\v<>"'
+PROBE_CONCURRENCY = int(os.environ.get('PROBE_CONCURRENCY', '50'))
+PROBE_PER_HOST_LIMIT = int(os.environ.get('PROBE_PER_HOST_LIMIT', '2'))
+PROBE_TIMEOUT = float(os.environ.get('PROBE_TIMEOUT', '5'))
+DNS_TIMEOUT = float(os.environ.get('DNS_TIMEOUT', '3'))
+DNS_MIN_TTL = int(os.environ.get('DNS_MIN_TTL', '30'))
+DNS_MAX_TTL = int(os.environ.get('DNS_MAX_TTL', '3600'))
+DNS_NEGATIVE_TTL = int(os.environ.get('DNS_NEGATIVE_TTL', '60'))
+DNS_CACHE_SIZE = int(os.environ.get('DNS_CACHE_SIZE', '10000'))
+PROBE_CACHE_ACTIVE_TTL = int(os.environ.get('PROBE_CACHE_ACTIVE_TTL', '300'))
+PROBE_CACHE_DEAD_TTL = int(os.environ.get('PROBE_CACHE_DEAD_TTL', '120'))
+PROBE_CACHE_SIZE = int(os.environ.get('PROBE_CACHE_SIZE', '50000'))
+KV_CACHE_TTL = float(os.environ.get('KV_CACHE_TTL', '5'))
+KV_CACHE_WATCH_TTL = float(os.environ.get('KV_CACHE_WATCH_TTL', '300'))
+KV_WATCH_RETRY = float(os.environ.get('KV_WATCH_RETRY', '30'))
+WRITE_BATCH_SIZE = int(os.environ.get('WRITE_BATCH_SIZE', '500'))
+WRITE_BATCH_DELAY = float(os.environ.get('WRITE_BATCH_DELAY', '0.05'))
+SUB_CHECK_SECONDS = float(os.environ.get('SUB_CHECK_SECONDS', '30'))
+SUB_MAX_AGE = int(os.environ.get('SUB_MAX_AGE', '300'))
+SUB_MAX_LIMIT = int(os.environ.get('SUB_MAX_LIMIT', '1000'))
+SUB_BLOB_CACHE_SIZE = int(os.environ.get('SUB_BLOB_CACHE_SIZE', '256'))
+RETEST_ENABLED = os.environ.get('RETEST_ENABLED', 'true').lower() == 'true'
+RETEST_PER_MINUTE = int(os.environ.get('RETEST_PER_MINUTE', '60'))
+RETEST_TICK_SECONDS = float(os.environ.get('RETEST_TICK_SECONDS', '15'))
+RETEST_INTERVAL = int(os.environ.get('RETEST_INTERVAL', '7200'))
+RETEST_MAX_BACKOFF = int(os.environ.get('RETEST_MAX_BACKOFF', '172800'))
+RETEST_MAX_FAILURES = int(os.environ.get('RETEST_MAX_FAILURES', '6'))
+RETEST_LEASE_SECONDS = int(os.environ.get('RETEST_LEASE_SECONDS', '60'))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+PROBE_SHARDS = int(os.environ.get('PROBE_SHARDS', '64'))
+PROBE_RING_REPLICAS = int(os.environ.get('PROBE_RING_REPLICAS', '32'))
+PROBE_WORKER_BATCH = int(os.environ.get('PROBE_WORKER_BATCH', '200'))
+PROBE_WORKER_IDLE = float(os.environ.get('PROBE_WORKER_IDLE', '5'))
+PROBE_LEASE_SECONDS = int(os.environ.get('PROBE_LEASE_SECONDS', '30'))
+PROBE_HISTORY_SAMPLES = int(os.environ.get('PROBE_HISTORY_SAMPLES', '64'))
+PROBE_HISTORY_DAYS = int(os.environ.get('PROBE_HISTORY_DAYS', '30'))
+STATS_SNAPSHOT_TTL = float(os.environ.get('STATS_SNAPSHOT_TTL', '5'))
+STATS_RECONCILE_SECONDS = int(os.environ.get('STATS_RECONCILE_SECONDS', '600'))
+PUBLISH_LIMIT = int(os.environ.get('PUBLISH_LIMIT', '20'))
+FETCH_JOB_STALE_SECONDS = int(os.environ.get('FETCH_JOB_STALE_SECONDS', '900'))
+FETCH_JOB_REPORT_INTERVAL = float(os.environ.get('FETCH_JOB_REPORT_INTERVAL', '1'))
+FETCH_JOB_HISTORY = int(os.environ.get('FETCH_JOB_HISTORY', '20'))
+SEEN_TTL_DAYS = int(os.environ.get('SEEN_TTL_DAYS', '30'))
+SEEN_BATCH_SIZE = int(os.environ.get('SEEN_BATCH_SIZE', '1000'))
+SEEN_BLOOM_ENABLED = os.environ.get('SEEN_BLOOM_ENABLED', 'true').lower() == 'true'
+SEEN_BLOOM_CAPACITY = int(os.environ.get('SEEN_BLOOM_CAPACITY', '1000000'))
+SEEN_BLOOM_ERROR_RATE = float(os.environ.get('SEEN_BLOOM_ERROR_RATE', '0.01'))
 
 DEFAULT_SOURCE_LINKS = [
     "https://raw.githubusercontent.com/arshiacomplus/v2rayExtractor/refs/heads/main/mix/sub.html"
@@ -71,6 +150,9 @@ class ConfigSubmission(BaseModel):
     config: str
     submitted_by: Optional[str] = "anonymous"
 
+class ConfigBatch(BaseModel):
+    configs: List[str]
+
 # --- Auth ---
 def create_token(username: str):
     return jwt.encode({"sub": username, "exp": datetime.now(timezone.utc).timestamp() + 86400}, JWT_SECRET, algorithm="HS256")
@@ -84,112 +166,533 @@ async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(secur
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-# --- Telegram helpers ---
-async def send_telegram(chat_id, text, reply_markup=None, parse_mode="Markdown"):
-    async with httpx.AsyncClient(timeout=30) as client_http:
+# --- Shared HTTP client ---
+http_client: Optional[httpx.AsyncClient] = None
+
+def http2_supported():
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def get_http_client():
+    global http_client
+    if http_client is None or http_client.is_closed:
+        http_client = httpx.AsyncClient(
+            timeout=FETCH_TIMEOUT,
+            follow_redirects=True,
+            http2=http2_supported(),
+            headers={"User-Agent": "Mozilla/5.0"},
+            limits=httpx.Limits(max_connections=FETCH_CONCURRENCY, max_keepalive_connections=FETCH_CONCURRENCY),
+        )
+    return http_client
+
+async def close_http_client():
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+
+# --- Telegram client ---
+@dataclass
+class TelegramResult:
+    ok: bool
+    result: Optional[dict] = None
+    error_code: Optional[int] = None
+    description: str = ""
+    retry_after: Optional[float] = None
+
+    @classmethod
+    def from_response(cls, data):
+        params = data.get("parameters") or {}
+        return cls(ok=bool(data.get("ok")), result=data.get("result"), error_code=data.get("error_code"),
+                   description=data.get("description", ""), retry_after=params.get("retry_after"))
+
+class TelegramClient:
+    def __init__(self, api_url=TELEGRAM_API, transport=None):
+        self.api_url = api_url
+        self.transport = transport
+        self.http = None
+
+    def _client(self):
+        if self.http is None or self.http.is_closed:
+            self.http = httpx.AsyncClient(
+                base_url=self.api_url,
+                timeout=TELEGRAM_TIMEOUT,
+                http2=http2_supported(),
+                transport=self.transport,
+                limits=httpx.Limits(max_connections=TELEGRAM_CONCURRENCY, max_keepalive_connections=TELEGRAM_CONCURRENCY,
+                                    keepalive_expiry=60),
+            )
+        return self.http
+
+    async def call(self, method, payload):
+        try:
+            resp = await self._client().post(method, json=payload)
+            result = TelegramResult.from_response(resp.json())
+        except Exception as e:
+            logger.error(f"Telegram {method} error: {e}")
+            return TelegramResult(ok=False, description=str(e))
+        if not result.ok:
+            logger.warning(f"Telegram {method} failed: {result.error_code} {result.description}")
+        return result
+
+    async def send_message(self, chat_id, text, reply_markup=None, parse_mode="Markdown"):
         body = {"chat_id": chat_id, "text": text, "parse_mode": parse_mode}
         if reply_markup:
             body["reply_markup"] = json.dumps(reply_markup)
+        return await self.call("sendMessage", body)
+
+    async def send_many(self, messages):
+        # messages are send_message kwargs; requests share the pooled connections and results keep input order.
+        limit = asyncio.Semaphore(TELEGRAM_CONCURRENCY)
+
+        async def send(message):
+            async with limit:
+                return await self.send_message(**message)
+
+        return await asyncio.gather(*(send(message) for message in messages))
+
+    async def aclose(self):
+        if self.http is not None:
+            await self.http.aclose()
+            self.http = None
+
+telegram = TelegramClient()
+
+# --- Outbound scheduler ---
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        # Drain the bucket so the next token is only available after `seconds` (Telegram's retry_after).
+        self._refill()
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+def chat_bucket(chat_id):
+    # Groups and channels (negative ids or @usernames) are limited per minute, private chats per second.
+    if str(chat_id).startswith(("-", "@")):
+        return TokenBucket(TELEGRAM_GROUP_RATE_PER_MIN / 60, TELEGRAM_CHAT_BURST)
+    return TokenBucket(TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+
+class OutboundScheduler:
+    # One FIFO queue and worker per chat (ordering within a chat, parallelism across chats),
+    # all sharing a global token bucket.
+    def __init__(self, client=None):
+        self.client = client or telegram
+        self.global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+        self.buckets = OrderedDict()
+        self.queues = {}
+        self.workers = {}
+        self.counters = {"sent": 0, "failed": 0, "throttled": 0, "retries": 0}
+
+    def stats(self):
+        depths = {chat: q.qsize() for chat, q in self.queues.items() if q.qsize()}
+        return {**self.counters, "queued": sum(depths.values()), "active_chats": len(self.workers), "queue_depths": depths}
+
+    def submit(self, chat_id, text, reply_markup=None, parse_mode="Markdown"):
+        chat_id = str(chat_id)
+        future = asyncio.get_running_loop().create_future()
+        queue = self.queues.setdefault(chat_id, asyncio.Queue())
+        queue.put_nowait(({"chat_id": chat_id, "text": text, "reply_markup": reply_markup, "parse_mode": parse_mode}, future))
+        if chat_id not in self.workers:
+            self.workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+        return future
+
+    async def send(self, chat_id, text, reply_markup=None, parse_mode="Markdown"):
+        return await self.submit(chat_id, text, reply_markup, parse_mode)
+
+    async def fan_out(self, chat_ids, text, reply_markup=None, parse_mode="Markdown"):
+        return await asyncio.gather(*(self.submit(c, text, reply_markup, parse_mode) for c in chat_ids))
+
+    async def _drain(self, chat_id):
+        queue = self.queues[chat_id]
+        bucket = self._bucket(chat_id)
         try:
-            resp = await client_http.post(f"{TELEGRAM_API}/sendMessage", json=body)
-            return resp.json()
-        except Exception as e:
-            logger.error(f"Telegram send error: {e}")
-            return None
+            while not queue.empty():
+                message, future = queue.get_nowait()
+                try:
+                    result = await self._deliver(message, bucket)
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except Exception as e:
+                    logger.error(f"Outbound delivery to {chat_id} failed: {e}")
+                    result = TelegramResult(ok=False, description=str(e))
+                self.counters["sent" if result.ok else "failed"] += 1
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            # No await between the emptiness check and removal, so submit() cannot enqueue unseen.
+            del self.workers[chat_id]
+            if queue.empty():
+                del self.queues[chat_id]
+                if bucket.is_full():
+                    self.buckets.pop(chat_id, None)
+
+    def _bucket(self, chat_id):
+        # Least recently used buckets that have refilled carry no state and are dropped; the size bound
+        # covers the rest.
+        while self.buckets:
+            oldest, oldest_bucket = next(iter(self.buckets.items()))
+            if oldest in self.workers or not oldest_bucket.is_full():
+                break
+            del self.buckets[oldest]
+        if chat_id not in self.buckets:
+            self.buckets[chat_id] = chat_bucket(chat_id)
+            while len(self.buckets) > TELEGRAM_MAX_BUCKETS:
+                self.buckets.popitem(last=False)
+        self.buckets.move_to_end(chat_id)
+        return self.buckets[chat_id]
+
+    async def _deliver(self, message, bucket):
+        for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            result = await self.client.send_message(**message)
+            if result.error_code != 429 or attempt == TELEGRAM_MAX_RETRIES:
+                return result
+            self.counters["throttled"] += 1
+            self.counters["retries"] += 1
+            bucket.pause(result.retry_after or 1)
+        return result
+
+    async def aclose(self):
+        for task in list(self.workers.values()):
+            task.cancel()
+        for queue in self.queues.values():
+            while not queue.empty():
+                _, future = queue.get_nowait()
+                future.cancel()
+
+outbound = OutboundScheduler()
+
+# --- Telegram helpers ---
+async def send_telegram(chat_id, text, reply_markup=None, parse_mode="Markdown"):
+    return await outbound.send(chat_id, text, reply_markup, parse_mode)
 
 async def answer_callback(callback_query_id, text=""):
-    async with httpx.AsyncClient(timeout=10) as client_http:
-        try:
-            await client_http.post(f"{TELEGRAM_API}/answerCallbackQuery",
-                json={"callback_query_id": callback_query_id, "text": text, "show_alert": False})
-        except Exception:
-            pass
+    await telegram.call("answerCallbackQuery", {"callback_query_id": callback_query_id, "text": text, "show_alert": False})
 
 # --- Config extraction ---
+def build_config_scanner(schemes):
+    # Anchor on the literal "://" and identify the scheme with lookbehinds; longer schemes go first
+    # so that e.g. "vless" wins over its "ss" suffix.
+    ordered = sorted(schemes, key=len, reverse=True)
+    lookbehinds = "|".join(f"(?<=(?P<{s}>{re.escape(s)})://)" for s in ordered)
+    return re.compile(rf'://(?:{lookbehinds})[^\s<>"]+')
+
+CONFIG_SCANNER = build_config_scanner(CONFIG_SCHEMES)
+
+def register_config_scheme(scheme):
+    global CONFIG_SCANNER
+    if scheme not in CONFIG_SCHEMES:
+        CONFIG_SCHEMES.append(scheme)
+        CONFIG_SCANNER = build_config_scanner(CONFIG_SCHEMES)
+
+def scan_configs(text):
+    found = {}
+    for m in CONFIG_SCANNER.finditer(text):
+        scheme = m.lastgroup
+        found.setdefault(text[m.start() - len(scheme):m.end()], scheme)
+    return list(found.items())
+
 def extract_configs(text):
-    configs = []
-    for pattern in CONFIG_PATTERNS:
-        found = re.findall(pattern, text)
-        configs.extend(found)
-    return list(set(configs))
+    return [config for config, _ in scan_configs(text)]
 
 def detect_config_type(config):
-    if config.startswith("vless://"):
-        return "vless"
-    elif config.startswith("vmess://"):
-        return "vmess"
-    elif config.startswith("trojan://"):
-        return "trojan"
-    elif config.startswith("ss://"):
-        return "ss"
-    return "unknown"
-
-def get_config_hash(config):
-    return hashlib.md5(config.encode()).hexdigest()
+    scheme = config.split("://", 1)[0]
+    return scheme if scheme in CONFIG_SCHEMES else "unknown"
+
+# --- Config normalization ---
+VMESS_COSMETIC_FIELDS = {"ps", "v", "remark", "remarks"}
+
+def b64decode_loose(data):
+    data = re.sub(r"\s+", "", data).replace("-", "+").replace("_", "/")
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+def canonical_params(query):
+    params = []
+    for pair in query.split("&"):
+        key, _, value = pair.partition("=")
+        key, value = unquote(key).strip().lower(), unquote(value).strip()
+        if key and value:
+            params.append((key, value))
+    return sorted(params)
+
+VMESS_ENDPOINT_FIELDS = {"add", "port", "id", "aid", "scy"}
+PARSE_ERRORS = ("unknown_scheme", "bad_encoding", "bad_json", "missing_credentials", "missing_host", "bad_port",
+                "malformed")
+
+class ConfigParseError(ValueError):
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+def split_host_port(hostport):
+    # For decoded legacy ss bodies, where IPv6 literals are often left unbracketed.
+    host, _, port = hostport.rpartition(":")
+    host = host.strip("[]")
+    return (f"[{host}]" if ":" in host else host) + f":{port}"
+
+class ParsedConfig:
+    # Everything the pipeline needs from a config, parsed once at extraction and passed along instead of
+    # the raw string. identity ignores remarks, param order and encoding differences. error is None for
+    # a usable config, otherwise one of PARSE_ERRORS.
+    __slots__ = ("raw", "type", "identity", "digest", "host", "port", "params", "error")
+
+    def __init__(self, raw, config_type=None):
+        self.raw = raw
+        self.type = config_type or detect_config_type(raw)
+        self.host = None
+        self.port = None
+        self.params = {}
+        self.error = None
+        try:
+            self.identity = self._parse()
+        except Exception as e:
+            self.error = parse_error_reason(e)
+            self.identity = raw.split("#", 1)[0]
+        self.digest = hashlib.md5(self.identity.encode()).digest()
+
+    @property
+    def hash(self):
+        return self.digest.hex()
+
+    @property
+    def server(self):
+        return f"{self.host}:{self.port}" if self.host else "Unknown"
+
+    def as_dict(self):
+        return {"config": self.raw, "type": self.type, "hash": self.hash, "host": self.host, "port": self.port,
+                "params": self.params, "error": self.error}
+
+    def _parse(self):
+        if self.type == "unknown":
+            raise ConfigParseError("unknown_scheme")
+        body = self.raw.split("://", 1)[1]
+        if self.type == "vmess" and "@" not in body:
+            return self._parse_vmess(body.split("#", 1)[0])
+        raw = self.raw.split("#", 1)[0]
+        if self.type == "ss" and "@" not in raw:
+            decoded = b64decode_loose(body.split("#", 1)[0].split("?", 1)[0].rstrip("/")).decode()
+            userinfo, _, hostport = decoded.rpartition("@")
+            raw = f"ss://{userinfo}@{split_host_port(hostport)}"
+        parts = urlsplit(raw)
+        userinfo = unquote(parts.netloc.rpartition("@")[0])
+        if self.type == "ss" and ":" not in userinfo:
+            userinfo = b64decode_loose(userinfo).decode()
+        if self.type == "ss":
+            method, _, password = userinfo.partition(":")
+            if not method or not password:
+                raise ConfigParseError("missing_credentials")
+            userinfo = f"{method.lower()}:{password}"
+        elif not userinfo:
+            raise ConfigParseError("missing_credentials")
+        elif self.type in ("vless", "vmess"):
+            userinfo = userinfo.lower()
+        if not parts.hostname:
+            raise ConfigParseError("missing_host")
+        try:
+            port = parts.port
+        except ValueError:
+            raise ConfigParseError("bad_port")
+        if not port:
+            raise ConfigParseError("bad_port")
+        params = canonical_params(parts.query)
+        self.host, self.port, self.params = parts.hostname, port, dict(params)
+        return json.dumps([self.type, userinfo, parts.hostname, port, params], separators=(",", ":"))
+
+    def _parse_vmess(self, body):
+        data = json.loads(b64decode_loose(body).decode())
+        if not isinstance(data, dict):
+            raise ConfigParseError("bad_json")
+        fields = {k: str(v).strip() for k, v in data.items() if k not in VMESS_COSMETIC_FIELDS and str(v).strip()}
+        for key in ("add", "id", "host"):
+            if key in fields:
+                fields[key] = fields[key].lower()
+        identity = json.dumps(["vmess", fields], sort_keys=True, separators=(",", ":"))
+        self.params = {k: v for k, v in fields.items() if k not in VMESS_ENDPOINT_FIELDS}
+        if not fields.get("add"):
+            raise ConfigParseError("missing_host")
+        port = fields.get("port", "443")
+        if not port.isdigit() or not 0 < int(port) < 65536:
+            raise ConfigParseError("bad_port")
+        self.host, self.port = fields["add"].strip("[]"), int(port)
+        return identity
+
+def parse_error_reason(error):
+    if isinstance(error, ConfigParseError):
+        return error.reason
+    if isinstance(error, json.JSONDecodeError):
+        return "bad_json"
+    if isinstance(error, (binascii.Error, UnicodeDecodeError)):
+        return "bad_encoding"
+    return "malformed"
+
+def parse_configs(items):
+    # Batch parser: items are raw URIs or (uri, type) pairs as returned by scan_configs. Returns
+    # (parsed, errors): every ParsedConfig in input order and a count of failures per reason.
+    parsed = [ParsedConfig(*item) if isinstance(item, tuple) else ParsedConfig(item) for item in items]
+    return parsed, dict(Counter(p.error for p in parsed if p.error))
+
+def as_parsed(config, config_type=None):
+    return config if isinstance(config, ParsedConfig) else ParsedConfig(config, config_type)
+
+def normalize_config(config, config_type=None):
+    return as_parsed(config, config_type).identity
+
+def get_config_hash(config, config_type=None):
+    return as_parsed(config, config_type).hash
+
+def get_config_digest(config, config_type=None):
+    return as_parsed(config, config_type).digest
 
 def extract_server_from_config(config):
-    config_type = detect_config_type(config)
+    parsed = as_parsed(config)
+    return parsed.host, parsed.port
+
+# --- TTL caches ---
+class CoalescingTtlCache:
+    # LRU map of key -> (value, expiry); concurrent loads of the same key share one in-flight task.
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.pending = {}
+        self.epoch = 0
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0}
+
+    def stats(self):
+        lookups = self.counters["hits"] + self.counters["misses"] + self.counters["coalesced"]
+        hit_rate = (lookups - self.counters["misses"]) / lookups if lookups else 0.0
+        return {**self.counters, "size": len(self.cache), "in_flight": len(self.pending), "hit_rate": round(hit_rate, 3)}
+
+    async def get_or_load(self, key, load):
+        # load() returns (value, ttl). Returns (value, cached).
+        entry = self.cache.get(key)
+        if entry and entry[1] > time.monotonic():
+            self.cache.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[0], True
+        if key in self.pending:
+            self.counters["coalesced"] += 1
+            return await asyncio.shield(self.pending[key]), True
+        self.counters["misses"] += 1
+        task = asyncio.create_task(self._load(key, load, self.epoch))
+        self.pending[key] = task
+        task.add_done_callback(lambda _: self.pending.pop(key, None))
+        return await asyncio.shield(task), False
+
+    async def _load(self, key, load, epoch):
+        value, ttl = await load()
+        # A put() or invalidate() that raced with this load is newer than what we read.
+        if ttl > 0 and epoch == self.epoch:
+            self.put(key, value, ttl)
+        return value
+
+    def put(self, key, value, ttl):
+        self.cache[key] = (value, time.monotonic() + ttl)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+    def invalidate(self, key):
+        self.epoch += 1
+        self.cache.pop(key, None)
+
+    def clear(self):
+        self.epoch += 1
+        self.cache.clear()
+
+# --- Async DNS resolution ---
+async def system_lookup(host):
+    infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    return list(dict.fromkeys(info[4][0] for info in infos)), DNS_MIN_TTL
+
+async def dns_lookup(host):
+    # Returns (addresses, ttl); raises on failure. NXDOMAIN or no address records is a negative answer.
+    # Only when DNS itself is unusable (no resolv.conf, no nameserver answering) and for single-label names
+    # does the lookup go to the system resolver, which also knows /etc/hosts.
+    if "." not in host:
+        return await system_lookup(host)
     try:
-        if config_type == "vmess":
-            b64 = config.replace("vmess://", "")
-            import base64
-            padding = 4 - len(b64) % 4
-            if padding != 4:
-                b64 += "=" * padding
-            data = json.loads(base64.b64decode(b64).decode())
-            return data.get("add", ""), int(data.get("port", 443))
-        elif config_type in ("vless", "trojan"):
-            part = config.split("://")[1]
-            at_split = part.split("@")
-            if len(at_split) > 1:
-                host_port = at_split[1].split("?")[0].split("#")[0]
-                if ":" in host_port:
-                    host, port = host_port.rsplit(":", 1)
-                    host = host.strip("[]")
-                    return host, int(port.split("/")[0])
-        elif config_type == "ss":
-            part = config.replace("ss://", "")
-            if "@" in part:
-                at_split = part.split("@")
-                host_port = at_split[1].split("?")[0].split("#")[0]
-                if ":" in host_port:
-                    host, port = host_port.rsplit(":", 1)
-                    return host, int(port.split("/")[0])
-    except Exception:
+        for rdtype in ("A", "AAAA"):
+            try:
+                answer = await dns.asyncresolver.resolve(host, rdtype, lifetime=DNS_TIMEOUT)
+            except dns.resolver.NoAnswer:
+                continue
+            return [r.address for r in answer], answer.rrset.ttl
+    except dns.resolver.NXDOMAIN:
         pass
-    return None, None
+    except (dns.resolver.NoResolverConfiguration, dns.resolver.NoNameservers) as e:
+        logger.debug(f"Async DNS lookup of {host} failed ({type(e).__name__}), using system resolver")
+        return await system_lookup(host)
+    return [], DNS_NEGATIVE_TTL
+
+class DnsResolver(CoalescingTtlCache):
+    def __init__(self, lookup=None, max_size=DNS_CACHE_SIZE):
+        super().__init__(max_size)
+        self.lookup = lookup or dns_lookup
+        self.counters.update(negative_hits=0, failures=0)
+
+    async def resolve(self, host):
+        # Returns a list of addresses; empty when the name does not resolve.
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+        addresses, cached = await self.get_or_load(host.lower(), lambda: self._lookup(host.lower()))
+        if cached and not addresses:
+            self.counters["negative_hits"] += 1
+        return addresses
 
-# --- Config testing ---
-async def test_config(config):
-    host, port = extract_server_from_config(config)
-    if not host or not port:
-        return {"status": "error", "message": "Cannot parse server", "latency": -1}
+    async def _lookup(self, host):
+        try:
+            addresses, ttl = await self.lookup(host)
+            return addresses, min(max(ttl, DNS_MIN_TTL), DNS_MAX_TTL)
+        except Exception:
+            self.counters["failures"] += 1
+            return [], DNS_NEGATIVE_TTL
 
-    result = {"host": host, "port": port, "tcp": False, "dns": False, "latency": -1}
+resolver = DnsResolver()
+
+# --- Config testing ---
+async def probe_endpoint(host, port):
+    result = {"host": host, "port": port, "tcp": False, "dns": False, "latency": -1, "cached": False}
 
     # DNS test
-    try:
-        loop = asyncio.get_event_loop()
-        addr = await loop.run_in_executor(None, lambda: socket.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_STREAM))
-        if addr:
-            result["dns"] = True
-    except Exception:
-        result["dns"] = False
+    addresses = await resolver.resolve(host)
+    result["dns"] = bool(addresses)
 
-    # TCP connection test
+    # TCP connection test, shared by every config on the same resolved endpoint
     if result["dns"]:
-        try:
-            start = asyncio.get_event_loop().time()
-            reader, writer = await asyncio.wait_for(
-                asyncio.open_connection(host, port), timeout=5
-            )
-            end = asyncio.get_event_loop().time()
-            result["tcp"] = True
-            result["latency"] = round((end - start) * 1000)
-            writer.close()
-            await writer.wait_closed()
-        except Exception:
-            result["tcp"] = False
+        outcome, result["cached"] = await probe_cache.probe(addresses, port)
+        result.update(outcome)
 
     if result["tcp"]:
         result["status"] = "active"
@@ -203,13 +706,1075 @@ async def test_config(config):
 
     return result
 
+async def tcp_probe(addresses, port):
+    try:
+        start = asyncio.get_event_loop().time()
+        reader, writer = await asyncio.wait_for(
+            connect_any(addresses, port), timeout=PROBE_TIMEOUT
+        )
+        end = asyncio.get_event_loop().time()
+        writer.close()
+        await writer.wait_closed()
+        return {"tcp": True, "latency": round((end - start) * 1000)}
+    except Exception:
+        return {"tcp": False, "latency": -1}
+
+async def connect_any(addresses, port):
+    error = None
+    for address in addresses:
+        try:
+            return await asyncio.open_connection(address, port)
+        except OSError as e:
+            error = e
+    raise error
+
+class ProbeCache(CoalescingTtlCache):
+    def __init__(self, max_size=PROBE_CACHE_SIZE):
+        super().__init__(max_size)
+
+    async def probe(self, addresses, port):
+        # Returns (outcome, cached); outcome is {"tcp": bool, "latency": ms}.
+        async def load():
+            outcome = await tcp_probe(addresses, port)
+            return outcome, PROBE_CACHE_ACTIVE_TTL if outcome["tcp"] else PROBE_CACHE_DEAD_TTL
+
+        outcome, cached = await self.get_or_load((addresses[0], port), load)
+        return dict(outcome), cached
+
+probe_cache = ProbeCache()
+
+# --- Probing engine ---
+class ConfigProber:
+    def __init__(self, concurrency=PROBE_CONCURRENCY, per_host_limit=PROBE_PER_HOST_LIMIT):
+        self.per_host_limit = per_host_limit
+        self.global_limit = asyncio.Semaphore(concurrency)
+        self.host_limits = {}
+        self.in_flight = 0
+
+    async def _probe_host(self, host, port):
+        # Per-host semaphores are reference counted so the map only holds hosts with probes in flight.
+        entry = self.host_limits.setdefault(host, [asyncio.Semaphore(self.per_host_limit), 0])
+        entry[1] += 1
+        try:
+            async with entry[0], self.global_limit:
+                self.in_flight += 1
+                try:
+                    return await probe_endpoint(host, port)
+                finally:
+                    self.in_flight -= 1
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.host_limits[host]
+
+    async def probe(self, config):
+        parsed = as_parsed(config)
+        if not parsed.host or not parsed.port:
+            return {"status": "error", "message": "Cannot parse server", "latency": -1}
+        return await self._probe_host(parsed.host, parsed.port)
+
+    async def probe_many(self, items, key=lambda item: item):
+        # Yields (item, result) as probes finish, so callers can act before the slowest one times out.
+        # items may be an async iterable; each item starts probing as soon as it arrives.
+        async def run(item):
+            return item, await self.probe(key(item))
+
+        finished = asyncio.Queue()
+        tasks = []
+
+        def start(item):
+            task = asyncio.create_task(run(item))
+            task.add_done_callback(finished.put_nowait)
+            tasks.append(task)
+
+        async def feed():
+            try:
+                if hasattr(items, "__aiter__"):
+                    async for item in items:
+                        start(item)
+                else:
+                    for item in items:
+                        start(item)
+            finally:
+                finished.put_nowait(None)
+
+        feeder = asyncio.create_task(feed())
+        try:
+            fed, yielded = False, 0
+            while not fed or yielded < len(tasks):
+                task = await finished.get()
+                if task is None:
+                    fed = True
+                    await feeder
+                else:
+                    yielded += 1
+                    yield task.result()
+        finally:
+            feeder.cancel()
+            for task in tasks:
+                task.cancel()
+
+prober = ConfigProber()
+
 # --- KV-like MongoDB helpers ---
-async def kv_get(key, default=None):
+# Settings read on hot paths are served from memory; each maps to the type its value must have.
+CACHED_SETTINGS = {"source_links": list, "channel_ids": list, "message_templates": dict}
+
+class KvCache(CoalescingTtlCache):
+    # While the change stream is live every write reaches us, so entries can live long; otherwise a
+    # short TTL bounds how stale another worker's write can look.
+    def __init__(self):
+        super().__init__(max_size=len(CACHED_SETTINGS))
+        self.watching = False
+
+    def ttl(self):
+        return KV_CACHE_WATCH_TTL if self.watching else KV_CACHE_TTL
+
+    def stats(self):
+        return {**super().stats(), "watching": self.watching}
+
+kv_cache = KvCache()
+
+async def kv_load(key):
     doc = await db.kv_store.find_one({"key": key}, {"_id": 0})
-    return doc["value"] if doc else default
+    return (doc["value"] if doc else None), kv_cache.ttl()
+
+async def kv_get(key, default=None):
+    kind = CACHED_SETTINGS.get(key)
+    if kind is None:
+        doc = await db.kv_store.find_one({"key": key}, {"_id": 0})
+        return doc["value"] if doc else default
+    value, _ = await kv_cache.get_or_load(key, lambda: kv_load(key))
+    if not isinstance(value, kind):
+        if value is not None:
+            logger.warning(f"Setting {key} is {type(value).__name__}, expected {kind.__name__}")
+        return default
+    # Callers edit lists in place before kv_set, so never hand out the cached object.
+    return copy.deepcopy(value)
+
+def kv_cache_store(key, value):
+    if key in CACHED_SETTINGS:
+        kv_cache.invalidate(key)
+        kv_cache.put(key, copy.deepcopy(value), kv_cache.ttl())
 
 async def kv_set(key, value):
     await db.kv_store.update_one({"key": key}, {"$set": {"key": key, "value": value}}, upsert=True)
+    kv_cache_store(key, value)
+
+async def kv_add_item(key, item):
+    # Atomic $addToSet in one round trip; the pre-image tells us whether it changed anything and what
+    # the list is now. Returns (changed, items).
+    before = await db.kv_store.find_one_and_update(
+        {"key": key}, {"$addToSet": {"value": item}}, projection={"_id": 0, "value": 1},
+        upsert=True, return_document=ReturnDocument.BEFORE)
+    items = list((before or {}).get("value") or [])
+    changed = item not in items
+    if changed:
+        items.append(item)
+    kv_cache_store(key, items)
+    return changed, items
+
+async def kv_remove_item(key, item):
+    before = await db.kv_store.find_one_and_update(
+        {"key": key}, {"$pull": {"value": item}}, projection={"_id": 0, "value": 1},
+        return_document=ReturnDocument.BEFORE)
+    items = list((before or {}).get("value") or [])
+    changed = item in items
+    items = [i for i in items if i != item]
+    kv_cache_store(key, items)
+    return changed, items
+
+async def watch_kv_changes():
+    # Keeps every worker's kv_cache coherent with writes made elsewhere. Standalone servers have no
+    # change streams; we then stay on the short TTL.
+    while True:
+        try:
+            async with db.kv_store.watch(full_document="updateLookup") as stream:
+                kv_cache.clear()
+                kv_cache.watching = True
+                async for change in stream:
+                    doc = change.get("fullDocument")
+                    if doc is None:
+                        kv_cache.clear()
+                    elif doc.get("key") in CACHED_SETTINGS:
+                        kv_cache.invalidate(doc["key"])
+                        kv_cache.put(doc["key"], doc.get("value"), kv_cache.ttl())
+        except OperationFailure as e:
+            if e.code == 40573:
+                logger.info("Change streams unavailable, settings cache falls back to TTL")
+                return
+            logger.warning(f"Settings change stream failed: {e}")
+        except Exception as e:
+            logger.warning(f"Settings change stream failed: {e}")
+        finally:
+            kv_cache.watching = False
+        await asyncio.sleep(KV_WATCH_RETRY)
+
+# --- Seen-config index ---
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, digest):
+        # Digests are already uniform, so derive all probes from two 64-bit halves (double hashing).
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, digest):
+        for pos in self._positions(digest):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, digest):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(digest))
+
+class SeenConfigIndex:
+    def __init__(self, collection):
+        self.collection = collection
+        self.bloom = BloomFilter(SEEN_BLOOM_CAPACITY, SEEN_BLOOM_ERROR_RATE) if SEEN_BLOOM_ENABLED else None
+        self.bloom_ready = False
+        self.stats = {"checked": 0, "bloom_new": 0, "mongo_lookups": 0}
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("h", unique=True)
+        await self.collection.create_index("seen_at", expireAfterSeconds=SEEN_TTL_DAYS * 86400)
+
+    async def warm(self):
+        if self.bloom is None:
+            return
+        async for doc in self.collection.find({}, {"_id": 0, "h": 1}):
+            self.bloom.add(doc["h"])
+        self.bloom_ready = True
+        logger.info("Seen-config bloom filter warmed")
+
+    async def count(self):
+        return await self.collection.estimated_document_count()
+
+    async def filter_new(self, digests):
+        # Returns the subset of digests never seen before and records all of them as seen.
+        new = set()
+        for i in range(0, len(digests), SEEN_BATCH_SIZE):
+            new |= await self._filter_batch(list(dict.fromkeys(digests[i:i + SEEN_BATCH_SIZE])))
+        return new
+
+    async def _filter_batch(self, batch):
+        now = datetime.now(timezone.utc)
+        self.stats["checked"] += len(batch)
+        if self.bloom_ready:
+            maybe_seen = [d for d in batch if d in self.bloom]
+            self.stats["bloom_new"] += len(batch) - len(maybe_seen)
+        else:
+            maybe_seen = batch
+        seen = set()
+        if maybe_seen:
+            self.stats["mongo_lookups"] += 1
+            docs = await self.collection.find({"h": {"$in": maybe_seen}}, {"_id": 0, "h": 1}).to_list(None)
+            seen = {doc["h"] for doc in docs}
+            if seen:
+                await self.collection.update_many({"h": {"$in": list(seen)}}, {"$set": {"seen_at": now}})
+        candidates = [d for d in batch if d not in seen]
+        if candidates:
+            try:
+                await self.collection.insert_many([{"h": d, "seen_at": now} for d in candidates], ordered=False)
+            except BulkWriteError as e:
+                # Another run or worker recorded these first; the unique index is authoritative.
+                seen |= {candidates[err["index"]] for err in e.details.get("writeErrors", []) if err.get("code") == 11000}
+        if self.bloom is not None:
+            for d in batch:
+                self.bloom.add(d)
+        return {d for d in candidates if d not in seen}
+
+seen_index = SeenConfigIndex(db.seen_configs)
+
+# --- Indexes ---
+# collection -> [(keys, options)]; create_index is a no-op for an index that already exists.
+INDEX_SPECS = {
+    "kv_store": [("key", {"unique": True})],
+    "configs": [
+        ("hash", {"unique": True}),
+        # Keyset pagination order for /dashboard/configs, optionally after an equality filter; latency
+        # sits after the sort keys so a range on it is checked inside the index.
+        ([("created_at", -1), ("hash", -1)], {}),
+        ([("type", 1), ("created_at", -1), ("hash", -1)], {}),
+        ([("test_result.status", 1), ("created_at", -1), ("hash", -1), ("test_result.latency", 1)], {}),
+        # Re-test queue: most overdue first, overall and per probe-worker shard.
+        ([("next_test_at", 1), ("popularity", -1)], {}),
+        ([("shard", 1), ("next_test_at", 1), ("popularity", -1)], {}),
+        ([("rollup.p50", 1), ("hash", 1)], {}),
+        ([("rollup.uptime_24h", -1), ("hash", -1)], {}),
+        # Hashes posted in copy/share buttons before configs were hashed by identity.
+        ("legacy_hashes", {}),
+    ],
+    "probe_history": [
+        ([("hash", 1), ("day", -1)], {}),
+        ("expire_at", {"expireAfterSeconds": 0}),
+    ],
+    "probe_workers": [("expires_at", {})],
+    "leases": [("owner", {})],
+    "submissions": [
+        ([("status", 1), ("created_at", -1)], {}),
+        ([("config", 1), ("status", 1)], {}),
+    ],
+    "source_state": [("url", {"unique": True})],
+    "fetch_runs": [
+        ("job_id", {"unique": True}),
+        ([("started_at", -1)], {}),
+        # At most one running fetch across all workers; a second trigger hits this and attaches instead.
+        ("lock", {"unique": True, "partialFilterExpression": {"status": "running"}}),
+    ],
+}
+
+# Superseded by the compound indexes above, of which they are prefixes.
+OBSOLETE_INDEXES = {"configs": ["created_at_-1", "test_result.status_1"]}
+
+# (collection, filter, sort) for every query server.py issues, checked by explain_queries().
+QUERY_SHAPES = [
+    ("kv_store", {"key": "source_links"}, None),
+    ("configs", {"hash": "h"}, None),
+    ("configs", {"hash": {"$in": ["h"]}}, None),
+    ("configs", {"$or": [{"hash": "h"}, {"legacy_hashes": "h"}]}, None),
+    ("configs", {}, [("created_at", -1)]),
+    ("configs", {"test_result.status": "active"}, None),
+    ("configs", {"created_at": {"$lt": "t"}}, [("created_at", -1), ("hash", -1)]),
+    ("configs", {"type": "vless"}, [("created_at", -1), ("hash", -1)]),
+    ("configs", {"next_test_at": {"$lte": "t"}}, [("next_test_at", 1), ("popularity", -1)]),
+    ("configs", {"shard": {"$in": [1, 2]}, "next_test_at": {"$lte": "t"}}, [("next_test_at", 1), ("popularity", -1)]),
+    ("configs", {"rollup.p50": {"$gte": 0}}, [("rollup.p50", 1), ("hash", 1)]),
+    ("configs", {"rollup.uptime_24h": {"$gte": 0}}, [("rollup.uptime_24h", -1), ("hash", -1)]),
+    ("configs", {"next_test_at": {"$exists": False}}, None),
+    ("configs", {"shard": {"$exists": False}}, None),
+    ("configs", {"legacy_hashes": {"$exists": False}}, None),
+    ("probe_history", {"hash": "h"}, [("day", -1)]),
+    ("probe_workers", {"expires_at": {"$gt": "t"}}, None),
+    ("leases", {"owner": "w"}, None),
+    ("configs", {"test_result.status": "active", "test_result.latency": {"$lte": 100}},
+     [("created_at", -1), ("hash", -1)]),
+    ("submissions", {"status": "pending"}, None),
+    ("submissions", {"status": "pending"}, [("created_at", -1)]),
+    ("submissions", {"config": "c", "status": "pending"}, None),
+    ("source_state", {"url": {"$in": ["u"]}}, None),
+    ("fetch_runs", {"job_id": "j"}, None),
+    ("fetch_runs", {"lock": "fetch", "status": "running"}, None),
+    ("fetch_runs", {}, [("started_at", -1)]),
+    ("seen_configs", {"h": {"$in": [b"h"]}}, None),
+]
+
+async def ensure_indexes():
+    await seen_index.ensure_indexes()
+    for name, specs in INDEX_SPECS.items():
+        for keys, options in specs:
+            try:
+                await db[name].create_index(keys, **options)
+            except OperationFailure as e:
+                # Duplicate data or an existing index with other options; the app still works without it.
+                logger.error(f"Could not create index {keys} on {name}: {e}")
+    for name, index_names in OBSOLETE_INDEXES.items():
+        for index_name in index_names:
+            try:
+                await db[name].drop_index(index_name)
+            except OperationFailure:
+                pass
+
+def plan_stages(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from plan_stages(value)
+
+async def explain_queries(database=None):
+    # Returns [(collection, filter, sort)] for every query shape whose winning plan scans the collection.
+    database = db if database is None else database
+    scans = []
+    for name, query, sort in QUERY_SHAPES:
+        cursor = database[name].find(query).limit(50)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = await cursor.explain()
+        if "COLLSCAN" in plan_stages(plan["queryPlanner"]["winningPlan"]):
+            scans.append((name, query, sort))
+    return scans
+
+# --- Stats ---
+class StatsCounters:
+    # Counters live in one stats document and are $inc'ed by the code that writes configs and submissions,
+    # so reading them costs one small find regardless of collection size. reconcile() recounts everything
+    # with a $facet aggregation to repair drift; snapshot() is what the dashboard polls.
+    def __init__(self):
+        self.cache = CoalescingTtlCache(max_size=1)
+
+    async def _inc(self, inc):
+        if inc:
+            await db.stats.update_one({"_id": "counters"}, {"$inc": inc}, upsert=True)
+
+    async def config_written(self, before, status, config_type):
+        await self.configs_written([(before, status, config_type)])
+
+    async def configs_written(self, changes):
+        # changes are (before, status, type); before is the pre-image of the config document, None when
+        # the write inserted it.
+        # configs_version tells subscription caches on every worker that the config set moved.
+        inc = Counter({"configs_version": len(changes)})
+        for before, status, config_type in changes:
+            was_active = bool(before) and before.get("test_result", {}).get("status") == "active"
+            if not before:
+                inc["configs_total"] += 1
+                inc[f"types.{config_type}"] += 1
+            if was_active != (status == "active"):
+                inc["configs_active"] += -1 if was_active else 1
+        await self._inc({k: v for k, v in inc.items() if v})
+        # Writes made by this worker show up in its subscriptions without waiting for the next check.
+        subscriptions.version_check.clear()
+
+    async def configs_deleted(self, docs):
+        inc = Counter({"configs_version": len(docs)})
+        for doc in docs:
+            inc["configs_total"] -= 1
+            inc[f"types.{doc.get('type')}"] -= 1
+            if doc.get("test_result", {}).get("status") == "active":
+                inc["configs_active"] -= 1
+        await self._inc({k: v for k, v in inc.items() if v})
+        subscriptions.version_check.clear()
+
+    async def submissions_added(self, count):
+        await self._inc({"submissions_pending": count} if count else {})
+
+    async def submissions_resolved(self, count):
+        await self._inc({"submissions_pending": -count} if count else {})
+
+    async def reconcile(self):
+        counters = await self._recount()
+        self.cache.clear()
+        return counters
+
+    async def _recount(self):
+        facets = await db.configs.aggregate([{"$facet": {
+            "total": [{"$count": "n"}],
+            "active": [{"$match": {"test_result.status": "active"}}, {"$count": "n"}],
+            "types": [{"$group": {"_id": "$type", "n": {"$sum": 1}}}],
+        }}]).to_list(1)
+        facet = facets[0] if facets else {}
+        counters = {
+            "configs_total": facet["total"][0]["n"] if facet.get("total") else 0,
+            "configs_active": facet["active"][0]["n"] if facet.get("active") else 0,
+            "types": {t["_id"]: t["n"] for t in facet.get("types", []) if t["_id"]},
+            "submissions_pending": await db.submissions.count_documents({"status": "pending"}),
+            "reconciled_at": datetime.now(timezone.utc).isoformat(),
+        }
+        await db.stats.update_one({"_id": "counters"}, {"$set": counters}, upsert=True)
+        return counters
+
+    async def snapshot(self):
+        async def load():
+            counters = await db.stats.find_one({"_id": "counters"}, {"_id": 0})
+            if counters is None or "reconciled_at" not in counters:
+                counters = await self._recount()
+            links = await kv_get("source_links", [])
+            channels = await kv_get("channel_ids", [])
+            snapshot = {
+                "total_configs": counters.get("configs_total", 0),
+                "active_configs": counters.get("configs_active", 0),
+                "configs_by_type": counters.get("types", {}),
+                "pending_submissions": counters.get("submissions_pending", 0),
+                "source_links": len(links),
+                "channels": len(channels),
+                "cache_size": await seen_index.count(),
+                "reconciled_at": counters.get("reconciled_at"),
+                "as_of": datetime.now(timezone.utc).isoformat(),
+            }
+            return snapshot, STATS_SNAPSHOT_TTL
+
+        snapshot, _ = await self.cache.get_or_load("snapshot", load)
+        return dict(snapshot)
+
+    async def run(self):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f"Stats reconciliation failed: {e}")
+            await asyncio.sleep(STATS_RECONCILE_SECONDS)
+
+stats_counters = StatsCounters()
+
+async def upsert_config(parsed, test_result):
+    now = datetime.now(timezone.utc)
+    before, _ = await asyncio.gather(db.configs.find_one_and_update(
+        {"hash": parsed.hash}, config_update(parsed, test_result, now),
+        projection={"_id": 0, "test_result.status": 1, "history": 1}, upsert=True,
+        return_document=ReturnDocument.BEFORE), record_probes([history_bucket_op(parsed.hash, test_result, now)]))
+    history = apply_history((before or {}).get("history"), test_result, now)
+    await write_rollups([rollup_update(parsed.hash, history, now)])
+    await stats_counters.config_written(before, test_result.get("status"), parsed.type)
+
+async def resolve_submission(query, status):
+    result = await db.submissions.update_one({**query, "status": "pending"}, {"$set": {"status": status}})
+    await stats_counters.submissions_resolved(result.modified_count)
+
+# --- Write batching ---
+class WriteBatcher:
+    # Buffers writes for one collection and sends them as a single unordered bulk_write once
+    # WRITE_BATCH_SIZE ops are queued or WRITE_BATCH_DELAY has passed since the first one. add() returns
+    # a future per op resolving to {"ok", "upserted", "error"}, so one bad document fails alone.
+    def __init__(self, collection, max_size=None, max_delay=None):
+        self.collection = collection
+        self.max_size = max_size or WRITE_BATCH_SIZE
+        self.max_delay = WRITE_BATCH_DELAY if max_delay is None else max_delay
+        self.pending = []
+        self.timer = None
+        self.flushes = set()
+        self.counters = {"batches": 0, "ops": 0, "errors": 0}
+
+    def stats(self):
+        return {**self.counters, "pending": len(self.pending)}
+
+    def add(self, op, meta=None):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((op, meta, future))
+        if len(self.pending) >= self.max_size:
+            self._spawn(self._send(self._take()))
+        elif self.timer is None:
+            self.timer = asyncio.create_task(self._flush_later())
+        return future
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.flushes.add(task)
+        task.add_done_callback(self.flushes.discard)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.max_delay)
+        await self.flush()
+
+    def _take(self):
+        if self.timer is not None and self.timer is not asyncio.current_task():
+            self.timer.cancel()
+        self.timer = None
+        entries, self.pending = self.pending, []
+        return entries
+
+    async def flush(self):
+        await self._send(self._take())
+
+    async def _send(self, entries):
+        if not entries:
+            return
+        try:
+            results = await self._write(entries)
+        except Exception as e:
+            logger.error(f"Bulk write to {self.collection} failed: {e}")
+            results = [{"ok": False, "upserted": False, "error": str(e) or type(e).__name__} for _ in entries]
+        self.counters["batches"] += 1
+        self.counters["ops"] += len(entries)
+        self.counters["errors"] += sum(1 for r in results if not r["ok"])
+        for (_, _, future), result in zip(entries, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _write(self, entries):
+        results = [{"ok": True, "upserted": False, "error": None} for _ in entries]
+        try:
+            response = await db[self.collection].bulk_write([op for op, _, _ in entries], ordered=False)
+            upserted = response.upserted_ids or {}
+        except BulkWriteError as e:
+            upserted = {u["index"]: u["_id"] for u in e.details.get("upserted", [])}
+            for error in e.details.get("writeErrors", []):
+                results[error["index"]].update(ok=False, error=error.get("errmsg") or f"code {error.get('code')}")
+        for index in upserted:
+            results[index]["upserted"] = True
+        return results
+
+    async def aclose(self):
+        await self.flush()
+        await asyncio.gather(*list(self.flushes), return_exceptions=True)
+
+class ConfigWriteBatcher(WriteBatcher):
+    # Bulk upserts can't return pre-images, so each batch reads the previous status and probe history of
+    # its hashes in one query; that keeps the stats counters exact and gives the rollups their base.
+    def __init__(self, **kwargs):
+        super().__init__("configs", **kwargs)
+
+    def add_config(self, parsed, test_result):
+        return self.add(None, (parsed, test_result))
+
+    async def _write(self, entries):
+        now = datetime.now(timezone.utc)
+        before = {doc["hash"]: doc async for doc in db.configs.find(
+            {"hash": {"$in": [parsed.hash for _, (parsed, _), _ in entries]}},
+            {"_id": 0, "hash": 1, "test_result.status": 1, "history": 1})}
+        entries = [(UpdateOne({"hash": parsed.hash}, config_update(parsed, test_result, now), upsert=True),
+                    (parsed, test_result), future) for _, (parsed, test_result), future in entries]
+        results, _ = await asyncio.gather(super()._write(entries), record_probes(
+            [history_bucket_op(parsed.hash, test_result, now) for _, (parsed, test_result), _ in entries]))
+        await write_rollups([
+            rollup_update(parsed.hash, apply_history(before.get(parsed.hash, {}).get("history"), test_result, now), now)
+            for (_, (parsed, test_result), _), result in zip(entries, results) if result["ok"]])
+        await stats_counters.configs_written([
+            (None if result["upserted"] else before.get(parsed.hash, {}), test_result.get("status"), parsed.type)
+            for (_, (parsed, test_result), _), result in zip(entries, results) if result["ok"]])
+        return results
+
+config_writes = ConfigWriteBatcher()
+submission_writes = WriteBatcher("submissions")
+
+async def submit_configs(configs, chat_id, username):
+    # Queues one pending submission per (config, type) and returns how many were stored.
+    now = datetime.now(timezone.utc).isoformat()
+    results = await asyncio.gather(*(submission_writes.add(InsertOne({
+        "config": cfg, "type": cfg_type, "submitted_by": chat_id, "username": username,
+        "status": "pending", "created_at": now,
+    })) for cfg, cfg_type in configs))
+    for (cfg, _), result in zip(configs, results):
+        if not result["ok"]:
+            logger.error(f"Could not store submission {cfg[:60]}: {result['error']}")
+    stored = sum(1 for result in results if result["ok"])
+    await stats_counters.submissions_added(stored)
+    return stored
+
+# --- Subscription ---
+class SubscriptionCache:
+    # Active configs are held in memory, most reliable first (24h uptime, then typical latency), and each
+    # (type, max_latency, min_uptime, limit) body is
+    # built once with its gzip and ETag. Requests only touch Mongo when the configs_version counter is
+    # re-read (at most every SUB_CHECK_SECONDS) and shows the set changed.
+    def __init__(self):
+        self.version = None
+        self.configs = []
+        self.blobs = OrderedDict()
+        self.version_check = CoalescingTtlCache(max_size=1)
+        self.reload_lock = asyncio.Lock()
+        self.counters = {"requests": 0, "not_modified": 0, "rebuilds": 0, "reloads": 0}
+
+    def stats(self):
+        return {**self.counters, "configs": len(self.configs), "blobs": len(self.blobs), "version": self.version}
+
+    async def _current_version(self):
+        async def load():
+            doc = await db.stats.find_one({"_id": "counters"}, {"_id": 0, "configs_version": 1})
+            return (doc or {}).get("configs_version", 0), SUB_CHECK_SECONDS
+
+        version, _ = await self.version_check.get_or_load("version", load)
+        return version
+
+    async def _ensure_fresh(self):
+        version = await self._current_version()
+        if version == self.version:
+            return
+        async with self.reload_lock:
+            if version == self.version:
+                return
+            docs = await db.configs.find({"test_result.status": "active"}, {
+                "_id": 0, "config": 1, "type": 1, "test_result.latency": 1, "rollup.p50": 1, "rollup.uptime_24h": 1,
+            }).to_list(None)
+            self.configs = sorted(
+                ((d["config"], d.get("type"), d.get("test_result", {}).get("latency", -1),
+                  d.get("rollup", {}).get("uptime_24h"), d.get("rollup", {}).get("p50", -1)) for d in docs),
+                # Configs stored before probe history existed count as a single good sample.
+                key=lambda c: (-(100 if c[3] is None else c[3]),
+                               c[4] if c[4] >= 0 else c[2] if c[2] >= 0 else float("inf")))
+            self.blobs.clear()
+            self.version = version
+            self.counters["reloads"] += 1
+
+    async def get(self, config_type=None, max_latency=None, limit=SUB_MAX_LIMIT, min_uptime=None):
+        # Returns {"etag", "body", "gzip", "count"} for the filtered subscription.
+        self.counters["requests"] += 1
+        await self._ensure_fresh()
+        key = (config_type, max_latency, min_uptime, limit)
+        blob = self.blobs.get(key)
+        if blob is None:
+            selected = [config for config, kind, latency, uptime, _ in self.configs
+                        if (not config_type or kind == config_type)
+                        and (max_latency is None or 0 <= latency <= max_latency)
+                        and (min_uptime is None or (100 if uptime is None else uptime) >= min_uptime)][:limit]
+            body = base64.b64encode("\n".join(selected).encode())
+            blob = {"etag": f'"{hashlib.md5(body).hexdigest()}"', "body": body,
+                    "gzip": gzip.compress(body, compresslevel=9), "count": len(selected)}
+            self.blobs[key] = blob
+            while len(self.blobs) > SUB_BLOB_CACHE_SIZE:
+                self.blobs.popitem(last=False)
+            self.counters["rebuilds"] += 1
+        self.blobs.move_to_end(key)
+        return blob
+
+subscriptions = SubscriptionCache()
+
+# --- Probe history ---
+# Every probe lands twice: as a sample in a per-config, per-day bucket in db.probe_history (kept
+# PROBE_HISTORY_DAYS), and in the compact history on the config document: the last PROBE_HISTORY_SAMPLES
+# latencies (-1 for a failure) and probe/ok counters per hour since the epoch. Both are changed with
+# atomic $push/$slice and $inc, so concurrent writers never drop samples. The rollups derived from the
+# history are then set by a second write that only applies while history.count is still the one they were
+# computed for; if another probe landed in between, its own rollup write covers both.
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)] if ordered else -1
+
+def uptime_percent(ok, total):
+    return round(100 * ok / total, 1) if total else None
+
+def probe_sample(test_result):
+    ok = test_result.get("status") == "active"
+    return ok, test_result.get("latency", -1) if ok else -1
+
+def hour_index(now):
+    return int(now.timestamp() // 3600)
+
+def history_update(test_result, now):
+    ok, latency = probe_sample(test_result)
+    hour = hour_index(now)
+    return {
+        "$push": {"history.latencies": {"$each": [latency], "$slice": -PROBE_HISTORY_SAMPLES}},
+        "$inc": {"history.count": 1, f"history.probes.{hour}": 1, f"history.ok.{hour}": int(ok)},
+    }
+
+def apply_history(history, test_result, now):
+    # What history_update turns the given pre-image into.
+    history = copy.deepcopy(history or {})
+    ok, latency = probe_sample(test_result)
+    hour = str(hour_index(now))
+    history["latencies"] = (history.get("latencies", []) + [latency])[-PROBE_HISTORY_SAMPLES:]
+    history["count"] = history.get("count", 0) + 1
+    for kind, inc in (("probes", 1), ("ok", int(ok))):
+        counts = history.setdefault(kind, {})
+        counts[hour] = counts.get(hour, 0) + inc
+    return history
+
+def compute_rollup(history, now):
+    # Returns (rollup, expired hours). Uptime windows are whole clock hours: 1h covers the current and
+    # previous hour, 24h the last 24 and 7d the last 168.
+    hour = hour_index(now)
+    probes, ok = history.get("probes", {}), history.get("ok", {})
+
+    def uptime(hours):
+        window = [h for h in probes if hour - int(h) < hours]
+        return uptime_percent(sum(ok.get(h, 0) for h in window), sum(probes[h] for h in window))
+
+    latencies = [latency for latency in history.get("latencies", []) if latency >= 0]
+    rollup = {
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "uptime_1h": uptime(2),
+        "uptime_24h": uptime(24),
+        "uptime_7d": uptime(168),
+        "samples": len(history.get("latencies", [])),
+    }
+    return rollup, [h for h in probes if hour - int(h) >= 168]
+
+def rollup_update(config_hash, history, now):
+    # (filter, update) setting the rollup for history, as it stands right after this writer's probe.
+    rollup, expired = compute_rollup(history, now)
+    update = {"$set": {"rollup": rollup}}
+    if expired:
+        update["$unset"] = {f"history.{kind}.{h}": "" for h in expired for kind in ("probes", "ok")}
+    return {"hash": config_hash, "history.count": history["count"]}, update
+
+async def write_rollups(updates):
+    if updates:
+        await db.configs.bulk_write([UpdateOne(query, update) for query, update in updates], ordered=False)
+
+def history_bucket_op(config_hash, test_result, now):
+    ok, latency = probe_sample(test_result)
+    day = now.date().isoformat()
+    return UpdateOne({"_id": f"{config_hash}:{day}"}, {
+        "$setOnInsert": {"hash": config_hash, "day": day, "expire_at": now + timedelta(days=PROBE_HISTORY_DAYS)},
+        "$push": {"samples": [now.isoformat(), latency]},
+        "$inc": {"count": 1, "ok": int(ok)},
+    }, upsert=True)
+
+async def record_probes(ops):
+    if not ops:
+        return
+    try:
+        await db.probe_history.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        logger.error(f"Could not record {len(e.details.get('writeErrors', []))} probe samples")
+
+# --- Re-testing ---
+def next_test_time(now, failures, popularity=0):
+    # Healthy configs come back sooner the more they are used; failing ones back off exponentially.
+    if failures:
+        delay = min(RETEST_INTERVAL * 2 ** (failures - 1), RETEST_MAX_BACKOFF)
+    else:
+        delay = RETEST_INTERVAL / (1 + math.log2(1 + max(popularity, 0)))
+    return (now + timedelta(seconds=delay)).isoformat()
+
+async def acquire_lease(name, owner, seconds):
+    # Returns True while owner holds the named lease; it is taken over once the holder lets it expire.
+    now = datetime.now(timezone.utc)
+    try:
+        await db.leases.find_one_and_update(
+            {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lt": now.isoformat()}}]},
+            {"$set": {"owner": owner, "expires_at": (now + timedelta(seconds=seconds)).isoformat()}},
+            upsert=True)
+        return True
+    except DuplicateKeyError:
+        return False
+
+class RetestScheduler:
+    # Keeps stored test results fresh within a probe budget. Configs form a priority queue on next_test_at
+    # (see next_test_time); each tick probes the most overdue ones, writes the results in one bulk_write and
+    # deletes configs that failed RETEST_MAX_FAILURES times in a row. Only the lease holder runs ticks.
+    PROJECTION = {"_id": 0, "config": 1, "hash": 1, "type": 1, "test_result.status": 1, "failures": 1, "popularity": 1,
+                  "history": 1}
+
+    def __init__(self):
+        self.counters = {"ticks": 0, "probed": 0, "recovered": 0, "failed": 0, "expired": 0}
+
+    def stats(self):
+        return {**self.counters, "per_minute": RETEST_PER_MINUTE}
+
+    def batch_size(self):
+        return max(1, math.ceil(RETEST_PER_MINUTE * RETEST_TICK_SECONDS / 60))
+
+    async def tick(self, query=None, limit=None):
+        now = datetime.now(timezone.utc)
+        query = {**(query or {}), "next_test_at": {"$lte": now.isoformat()}}
+        docs = await db.configs.find(query, self.PROJECTION).sort(
+            [("next_test_at", 1), ("popularity", -1)]).limit(limit or self.batch_size()).to_list(None)
+        if not docs:
+            return 0
+        results = await asyncio.gather(*(prober.probe(ParsedConfig(d["config"], d.get("type"))) for d in docs))
+        ops, changed, expired, rollups = [], [], [], []
+        for doc, result in zip(docs, results):
+            active = result.get("status") == "active"
+            failures = 0 if active else doc.get("failures", 0) + 1
+            if failures >= RETEST_MAX_FAILURES:
+                ops.append(DeleteOne({"hash": doc["hash"]}))
+                expired.append(doc)
+                continue
+            ops.append(UpdateOne({"hash": doc["hash"]}, {"$set": {
+                "test_result": result, "tested_at": now.isoformat(), "failures": failures,
+                "next_test_at": next_test_time(now, failures, doc.get("popularity", 0)),
+            }, **history_update(result, now)}))
+            rollups.append(rollup_update(doc["hash"], apply_history(doc.get("history"), result, now), now))
+            changed.append((doc, result.get("status"), doc.get("type")))
+            if active and doc.get("failures"):
+                self.counters["recovered"] += 1
+        async def write_configs():
+            try:
+                await db.configs.bulk_write(ops, ordered=False)
+            except BulkWriteError as e:
+                logger.error(f"Re-test write failed for {len(e.details.get('writeErrors', []))} configs")
+
+        await asyncio.gather(write_configs(), record_probes(
+            [history_bucket_op(doc["hash"], result, now) for doc, result in zip(docs, results)]))
+        await write_rollups(rollups)
+        await stats_counters.configs_written(changed)
+        if expired:
+            await stats_counters.configs_deleted(expired)
+        self.counters["ticks"] += 1
+        self.counters["probed"] += len(docs)
+        self.counters["failed"] += sum(1 for r in results if r.get("status") != "active")
+        self.counters["expired"] += len(expired)
+        return len(docs)
+
+    async def backfill(self):
+        # Configs stored before re-testing existed have no next_test_at; "" sorts first, so they go next.
+        await db.configs.update_many({"next_test_at": {"$exists": False}}, {"$set": {"next_test_at": ""}})
+
+    async def run(self):
+        await self.backfill()
+        while True:
+            try:
+                # Once standalone probe workers are running they own the queue.
+                if not await live_probe_workers() and await acquire_lease("retest", WORKER_ID, RETEST_LEASE_SECONDS):
+                    await self.tick()
+            except Exception as e:
+                logger.error(f"Re-test tick failed: {e}")
+            await asyncio.sleep(RETEST_TICK_SECONDS)
+
+retester = RetestScheduler()
+
+# --- Probe workers ---
+def ring_position(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+def shard_of(host, port):
+    return ring_position(f"{(host or '').lower()}:{port or 0}") % PROBE_SHARDS
+
+def shard_lease(shard):
+    return f"probe-shard:{shard}"
+
+class HashRing:
+    # Consistent-hash ring of worker ids, each placed PROBE_RING_REPLICAS times; a key belongs to the first
+    # point clockwise from it, so adding or removing a worker only moves the keys next to its points.
+    def __init__(self, nodes, replicas=None):
+        self.points = sorted((ring_position(f"{node}#{i}"), node)
+                             for node in nodes for i in range(replicas or PROBE_RING_REPLICAS))
+        self.positions = [position for position, _ in self.points]
+
+    def owner(self, key):
+        if not self.points:
+            return None
+        return self.points[bisect.bisect(self.positions, ring_position(key)) % len(self.points)][1]
+
+async def live_probe_workers():
+    now = datetime.now(timezone.utc).isoformat()
+    return [doc["_id"] async for doc in db.probe_workers.find({"expires_at": {"$gt": now}}, {"_id": 1})]
+
+class ProbeWorker(RetestScheduler):
+    # One of any number of processes sharing the re-test queue (run with probe_worker.py). Configs hash by
+    # host:port into PROBE_SHARDS fixed shards, and the shards are spread over the live workers on a
+    # HashRing. A worker probes a shard only while it holds that shard's lease in db.leases; a worker that
+    # dies stops renewing its heartbeat and leases, and once they expire its shards pass to the survivors.
+    def __init__(self, worker_id=None, batch_size=None):
+        super().__init__()
+        self.worker_id = worker_id or WORKER_ID
+        self.batch = batch_size or PROBE_WORKER_BATCH
+        self.shards = set()
+        self.counters.update(rebalances=0)
+
+    def stats(self):
+        return {**self.counters, "worker_id": self.worker_id, "shards": len(self.shards)}
+
+    async def heartbeat(self):
+        expires_at = (datetime.now(timezone.utc) + timedelta(seconds=PROBE_LEASE_SECONDS)).isoformat()
+        await db.probe_workers.update_one({"_id": self.worker_id}, {"$set": {
+            "expires_at": expires_at, "host": socket.gethostname(), "pid": os.getpid(), **self.counters,
+        }}, upsert=True)
+
+    async def rebalance(self):
+        await self.heartbeat()
+        ring = HashRing(await live_probe_workers())
+        wanted = sorted(s for s in range(PROBE_SHARDS) if ring.owner(shard_lease(s)) == self.worker_id)
+        released = self.shards - set(wanted)
+        if released:
+            await db.leases.delete_many({"_id": {"$in": [shard_lease(s) for s in released]}, "owner": self.worker_id})
+        held = await asyncio.gather(*(acquire_lease(shard_lease(s), self.worker_id, PROBE_LEASE_SECONDS) for s in wanted))
+        shards = {s for s, ok in zip(wanted, held) if ok}
+        if shards != self.shards:
+            self.counters["rebalances"] += 1
+        self.shards = shards
+
+    async def renew(self):
+        expires_at = (datetime.now(timezone.utc) + timedelta(seconds=PROBE_LEASE_SECONDS)).isoformat()
+        await asyncio.gather(self.heartbeat(), db.leases.update_many(
+            {"_id": {"$in": [shard_lease(s) for s in self.shards]}, "owner": self.worker_id},
+            {"$set": {"expires_at": expires_at}}))
+
+    async def keepalive(self):
+        # A batch of slow probes can outlast the leases; keep them and the heartbeat fresh meanwhile.
+        while True:
+            await asyncio.sleep(PROBE_LEASE_SECONDS / 3)
+            try:
+                await self.renew()
+            except Exception as e:
+                logger.warning(f"Probe worker lease renewal failed: {e}")
+
+    async def step(self):
+        # Renews the heartbeat and leases, then probes one batch from the shards held.
+        await self.rebalance()
+        if not self.shards:
+            return 0
+        keepalive = asyncio.create_task(self.keepalive())
+        try:
+            return await self.tick({"shard": {"$in": sorted(self.shards)}}, self.batch)
+        finally:
+            keepalive.cancel()
+
+    async def backfill(self):
+        # Configs stored before sharding have no shard; one worker assigns them.
+        if not await acquire_lease("probe-backfill", self.worker_id, PROBE_LEASE_SECONDS):
+            return
+        await super().backfill()
+        ops = []
+        async for doc in db.configs.find({"shard": {"$exists": False}}, {"_id": 0, "hash": 1, "config": 1, "type": 1}):
+            parsed = ParsedConfig(doc["config"], doc.get("type"))
+            ops.append(UpdateOne({"hash": doc["hash"]}, {"$set": {"shard": shard_of(parsed.host, parsed.port)}}))
+            if len(ops) >= WRITE_BATCH_SIZE:
+                await db.configs.bulk_write(ops, ordered=False)
+                ops = []
+        if ops:
+            await db.configs.bulk_write(ops, ordered=False)
+
+    async def run(self):
+        await self.backfill()
+        while True:
+            try:
+                probed = await self.step()
+            except Exception as e:
+                logger.error(f"Probe worker step failed: {e}")
+                probed = 0
+            if probed < self.batch:
+                await asyncio.sleep(PROBE_WORKER_IDLE)
+
+    async def stop(self):
+        # Hands the shards over right away instead of waiting for the leases to expire.
+        await db.leases.delete_many({"owner": self.worker_id})
+        await db.probe_workers.delete_one({"_id": self.worker_id})
+        self.shards = set()
+
+# --- Migrations ---
+async def run_migration(name, migrate):
+    # Runs migrate() once per database; the lease keeps workers starting together from running it twice.
+    if await db.migrations.find_one({"_id": name}):
+        return
+    if not await acquire_lease(f"migration:{name}", WORKER_ID, 3600):
+        return
+    started = time.monotonic()
+    result = await migrate()
+    await db.migrations.insert_one({"_id": name, "result": result,
+                                    "finished_at": datetime.now(timezone.utc).isoformat()})
+    logger.info(f"Migration {name} done in {time.monotonic() - started:.1f}s: {result}")
+
+async def rehash_configs():
+    # Configs stored before identity hashing carry md5(raw URI) as their hash. Each gets its identity hash
+    # and keeps the old one in legacy_hashes, which copy/share buttons already posted still resolve
+    # through. Configs that turn out to share an identity are merged into the first one stored.
+    counts = {"rehashed": 0, "merged": 0}
+
+    async def write(batch):
+        ops = [UpdateOne({"_id": _id}, {"$set": {"hash": new}, "$addToSet": {"legacy_hashes": old}})
+               for _id, old, new in batch]
+        duplicates = []
+        try:
+            await db.configs.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            duplicates = [batch[err["index"]] for err in e.details.get("writeErrors", []) if err.get("code") == 11000]
+        if duplicates:
+            await db.configs.bulk_write([op for _id, old, new in duplicates for op in (
+                UpdateOne({"hash": new}, {"$addToSet": {"legacy_hashes": old}}), DeleteOne({"_id": _id}))])
+        counts["rehashed"] += len(batch) - len(duplicates)
+        counts["merged"] += len(duplicates)
+
+    batch = []
+    async for doc in db.configs.find({"legacy_hashes": {"$exists": False}}, {"_id": 1, "config": 1, "type": 1, "hash": 1}):
+        new_hash = ParsedConfig(doc["config"], doc.get("type")).hash
+        if new_hash != doc.get("hash"):
+            batch.append((doc["_id"], doc.get("hash"), new_hash))
+        if len(batch) >= WRITE_BATCH_SIZE:
+            await write(batch)
+            batch = []
+    if batch:
+        await write(batch)
+    if counts["merged"]:
+        await stats_counters.reconcile()
+    return counts
+
+async def seed_seen_index():
+    # The seen index started out empty; without this the first run after it shipped would take every stored
+    # config for new, probe all of them again and re-post PUBLISH_LIMIT of them. configs_cache only held
+    # raw-URI hashes, which cannot be turned into identity digests, so db.configs is the source.
+    batch, recorded = [], 0
+    async for doc in db.configs.find({}, {"_id": 0, "config": 1, "type": 1}):
+        batch.append(ParsedConfig(doc["config"], doc.get("type")).digest)
+        if len(batch) >= SEEN_BATCH_SIZE:
+            recorded += len(await seen_index.filter_new(batch))
+            batch = []
+    if batch:
+        recorded += len(await seen_index.filter_new(batch))
+    return {"recorded": recorded}
+
+async def find_config_for_button(config_hash):
+    return await db.configs.find_one_and_update(
+        {"$or": [{"hash": config_hash}, {"legacy_hashes": config_hash}]}, {"$inc": {"popularity": 1}},
+        {"_id": 0, "config": 1})
 
 # --- Initialize defaults ---
 async def init_defaults():
@@ -219,9 +1784,6 @@ async def init_defaults():
     channels = await kv_get("channel_ids")
     if channels is None:
         await kv_set("channel_ids", [CHANNEL_ID])
-    cache = await kv_get("configs_cache")
-    if cache is None:
-        await kv_set("configs_cache", [])
     templates = await kv_get("message_templates")
     if templates is None:
         await kv_set("message_templates", {
@@ -232,33 +1794,67 @@ async def init_defaults():
             "default": "VPN Config\nType: {type}\nServer: {server}\nStatus: {status}"
         })
 
+kv_watch_task = None
+stats_task = None
+retest_task = None
+
 @app.on_event("startup")
 async def startup():
+    get_http_client()
     await init_defaults()
+    await ensure_indexes()
+    await run_migration("config_identity_hash", rehash_configs)
+    # After the rehash, so the seen index and stored hashes agree on identity.
+    await run_migration("seen_index_seed", seed_seen_index)
+    asyncio.create_task(seen_index.warm())
+    global kv_watch_task, stats_task, retest_task
+    kv_watch_task = asyncio.create_task(watch_kv_changes())
+    stats_task = asyncio.create_task(stats_counters.run())
+    if RETEST_ENABLED:
+        retest_task = asyncio.create_task(retester.run())
     logger.info("Bot initialized with defaults")
 
 # --- Format message ---
-async def format_config_message(config, test_result):
+async def format_config_message(config, test_result, config_type=None):
+    parsed = as_parsed(config, config_type)
     templates = await kv_get("message_templates", {})
-    config_type = detect_config_type(config)
-    template = templates.get(config_type, templates.get("default", "{type} - {server} - {status}"))
-    host, port = extract_server_from_config(config)
-    server_str = f"{host}:{port}" if host else "Unknown"
+    template = templates.get(parsed.type, templates.get("default", "{type} - {server} - {status}"))
     status_emoji = "✅" if test_result["status"] == "active" else "⚠️" if test_result["status"] == "dns_only" else "❌"
     status_str = f'{status_emoji} {test_result["message"]}'
-    msg = template.format(type=config_type.upper(), server=server_str, status=status_str)
+    msg = template.format(type=parsed.type.upper(), server=parsed.server, status=status_str)
     return msg
 
-def create_inline_keyboard(config):
-    config_type = detect_config_type(config)
+def create_inline_keyboard(config, config_type=None):
+    parsed = as_parsed(config, config_type)
     return {
         "inline_keyboard": [
-            [{"text": f"📋 Copy {config_type.upper()} Config", "callback_data": f"copy_{get_config_hash(config)}"}],
-            [{"text": "📤 Share", "callback_data": f"share_{get_config_hash(config)}"},
-             {"text": "📱 Open in App", "url": f"https://t.me/share/url?url={config[:100]}"}]
+            [{"text": f"📋 Copy {parsed.type.upper()} Config", "callback_data": f"copy_{parsed.hash}"}],
+            [{"text": "📤 Share", "callback_data": f"share_{parsed.hash}"},
+             {"text": "📱 Open in App", "url": f"https://t.me/share/url?url={parsed.raw[:100]}"}]
         ]
     }
 
+def config_document(parsed, test_result, now=None):
+    now = now or datetime.now(timezone.utc)
+    failures = 0 if test_result.get("status") == "active" else 1
+    return {
+        "config": parsed.raw,
+        "hash": parsed.hash,
+        "type": parsed.type,
+        "test_result": test_result,
+        "created_at": now.isoformat(),
+        "host": parsed.host or "",
+        "port": parsed.port or 0,
+        "shard": shard_of(parsed.host, parsed.port),
+        "tested_at": now.isoformat(),
+        "failures": failures,
+        "next_test_at": next_test_time(now, failures),
+    }
+
+def config_update(parsed, test_result, now):
+    # Upsert of a probed config: the document fields plus the probe folded into its history.
+    return {"$set": config_document(parsed, test_result, now), **history_update(test_result, now)}
+
 # --- Main menu for regular users ---
 def get_user_menu():
     return {
@@ -281,65 +1877,332 @@ def get_admin_menu():
         ]
     }
 
-# --- Fetch and distribute configs ---
-async def fetch_and_distribute():
-    links = await kv_get("source_links", [])
-    channels = await kv_get("channel_ids", [CHANNEL_ID])
-    cache = await kv_get("configs_cache", [])
-    all_new = []
-
-    for link in links:
+# --- Streaming extraction ---
+class StreamingConfigExtractor:
+    # Holds nothing but the unfinished token at the end of the last chunk; duplicates across chunks are
+    # left to the seen index downstream.
+    def __init__(self, max_config_length=STREAM_MAX_CONFIG_LENGTH):
+        self.max_config_length = max_config_length
+        self.carry = ""
+
+    def _split(self, text):
+        # Only scan up to the last delimiter; the trailing token may continue in the next chunk.
+        buffer = self.carry + text
+        cut = max(buffer.rfind(ch) for ch in STREAM_DELIMITERS) + 1
+        self.carry = buffer[cut:]
+        if len(self.carry) > self.max_config_length:
+            self.carry = self.carry[-self.max_config_length:]
+        return buffer[:cut]
+
+    def feed(self, text):
+        complete = self._split(text)
+        return scan_configs(complete) if complete else []
+
+    def skip(self, text):
+        # Moves past text that was already scanned, keeping the carry consistent.
+        self._split(text)
+
+    def close(self):
+        configs = scan_configs(self.carry) if self.carry else []
+        self.carry = ""
+        return configs
+
+def chunk_hash(chunk):
+    return hashlib.blake2b(chunk, digest_size=8).hexdigest()
+
+async def iter_response_configs(resp, result, digest, known_chunks=(), chunk_hashes=None):
+    # Yields the configs of each chunk as it arrives. Leading chunks identical to the previous fetch
+    # (known_chunks, same positions) were scanned then and are skipped; chunk_hashes collects this body's.
+    decoder = codecs.getincrementaldecoder(resp.encoding or "utf-8")(errors="replace")
+    extractor = StreamingConfigExtractor()
+    chunk_hashes = [] if chunk_hashes is None else chunk_hashes
+    unchanged = True
+    async for chunk in resp.aiter_bytes(FETCH_CHUNK_SIZE):
+        if result["bytes"] + len(chunk) > FETCH_MAX_BYTES:
+            result["truncated"] = True
+            logger.warning(f"{result['url']} exceeds {FETCH_MAX_BYTES} bytes, truncating")
+            break
+        result["bytes"] += len(chunk)
+        digest.update(chunk)
+        index = len(chunk_hashes)
+        chunk_hashes.append(chunk_hash(chunk))
+        unchanged = unchanged and index < len(known_chunks) and known_chunks[index] == chunk_hashes[index]
+        cpu_start = time.process_time()
+        text = decoder.decode(chunk)
+        configs = []
+        if unchanged:
+            extractor.skip(text)
+        else:
+            configs = extractor.feed(text)
+        result["parse_ms"] += (time.process_time() - cpu_start) * 1000
+        if configs:
+            yield configs
+    if result["truncated"]:
+        # The carried-over token was cut off mid-body; scanning it would report a corrupt URI.
+        return
+    if unchanged and len(chunk_hashes) == len(known_chunks):
+        return
+    configs = extractor.feed(decoder.decode(b"", final=True)) + extractor.close()
+    if configs:
+        yield configs
+
+# --- Source fetching ---
+def conditional_headers(state):
+    headers = {}
+    if state.get("etag"):
+        headers["If-None-Match"] = state["etag"]
+    if state.get("last_modified"):
+        headers["If-Modified-Since"] = state["last_modified"]
+    return headers
+
+async def fetch_source(link, global_limit, host_limits, state=None, sink=None):
+    # With a sink, configs are handed over chunk by chunk (await sink(configs)) and never held for the
+    # whole body; without one they are collected in result["configs"]. found counts them either way.
+    state = state or {}
+    host = urlparse(link).hostname or ""
+    host_limit = host_limits.setdefault(host, asyncio.Semaphore(FETCH_PER_HOST_LIMIT))
+    result = {"url": link, "status_code": None, "configs": [], "found": 0, "bytes": 0, "truncated": False, "parse_ms": 0,
+              "elapsed_ms": 0, "error": None, "skipped": None, "saved_bytes": 0, "saved_cpu_ms": 0, "state": None}
+    async with global_limit, host_limit:
+        start = time.monotonic()
         try:
-            async with httpx.AsyncClient(timeout=30, follow_redirects=True) as client_http:
-                resp = await client_http.get(link, headers={"User-Agent": "Mozilla/5.0"})
-                text = resp.text
-                configs = extract_configs(text)
-                for config in configs:
-                    config_hash = get_config_hash(config)
-                    if config_hash not in cache:
-                        all_new.append(config)
-                        cache.append(config_hash)
+            async with get_http_client().stream("GET", link, headers=conditional_headers(state)) as resp:
+                result["status_code"] = resp.status_code
+                now = datetime.now(timezone.utc).isoformat()
+                if resp.status_code == 304:
+                    result["skipped"] = "not_modified"
+                    result["saved_bytes"] = state.get("bytes", 0)
+                    result["saved_cpu_ms"] = state.get("parse_ms", 0)
+                    result["state"] = {**state, "last_checked_at": now}
+                else:
+                    digest = hashlib.sha256()
+                    chunk_hashes = []
+                    known_chunks = state.get("chunk_hashes") or () if resp.is_success else ()
+                    async for configs in iter_response_configs(resp, result, digest, known_chunks, chunk_hashes):
+                        result["found"] += len(configs)
+                        if sink:
+                            await sink(configs)
+                        else:
+                            result["configs"].extend(configs)
+                    result["parse_ms"] = round(result["parse_ms"], 2)
+                    content_hash = None if result["truncated"] else digest.hexdigest()
+                    new_state = {**state, "url": link, "etag": resp.headers.get("etag"),
+                                 "last_modified": resp.headers.get("last-modified"), "last_checked_at": now,
+                                 "chunk_hashes": chunk_hashes}
+                    if resp.is_success and content_hash and content_hash == state.get("content_hash"):
+                        result["skipped"] = "unchanged"
+                    else:
+                        new_state.update(parse_ms=result["parse_ms"], bytes=result["bytes"],
+                                         content_hash=content_hash, last_changed_at=now)
+                    if resp.is_success:
+                        result["state"] = new_state
         except Exception as e:
             logger.error(f"Error fetching {link}: {e}")
+            result["error"] = str(e) or type(e).__name__
+        result["elapsed_ms"] = round((time.monotonic() - start) * 1000)
+    return result
 
-    if len(cache) > 500:
-        cache = cache[-500:]
-    await kv_set("configs_cache", cache)
+def source_fetches(links, states=None, sink=None):
+    states = states or {}
+    global_limit = asyncio.Semaphore(FETCH_CONCURRENCY)
+    host_limits = {}
+    return [fetch_source(link, global_limit, host_limits, states.get(link), sink) for link in links]
 
-    sent_count = 0
-    for config in all_new[:20]:
-        test_result = await test_config(config)
-        msg = await format_config_message(config, test_result)
-        full_msg = f"{msg}\n\n`{config}`"
-        keyboard = create_inline_keyboard(config)
-
-        # Store config in DB
-        await db.configs.update_one(
-            {"hash": get_config_hash(config)},
-            {"$set": {
-                "config": config,
-                "hash": get_config_hash(config),
-                "type": detect_config_type(config),
-                "test_result": test_result,
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "host": test_result.get("host", ""),
-                "port": test_result.get("port", 0),
-            }},
-            upsert=True
-        )
+async def fetch_sources(links, states=None):
+    return await asyncio.gather(*source_fetches(links, states))
 
-        for channel in channels:
-            try:
-                await send_telegram(channel, full_msg, keyboard)
-                await asyncio.sleep(1)
-            except Exception as e:
-                logger.error(f"Error sending to channel {channel}: {e}")
-        sent_count += 1
+async def iter_sources(links, states=None, sink=None):
+    # Yields each source result as soon as it is fetched, in completion order.
+    for next_source in asyncio.as_completed(source_fetches(links, states, sink)):
+        yield await next_source
+
+async def load_source_states(links):
+    docs = await db.source_state.find({"url": {"$in": links}}, {"_id": 0}).to_list(None)
+    return {doc["url"]: doc for doc in docs}
+
+async def save_source_states(sources):
+    ops = [UpdateOne({"url": src["url"]}, {"$set": src["state"]}, upsert=True) for src in sources if src["state"]]
+    if ops:
+        await db.source_state.bulk_write(ops, ordered=False)
+
+def summarize_source(source):
+    summary = {k: v for k, v in source.items() if k not in ("state", "found")}
+    summary["configs"] = source["found"]
+    return summary
+
+# --- Fetch and distribute configs ---
+async def fetch_and_distribute(report=None):
+    run_start = time.monotonic()
+    links = await kv_get("source_links", [])
+    channels = await kv_get("channel_ids", [CHANNEL_ID])
+    progress = {"stage": "fetch", "sources_total": len(links), "sources_done": 0, "new_configs": 0, "probed": 0, "published": 0}
+
+    async def update_progress(**changes):
+        progress.update(changes)
+        if report:
+            await report(progress)
+
+    # Every chunk of every source is parsed and deduped as it streams in, and its new configs are queued
+    # for probing right away, so only new configs outlive the chunk they came in. Configs without a usable
+    # endpoint are dropped here, before they cost a probe or a message. filter_new records what it
+    # returns, so a config repeated across chunks or sources is only new once.
+    parse_errors = Counter()
+    writes = []
+    sources = []
+    all_new = []
+    fresh = asyncio.Queue()
+    fetch_end = None
+
+    async def take(configs):
+        candidates = {}
+        parsed_configs, errors = parse_configs(configs)
+        parse_errors.update(errors)
+        for parsed in parsed_configs:
+            if not parsed.error:
+                candidates.setdefault(parsed.digest, parsed)
+        if not candidates:
+            return
+        new_digests = await seen_index.filter_new(list(candidates))
+        for digest, parsed in candidates.items():
+            if digest in new_digests:
+                all_new.append(parsed)
+                fresh.put_nowait(parsed)
+        await update_progress(new_configs=len(all_new))
+
+    async def new_configs():
+        while (parsed := await fresh.get()) is not None:
+            yield parsed
+
+    async def fetch_sources():
+        nonlocal fetch_end
+        try:
+            async for source in iter_sources(links, await load_source_states(links), take):
+                sources.append(source)
+                await update_progress(sources_done=len(sources))
+        finally:
+            fresh.put_nowait(None)
+        fetch_end = time.monotonic()
+        link_order = {link: i for i, link in enumerate(links)}
+        sources.sort(key=lambda src: link_order[src["url"]])
+        await save_source_states(sources)
+        await update_progress(stage="probe")
+
+    fetch_start = time.monotonic()
+    fetching = asyncio.create_task(fetch_sources())
+    sent_count = 0
+    deliveries = []
+    try:
+        async for parsed, test_result in prober.probe_many(new_configs()):
+            # Every new config is probed and stored; only the first PUBLISH_LIMIT to finish are posted.
+            writes.append((parsed, config_writes.add_config(parsed, test_result)))
+            if sent_count < PUBLISH_LIMIT:
+                msg = await format_config_message(parsed, test_result)
+                keyboard = create_inline_keyboard(parsed)
+                deliveries.extend(outbound.submit(channel, f"{msg}\n\n`{parsed.raw}`", keyboard) for channel in channels)
+                sent_count += 1
+            await update_progress(probed=len(writes), published=sent_count)
+        await fetching
+    finally:
+        fetching.cancel()
+    fetch_ms = round((fetch_end - fetch_start) * 1000)
+    # Probing overlaps the fetch; probe_ms is the part left once every source is in.
+    probe_start = fetch_end
+    await config_writes.flush()
+    write_results = await asyncio.gather(*(future for _, future in writes))
+    write_errors = [(parsed.hash, result["error"]) for (parsed, _), result in zip(writes, write_results) if not result["ok"]]
+    for config_hash, error in write_errors:
+        logger.error(f"Could not store config {config_hash}: {error}")
+    probe_ms = round((time.monotonic() - probe_start) * 1000)
+
+    await update_progress(stage="deliver")
+    deliver_start = time.monotonic()
+    failed = sum(1 for result in await asyncio.gather(*deliveries) if not result.ok)
+    deliver_ms = round((time.monotonic() - deliver_start) * 1000)
+    if failed:
+        logger.error(f"{failed} of {len(deliveries)} channel messages failed")
 
     if sent_count > 0 and ADMIN_CHAT_ID:
         await send_telegram(ADMIN_CHAT_ID, f"✅ {sent_count} new configs distributed to {len(channels)} channel(s).")
 
-    return {"new_configs": sent_count, "total_checked": len(all_new)}
+    return {
+        "new_configs": sent_count,
+        "total_checked": len(all_new),
+        "fetch_ms": fetch_ms,
+        "timings": {"fetch_ms": fetch_ms, "probe_ms": probe_ms, "deliver_ms": deliver_ms,
+                    "total_ms": round((time.monotonic() - run_start) * 1000)},
+        "skipped_sources": sum(1 for src in sources if src["skipped"]),
+        "saved_bytes": sum(src["saved_bytes"] for src in sources),
+        "saved_cpu_ms": round(sum(src["saved_cpu_ms"] for src in sources), 2),
+        "parse_errors": dict(parse_errors),
+        "write_errors": len(write_errors),
+        "sources": [summarize_source(src) for src in sources],
+    }
+
+# --- Fetch jobs ---
+fetch_tasks = {}
+
+async def start_fetch_job(trigger, notify_chat=None):
+    # Returns (job, attached). attached is True when a run was already in progress.
+    now = datetime.now(timezone.utc)
+    job = {"job_id": uuid.uuid4().hex, "lock": "fetch", "status": "running", "trigger": trigger,
+           "started_at": now.isoformat(), "heartbeat_at": now.isoformat(), "notify": [notify_chat] if notify_chat else [],
+           "progress": {}, "timings": {}, "result": None, "error": None}
+    try:
+        await db.fetch_runs.insert_one(dict(job))
+    except DuplicateKeyError:
+        running = await db.fetch_runs.find_one({"lock": "fetch", "status": "running"}, {"_id": 0})
+        if running is None:
+            return await start_fetch_job(trigger, notify_chat)
+        heartbeat = datetime.fromisoformat(running["heartbeat_at"])
+        if (now - heartbeat).total_seconds() > FETCH_JOB_STALE_SECONDS:
+            # The worker that owned this run died without finishing it.
+            await db.fetch_runs.update_one({"job_id": running["job_id"], "status": "running"},
+                                           {"$set": {"status": "failed", "error": "stale", "finished_at": now.isoformat()}})
+            return await start_fetch_job(trigger, notify_chat)
+        if notify_chat:
+            await db.fetch_runs.update_one({"job_id": running["job_id"]}, {"$addToSet": {"notify": notify_chat}})
+        return running, True
+    fetch_tasks[job["job_id"]] = asyncio.create_task(run_fetch_job(job["job_id"]))
+    return job, False
+
+async def run_fetch_job(job_id):
+    last_report = 0
+
+    async def report(progress):
+        nonlocal last_report
+        if time.monotonic() - last_report < FETCH_JOB_REPORT_INTERVAL:
+            return
+        last_report = time.monotonic()
+        await db.fetch_runs.update_one({"job_id": job_id}, {"$set": {
+            "progress": dict(progress), "heartbeat_at": datetime.now(timezone.utc).isoformat()}})
+
+    # Anything that ends the run early, cancellation at shutdown included, must still release the lock.
+    update = {"status": "failed", "error": "cancelled"}
+    try:
+        result = await fetch_and_distribute(report)
+        update = {"status": "done", "result": result, "timings": result["timings"],
+                  "progress": {"stage": "done", "new_configs": result["total_checked"], "published": result["new_configs"]}}
+    except Exception as e:
+        logger.error(f"Fetch job {job_id} failed: {e}")
+        update = {"status": "failed", "error": str(e) or type(e).__name__}
+    finally:
+        fetch_tasks.pop(job_id, None)
+        update["finished_at"] = datetime.now(timezone.utc).isoformat()
+        await db.fetch_runs.update_one({"job_id": job_id}, {"$set": update})
+    job = await db.fetch_runs.find_one({"job_id": job_id}, {"_id": 0})
+    for chat_id in job.get("notify", []):
+        await send_telegram(chat_id, format_job_summary(job))
+
+def format_job_summary(job):
+    if job["status"] != "done":
+        return f"❌ Fetch failed: {job.get('error')}"
+    result = job["result"]
+    return f"✅ Done!\nNew configs: {result['new_configs']}\nTotal checked: {result['total_checked']}\nTime: {result['timings']['total_ms'] / 1000:.1f}s"
+
+def format_job_started(job, attached):
+    if attached:
+        return f"⏳ A fetch is already running (job `{job['job_id'][:8]}`), you'll get its result."
+    return f"🔄 Fetching configs... (job `{job['job_id'][:8]}`)"
 
 # --- Webhook handler ---
 async def handle_webhook(update):
@@ -358,18 +2221,10 @@ async def handle_webhook(update):
     user_state = await kv_get(f"user_state_{chat_id}")
     if user_state == "awaiting_config":
         await kv_set(f"user_state_{chat_id}", None)
-        configs = extract_configs(text)
+        configs = [(p.raw, p.type) for p in parse_configs(scan_configs(text))[0] if not p.error]
         if configs:
-            for cfg in configs:
-                await db.submissions.insert_one({
-                    "config": cfg,
-                    "type": detect_config_type(cfg),
-                    "submitted_by": chat_id,
-                    "username": message.get("from", {}).get("username", "unknown"),
-                    "status": "pending",
-                    "created_at": datetime.now(timezone.utc).isoformat()
-                })
-            await send_telegram(chat_id, f"✅ {len(configs)} config(s) submitted for review!\nThey will be tested and published after admin approval.")
+            stored = await submit_configs(configs, chat_id, message.get("from", {}).get("username", "unknown"))
+            await send_telegram(chat_id, f"✅ {stored} config(s) submitted for review!\nThey will be tested and published after admin approval.")
         else:
             await send_telegram(chat_id, "❌ No valid V2Ray config found in your message.\nSupported: vless://, vmess://, trojan://, ss://")
         return
@@ -388,9 +2243,8 @@ async def handle_webhook(update):
         await send_telegram(chat_id, help_text)
 
     elif text == "/check" and is_admin:
-        await send_telegram(chat_id, "🔄 Fetching configs...")
-        result = await fetch_and_distribute()
-        await send_telegram(chat_id, f"✅ Done!\nNew configs: {result['new_configs']}\nTotal checked: {result['total_checked']}")
+        job, attached = await start_fetch_job("telegram:/check", chat_id)
+        await send_telegram(chat_id, format_job_started(job, attached))
 
     elif text == "/links" and is_admin:
         links = await kv_get("source_links", [])
@@ -403,50 +2257,38 @@ async def handle_webhook(update):
         await send_telegram(chat_id, msg)
 
     elif text == "/status" and is_admin:
-        links = await kv_get("source_links", [])
-        channels = await kv_get("channel_ids", [])
-        cache = await kv_get("configs_cache", [])
-        total_configs = await db.configs.count_documents({})
-        pending = await db.submissions.count_documents({"status": "pending"})
-        msg = f"📊 *Bot Status*\n\nSource Links: {len(links)}\nChannels: {len(channels)}\nCache Size: {len(cache)}\nTotal Configs: {total_configs}\nPending Submissions: {pending}"
+        stats = await stats_counters.snapshot()
+        msg = f"📊 *Bot Status*\n\nSource Links: {stats['source_links']}\nChannels: {stats['channels']}\nCache Size: {stats['cache_size']}\nTotal Configs: {stats['total_configs']}\nPending Submissions: {stats['pending_submissions']}"
         await send_telegram(chat_id, msg)
 
     elif text.startswith("/add_link ") and is_admin:
         url = text.replace("/add_link ", "").strip()
-        links = await kv_get("source_links", [])
-        if url not in links:
-            links.append(url)
-            await kv_set("source_links", links)
+        added, _ = await kv_add_item("source_links", url)
+        if added:
             await send_telegram(chat_id, f"✅ Link added: `{url}`")
         else:
             await send_telegram(chat_id, "⚠️ Link already exists.")
 
     elif text.startswith("/remove_link ") and is_admin:
         url = text.replace("/remove_link ", "").strip()
-        links = await kv_get("source_links", [])
-        if url in links:
-            links.remove(url)
-            await kv_set("source_links", links)
+        removed, _ = await kv_remove_item("source_links", url)
+        if removed:
             await send_telegram(chat_id, f"✅ Link removed.")
         else:
             await send_telegram(chat_id, "⚠️ Link not found.")
 
     elif text.startswith("/add_channel ") and is_admin:
         cid = text.replace("/add_channel ", "").strip()
-        channels = await kv_get("channel_ids", [])
-        if cid not in channels:
-            channels.append(cid)
-            await kv_set("channel_ids", channels)
+        added, _ = await kv_add_item("channel_ids", cid)
+        if added:
             await send_telegram(chat_id, f"✅ Channel added: `{cid}`")
         else:
             await send_telegram(chat_id, "⚠️ Channel already exists.")
 
     elif text.startswith("/remove_channel ") and is_admin:
         cid = text.replace("/remove_channel ", "").strip()
-        channels = await kv_get("channel_ids", [])
-        if cid in channels:
-            channels.remove(cid)
-            await kv_set("channel_ids", channels)
+        removed, _ = await kv_remove_item("channel_ids", cid)
+        if removed:
             await send_telegram(chat_id, f"✅ Channel removed.")
         else:
             await send_telegram(chat_id, "⚠️ Channel not found.")
@@ -465,18 +2307,10 @@ async def handle_webhook(update):
             await send_telegram(chat_id, "No configs available yet.")
 
     elif not is_admin:
-        configs = extract_configs(text)
+        configs = [(p.raw, p.type) for p in parse_configs(scan_configs(text))[0] if not p.error]
         if configs:
-            for cfg in configs:
-                await db.submissions.insert_one({
-                    "config": cfg,
-                    "type": detect_config_type(cfg),
-                    "submitted_by": chat_id,
-                    "username": message.get("from", {}).get("username", "unknown"),
-                    "status": "pending",
-                    "created_at": datetime.now(timezone.utc).isoformat()
-                })
-            await send_telegram(chat_id, f"✅ {len(configs)} config(s) submitted for review!")
+            stored = await submit_configs(configs, chat_id, message.get("from", {}).get("username", "unknown"))
+            await send_telegram(chat_id, f"✅ {stored} config(s) submitted for review!")
         else:
             await send_telegram(chat_id, "Use /start to see the menu.", get_user_menu())
 
@@ -502,17 +2336,15 @@ async def handle_callback(callback):
             await send_telegram(chat_id, "No configs available yet.")
 
     elif data == "bot_stats":
-        total = await db.configs.count_documents({})
-        active = await db.configs.count_documents({"test_result.status": "active"})
-        await send_telegram(chat_id, f"📊 *Stats*\n\nTotal Configs: {total}\nActive: {active}")
+        stats = await stats_counters.snapshot()
+        await send_telegram(chat_id, f"📊 *Stats*\n\nTotal Configs: {stats['total_configs']}\nActive: {stats['active_configs']}")
 
     elif data == "user_help":
         await send_telegram(chat_id, "📖 Send /start for menu.\nSend any V2Ray config to submit it.\nUse /latest to see recent configs.")
 
     elif data == "admin_check_now" and is_admin:
-        await send_telegram(chat_id, "🔄 Fetching configs...")
-        result = await fetch_and_distribute()
-        await send_telegram(chat_id, f"✅ Done! {result['new_configs']} new configs sent.")
+        job, attached = await start_fetch_job("telegram:admin_check_now", chat_id)
+        await send_telegram(chat_id, format_job_started(job, attached))
 
     elif data == "admin_links" and is_admin:
         links = await kv_get("source_links", [])
@@ -532,12 +2364,8 @@ async def handle_callback(callback):
         await send_telegram(chat_id, msg)
 
     elif data == "admin_status" and is_admin:
-        links = await kv_get("source_links", [])
-        channels = await kv_get("channel_ids", [])
-        cache = await kv_get("configs_cache", [])
-        total = await db.configs.count_documents({})
-        pending = await db.submissions.count_documents({"status": "pending"})
-        msg = f"📊 *Status*\n\nLinks: {len(links)}\nChannels: {len(channels)}\nCache: {len(cache)}\nConfigs: {total}\nPending: {pending}"
+        stats = await stats_counters.snapshot()
+        msg = f"📊 *Status*\n\nLinks: {stats['source_links']}\nChannels: {stats['channels']}\nCache: {stats['cache_size']}\nConfigs: {stats['total_configs']}\nPending: {stats['pending_submissions']}"
         await send_telegram(chat_id, msg)
 
     elif data == "admin_submissions" and is_admin:
@@ -558,38 +2386,28 @@ async def handle_callback(callback):
     elif data.startswith("approve_") and is_admin:
         config_hash = data.replace("approve_", "")
         sub = await db.submissions.find_one({"status": "pending"}, {"_id": 0})
-        if sub and get_config_hash(sub["config"]) == config_hash:
-            test_result = await test_config(sub["config"])
-            msg = await format_config_message(sub["config"], test_result)
+        parsed = ParsedConfig(sub["config"], sub.get("type")) if sub else None
+        if parsed and parsed.hash == config_hash and parsed.error:
+            await send_telegram(chat_id, f"⚠️ Cannot publish this config ({parsed.error}), reject it instead.")
+        elif parsed and parsed.hash == config_hash:
+            test_result = await prober.probe(parsed)
+            msg = await format_config_message(parsed, test_result)
             full_msg = f"{msg}\n\n`{sub['config']}`"
-            keyboard = create_inline_keyboard(sub["config"])
+            keyboard = create_inline_keyboard(parsed)
             channels = await kv_get("channel_ids", [CHANNEL_ID])
-            for channel in channels:
-                await send_telegram(channel, full_msg, keyboard)
-                await asyncio.sleep(1)
-            await db.submissions.update_one(
-                {"config": sub["config"], "status": "pending"},
-                {"$set": {"status": "approved"}}
-            )
-            await db.configs.update_one(
-                {"hash": config_hash},
-                {"$set": {"config": sub["config"], "hash": config_hash, "type": sub["type"],
-                          "test_result": test_result, "created_at": datetime.now(timezone.utc).isoformat()}},
-                upsert=True
-            )
+            await outbound.fan_out(channels, full_msg, keyboard)
+            await resolve_submission({"config": sub["config"]}, "approved")
+            await upsert_config(parsed, test_result)
             await send_telegram(chat_id, "✅ Config approved and published!")
 
     elif data.startswith("reject_") and is_admin:
         config_hash = data.replace("reject_", "")
-        await db.submissions.update_one(
-            {"status": "pending"},
-            {"$set": {"status": "rejected"}}
-        )
+        await resolve_submission({}, "rejected")
         await send_telegram(chat_id, "❌ Config rejected.")
 
     elif data.startswith("copy_"):
         config_hash = data.replace("copy_", "")
-        cfg = await db.configs.find_one({"hash": config_hash}, {"_id": 0})
+        cfg = await find_config_for_button(config_hash)
         if cfg:
             await send_telegram(chat_id, f"`{cfg['config']}`")
         else:
@@ -597,21 +2415,108 @@ async def handle_callback(callback):
 
     elif data.startswith("share_"):
         config_hash = data.replace("share_", "")
-        cfg = await db.configs.find_one({"hash": config_hash}, {"_id": 0})
+        cfg = await find_config_for_button(config_hash)
         if cfg:
             await send_telegram(chat_id, f"Share this config:\n\n`{cfg['config']}`")
 
+# --- Update queue ---
+def update_chat_id(update):
+    message = update.get("callback_query", {}).get("message") or update.get("message") or {}
+    return str(message.get("chat", {}).get("id", ""))
+
+class UpdateQueue:
+    # Same shape as OutboundScheduler: a FIFO queue and worker per chat so one chat's updates are
+    # handled in order, with a semaphore bounding how many chats are handled at once.
+    def __init__(self, handler=None):
+        self.handler = handler
+        self.slots = asyncio.Semaphore(WEBHOOK_CONCURRENCY)
+        self.queues = {}
+        self.workers = {}
+        self.seen = OrderedDict()
+        self.queued = 0
+        self.counters = {"accepted": 0, "duplicates": 0, "rejected": 0, "handled": 0, "failed": 0}
+
+    def stats(self):
+        return {**self.counters, "queued": self.queued, "active_chats": len(self.workers)}
+
+    def submit(self, update):
+        # Returns "accepted", "duplicate" or "full"; never awaits, so the webhook can answer at once.
+        update_id = update["update_id"]
+        if update_id in self.seen:
+            self.seen.move_to_end(update_id)
+            self.counters["duplicates"] += 1
+            return "duplicate"
+        if self.queued >= WEBHOOK_MAX_QUEUED:
+            self.counters["rejected"] += 1
+            return "full"
+        self.seen[update_id] = True
+        if len(self.seen) > WEBHOOK_DEDUP_SIZE:
+            self.seen.popitem(last=False)
+        chat_id = update_chat_id(update)
+        self.queues.setdefault(chat_id, deque()).append(update)
+        self.queued += 1
+        self.counters["accepted"] += 1
+        if chat_id not in self.workers:
+            self.workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+        return "accepted"
+
+    async def _drain(self, chat_id):
+        queue = self.queues[chat_id]
+        try:
+            async with self.slots:
+                while queue:
+                    update = queue.popleft()
+                    self.queued -= 1
+                    try:
+                        await (self.handler or handle_webhook)(update)
+                        self.counters["handled"] += 1
+                    except Exception as e:
+                        logger.error(f"Update {update.get('update_id')} failed: {e}")
+                        self.counters["failed"] += 1
+        finally:
+            del self.workers[chat_id]
+            if not queue:
+                del self.queues[chat_id]
+
+    async def join(self):
+        while self.workers:
+            await asyncio.gather(*list(self.workers.values()), return_exceptions=True)
+
+    async def aclose(self):
+        for task in list(self.workers.values()):
+            task.cancel()
+        await asyncio.gather(*list(self.workers.values()), return_exceptions=True)
+
+updates = UpdateQueue()
+
 # === API Routes ===
 
 @api_router.post("/webhook")
 async def webhook_endpoint(request: Request):
     try:
         update = await request.json()
-        await handle_webhook(update)
-        return {"ok": True}
     except Exception as e:
         logger.error(f"Webhook error: {e}")
         return {"ok": False, "error": str(e)}
+    if not isinstance(update, dict) or not isinstance(update.get("update_id"), int):
+        return {"ok": False, "error": "invalid update"}
+    if updates.submit(update) == "full":
+        # A non-2xx answer makes Telegram redeliver later instead of us dropping the update.
+        raise HTTPException(status_code=503, detail="Update queue full")
+    return {"ok": True}
+
+@api_router.get("/sub")
+async def subscription(request: Request, type: Optional[str] = None, max_latency: Optional[int] = None,
+                       limit: int = SUB_MAX_LIMIT, min_uptime: Optional[float] = None):
+    blob = await subscriptions.get(type, max_latency, max(1, min(limit, SUB_MAX_LIMIT)), min_uptime)
+    headers = {"ETag": blob["etag"], "Cache-Control": f"public, max-age={SUB_MAX_AGE}", "Vary": "Accept-Encoding",
+               "Profile-Update-Interval": str(max(1, SUB_MAX_AGE // 3600))}
+    if blob["etag"] in request.headers.get("if-none-match", ""):
+        subscriptions.counters["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(blob["gzip"], media_type="text/plain", headers={**headers, "Content-Encoding": "gzip"})
+    return Response(blob["body"], media_type="text/plain", headers=headers)
 
 @api_router.post("/auth/login")
 async def login(req: LoginRequest):
@@ -622,19 +2527,17 @@ async def login(req: LoginRequest):
 
 @api_router.get("/dashboard/stats")
 async def dashboard_stats(user: str = Depends(verify_token)):
-    total_configs = await db.configs.count_documents({})
-    active_configs = await db.configs.count_documents({"test_result.status": "active"})
-    links = await kv_get("source_links", [])
-    channels = await kv_get("channel_ids", [])
-    cache = await kv_get("configs_cache", [])
-    pending = await db.submissions.count_documents({"status": "pending"})
     return {
-        "total_configs": total_configs,
-        "active_configs": active_configs,
-        "source_links": len(links),
-        "channels": len(channels),
-        "cache_size": len(cache),
-        "pending_submissions": pending
+        **await stats_counters.snapshot(),
+        "seen_index": {**seen_index.stats, "bloom_ready": seen_index.bloom_ready},
+        "dns_cache": resolver.stats(),
+        "probe_cache": probe_cache.stats(),
+        "kv_cache": kv_cache.stats(),
+        "outbound": outbound.stats(),
+        "webhook": updates.stats(),
+        "subscription": subscriptions.stats(),
+        "retest": retester.stats(),
+        "writes": {"configs": config_writes.stats(), "submissions": submission_writes.stats()},
     }
 
 @api_router.get("/dashboard/links")
@@ -644,18 +2547,12 @@ async def get_links(user: str = Depends(verify_token)):
 
 @api_router.post("/dashboard/links")
 async def add_link(link: SourceLink, user: str = Depends(verify_token)):
-    links = await kv_get("source_links", [])
-    if link.url not in links:
-        links.append(link.url)
-        await kv_set("source_links", links)
+    _, links = await kv_add_item("source_links", link.url)
     return {"links": links}
 
 @api_router.delete("/dashboard/links")
 async def remove_link(link: SourceLink, user: str = Depends(verify_token)):
-    links = await kv_get("source_links", [])
-    if link.url in links:
-        links.remove(link.url)
-        await kv_set("source_links", links)
+    _, links = await kv_remove_item("source_links", link.url)
     return {"links": links}
 
 @api_router.get("/dashboard/channels")
@@ -665,25 +2562,95 @@ async def get_channels(user: str = Depends(verify_token)):
 
 @api_router.post("/dashboard/channels")
 async def add_channel(ch: ChannelEntry, user: str = Depends(verify_token)):
-    channels = await kv_get("channel_ids", [])
-    if ch.channel_id not in channels:
-        channels.append(ch.channel_id)
-        await kv_set("channel_ids", channels)
+    _, channels = await kv_add_item("channel_ids", ch.channel_id)
     return {"channels": channels}
 
 @api_router.delete("/dashboard/channels")
 async def remove_channel(ch: ChannelEntry, user: str = Depends(verify_token)):
-    channels = await kv_get("channel_ids", [])
-    if ch.channel_id in channels:
-        channels.remove(ch.channel_id)
-        await kv_set("channel_ids", channels)
+    _, channels = await kv_remove_item("channel_ids", ch.channel_id)
     return {"channels": channels}
 
+CONFIG_LIST_PROJECTION = {"_id": 0, "config": 1, "hash": 1, "type": 1, "host": 1, "port": 1, "created_at": 1,
+                          "test_result.status": 1, "test_result.message": 1, "test_result.latency": 1, "rollup": 1}
+CONFIG_PAGE_MAX = 200
+# sort name -> (field, direction); hash breaks ties in the same direction. Rollup sorts only list configs
+# that have a value for the field.
+CONFIG_SORTS = {"recent": ("created_at", -1), "latency": ("rollup.p50", 1), "uptime": ("rollup.uptime_24h", -1)}
+
+def encode_cursor(doc, field="created_at"):
+    value = get_nested(doc, field)
+    return base64.urlsafe_b64encode(json.dumps([value, doc["hash"]]).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor, field="created_at"):
+    try:
+        value, config_hash = json.loads(b64decode_loose(cursor))
+        value = str(value) if field == "created_at" else float(value)
+        return value, str(config_hash)
+    except Exception:
+        raise HTTPException(400, "Invalid cursor")
+
+def get_nested(doc, path):
+    for part in path.split("."):
+        doc = (doc or {}).get(part)
+    return doc
+
+def config_filter(config_type=None, status=None, min_latency=None, max_latency=None):
+    query = {}
+    if config_type:
+        query["type"] = config_type
+    if status:
+        query["test_result.status"] = status
+    latency = {}
+    if min_latency is not None:
+        latency["$gte"] = min_latency
+    if max_latency is not None:
+        latency["$lte"] = max_latency
+    if latency:
+        # Only reachable configs have a latency; -1 marks a failed probe.
+        query["test_result.latency"] = {"$gte": 0, **latency}
+    return query
+
+async def estimated_config_total(query):
+    # Totals the counters already know; anything else needs exact=true.
+    stats = await stats_counters.snapshot()
+    if not query:
+        return stats["total_configs"]
+    if list(query) == ["type"]:
+        return stats["configs_by_type"].get(query["type"], 0)
+    if query == {"test_result.status": "active"}:
+        return stats["active_configs"]
+    return None
+
 @api_router.get("/dashboard/configs")
-async def get_configs(user: str = Depends(verify_token), limit: int = 50, skip: int = 0):
-    configs = await db.configs.find({}, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    total = await db.configs.count_documents({})
-    return {"configs": configs, "total": total}
+async def get_configs(user: str = Depends(verify_token), limit: int = 50, cursor: Optional[str] = None,
+                      type: Optional[str] = None, status: Optional[str] = None, min_latency: Optional[int] = None,
+                      max_latency: Optional[int] = None, exact: bool = False, sort: str = "recent"):
+    # Keyset pagination on (sort field, hash), newest first by default; next_cursor is null on the last page.
+    if sort not in CONFIG_SORTS:
+        raise HTTPException(400, f"sort must be one of {', '.join(CONFIG_SORTS)}")
+    field, direction = CONFIG_SORTS[sort]
+    limit = max(1, min(limit, CONFIG_PAGE_MAX))
+    query = config_filter(type, status, min_latency, max_latency)
+    if sort != "recent":
+        query[field] = {"$gte": 0}
+    page_query = dict(query)
+    if cursor:
+        value, config_hash = decode_cursor(cursor, field)
+        op = "$lt" if direction < 0 else "$gt"
+        page_query["$or"] = [{field: {op: value}}, {field: value, "hash": {op: config_hash}}]
+    configs = await db.configs.find(page_query, CONFIG_LIST_PROJECTION).sort(
+        [(field, direction), ("hash", direction)]).limit(limit + 1).to_list(limit + 1)
+    next_cursor = encode_cursor(configs[limit - 1], field) if len(configs) > limit else None
+    total = await db.configs.count_documents(query) if exact else await estimated_config_total(query)
+    return {"configs": configs[:limit], "next_cursor": next_cursor, "total": total, "total_exact": exact}
+
+@api_router.get("/dashboard/configs/{config_hash}/history")
+async def get_config_history(config_hash: str, user: str = Depends(verify_token), days: int = 7):
+    days = max(1, min(days, PROBE_HISTORY_DAYS))
+    buckets = await db.probe_history.find({"hash": config_hash}, {"_id": 0, "expire_at": 0}).sort(
+        "day", -1).limit(days).to_list(days)
+    rollup = await db.configs.find_one({"hash": config_hash}, {"_id": 0, "rollup": 1})
+    return {"hash": config_hash, "rollup": (rollup or {}).get("rollup"), "days": buckets}
 
 @api_router.get("/dashboard/templates")
 async def get_templates(user: str = Depends(verify_token)):
@@ -705,42 +2672,48 @@ async def get_submissions(user: str = Depends(verify_token), status: str = "pend
 @api_router.post("/dashboard/submissions/{action}")
 async def handle_submission(action: str, sub: ConfigSubmission, user: str = Depends(verify_token)):
     if action == "approve":
-        test_result = await test_config(sub.config)
-        msg = await format_config_message(sub.config, test_result)
+        parsed = ParsedConfig(sub.config)
+        if parsed.error:
+            raise HTTPException(400, f"Cannot publish an unparseable config ({parsed.error})")
+        test_result = await prober.probe(parsed)
+        msg = await format_config_message(parsed, test_result)
         full_msg = f"{msg}\n\n`{sub.config}`"
-        keyboard = create_inline_keyboard(sub.config)
+        keyboard = create_inline_keyboard(parsed)
         channels = await kv_get("channel_ids", [CHANNEL_ID])
-        for channel in channels:
-            await send_telegram(channel, full_msg, keyboard)
-            await asyncio.sleep(1)
-        await db.submissions.update_one(
-            {"config": sub.config, "status": "pending"},
-            {"$set": {"status": "approved"}}
-        )
-        await db.configs.update_one(
-            {"hash": get_config_hash(sub.config)},
-            {"$set": {"config": sub.config, "hash": get_config_hash(sub.config),
-                      "type": detect_config_type(sub.config), "test_result": test_result,
-                      "created_at": datetime.now(timezone.utc).isoformat()}},
-            upsert=True
-        )
+        await outbound.fan_out(channels, full_msg, keyboard)
+        await resolve_submission({"config": sub.config}, "approved")
+        await upsert_config(parsed, test_result)
         return {"status": "approved", "test_result": test_result}
     elif action == "reject":
-        await db.submissions.update_one(
-            {"config": sub.config, "status": "pending"},
-            {"$set": {"status": "rejected"}}
-        )
+        await resolve_submission({"config": sub.config}, "rejected")
         return {"status": "rejected"}
     raise HTTPException(400, "Invalid action")
 
+@api_router.post("/dashboard/configs/parse")
+async def parse_config_batch(batch: ConfigBatch, user: str = Depends(verify_token)):
+    parsed, errors = parse_configs(batch.configs)
+    return {"configs": [p.as_dict() for p in parsed], "errors": errors}
+
 @api_router.post("/dashboard/fetch-now")
 async def fetch_now(user: str = Depends(verify_token)):
-    result = await fetch_and_distribute()
-    return result
+    job, attached = await start_fetch_job(f"dashboard:{user}")
+    return {"job_id": job["job_id"], "status": job["status"], "attached": attached}
+
+@api_router.get("/dashboard/jobs")
+async def list_fetch_jobs(user: str = Depends(verify_token), limit: int = FETCH_JOB_HISTORY):
+    jobs = await db.fetch_runs.find({}, {"_id": 0, "result.sources": 0}).sort("started_at", -1).limit(limit).to_list(limit)
+    return {"jobs": jobs}
+
+@api_router.get("/dashboard/jobs/{job_id}")
+async def get_fetch_job(job_id: str, user: str = Depends(verify_token)):
+    job = await db.fetch_runs.find_one({"job_id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(404, "Job not found")
+    return job
 
 @api_router.post("/dashboard/test-config")
 async def test_single_config(sub: ConfigSubmission, user: str = Depends(verify_token)):
-    result = await test_config(sub.config)
+    result = await prober.probe(sub.config)
     return result
 
 @api_router.get("/dashboard/worker-script")
@@ -762,4 +2735,17 @@ app.add_middleware(
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    running = list(fetch_tasks.values())
+    for task in running:
+        task.cancel()
+    await asyncio.gather(*running, return_exceptions=True)
+    await updates.aclose()
+    await config_writes.aclose()
+    await submission_writes.aclose()
+    for task in (kv_watch_task, stats_task, retest_task):
+        if task:
+            task.cancel()
+    await close_http_client()
+    await outbound.aclose()
+    await telegram.aclose()
     client.close()
@@ -1,6 +1,7 @@
 import requests
 import sys
 import json
+import time
 from datetime import datetime
 
 class TelegramBotAPITester:
@@ -251,16 +252,25 @@ class TelegramBotAPITester:
         print("\n🔄 Testing Fetch Now...")
         
         success, response_data, status_code = self.run_request("POST", "/dashboard/fetch-now", 200)
-        
-        expected_fields = ["new_configs", "total_checked"]
-        missing_fields = [field for field in expected_fields if field not in response_data]
-        
-        if success and not missing_fields:
-            new_configs = response_data.get("new_configs", 0)
-            total_checked = response_data.get("total_checked", 0)
-            self.log_test_result("Fetch Now", True, f"New configs: {new_configs}, Total checked: {total_checked}")
+        job_id = response_data.get("job_id")
+        if not success or not job_id:
+            self.log_test_result("Fetch Now", False, "Missing job_id", 200, status_code)
+            return
+
+        # The fetch runs as a background job; poll it the way the dashboard does.
+        job = {}
+        for _ in range(120):
+            success, job, status_code = self.run_request("GET", f"/dashboard/jobs/{job_id}", 200)
+            if not success or job.get("status") != "running":
+                break
+            time.sleep(2)
+
+        result = job.get("result") or {}
+        if success and job.get("status") == "done" and "new_configs" in result and "total_checked" in result:
+            self.log_test_result("Fetch Now", True,
+                                 f"New configs: {result['new_configs']}, Total checked: {result['total_checked']}")
         else:
-            error_msg = f"Missing fields: {missing_fields}" if missing_fields else "Request failed"
+            error_msg = job.get("error") or f"Job ended with status {job.get('status')}"
             self.log_test_result("Fetch Now", False, error_msg, 200, status_code)
 
     def test_config_testing(self):
@@ -77,6 +77,7 @@ function Dashboard({ onLogout }) {
   const [links, setLinks] = useState([]);
   const [channels, setChannels] = useState([]);
   const [configs, setConfigs] = useState([]);
+  const [configsCursor, setConfigsCursor] = useState(null);
   const [templates, setTemplates] = useState({});
   const [submissions, setSubmissions] = useState([]);
   const [newLink, setNewLink] = useState("");
@@ -101,6 +102,7 @@ function Dashboard({ onLogout }) {
       setLinks(l.data.links || []);
       setChannels(ch.data.channels || []);
       setConfigs(c.data.configs || []);
+      setConfigsCursor(c.data.next_cursor || null);
       setTemplates(t.data.templates || {});
       setSubmissions(sub.data.submissions || []);
     } catch (e) {
@@ -139,13 +141,30 @@ function Dashboard({ onLogout }) {
     setActionMsg("");
     try {
       const { data } = await api.post("/dashboard/fetch-now");
-      setActionMsg(`New configs: ${data.new_configs}, Total checked: ${data.total_checked}`);
+      setActionMsg(data.attached ? "A fetch is already running, waiting for it..." : "Fetching configs...");
+      let job = data;
+      while (job.status === "running") {
+        await new Promise(resolve => setTimeout(resolve, 2000));
+        job = (await api.get(`/dashboard/jobs/${data.job_id}`)).data;
+      }
+      if (job.status === "done") {
+        setActionMsg(`New configs: ${job.result.new_configs}, Total checked: ${job.result.total_checked}`);
+      } else {
+        setActionMsg(`Fetch failed: ${job.error}`);
+      }
       loadData();
     } catch {
       setActionMsg("Error fetching configs");
     } finally { setLoading(false); }
   };
 
+  const loadMoreConfigs = async () => {
+    if (!configsCursor) return;
+    const { data } = await api.get("/dashboard/configs", { params: { cursor: configsCursor } });
+    setConfigs(prev => [...prev, ...(data.configs || [])]);
+    setConfigsCursor(data.next_cursor || null);
+  };
+
   const runTest = async () => {
     if (!testConfig) return;
     setTestResult(null);
@@ -266,7 +285,7 @@ function Dashboard({ onLogout }) {
 
           {tab === "configs" && (
             <div data-testid="configs-section">
-              <h2>Recent Configs ({configs.length})</h2>
+              <h2>Recent Configs ({stats.total_configs ?? configs.length})</h2>
               <div className="configs-list">
                 {configs.map((c, i) => (
                   <div key={i} className="config-card" data-testid={`config-item-${i}`}>
@@ -277,12 +296,17 @@ function Dashboard({ onLogout }) {
                         {c.test_result?.message || "Unknown"}
                       </span>
                     </div>
-                    <div className="config-server">{c.host || "N/A"}:{c.port || "N/A"}</div>
+                    <div className="config-server">
+                      {c.host || "N/A"}:{c.port || "N/A"}
+                      {c.rollup?.p50 >= 0 && <span> · p50 {c.rollup.p50}ms / p95 {c.rollup.p95}ms</span>}
+                      {c.rollup?.uptime_24h != null && <span> · {c.rollup.uptime_24h}% up 24h</span>}
+                    </div>
                     <code className="config-code">{c.config}</code>
                     <button className="btn-copy" onClick={() => copyConfig(c.config)}><Copy size={14} /> Copy</button>
                   </div>
                 ))}
                 {!configs.length && <p className="empty-text">No configs fetched yet. Use Actions tab to fetch.</p>}
+                {configsCursor && <button className="btn-accent" data-testid="load-more-configs" onClick={loadMoreConfigs}>Load more</button>}
               </div>
             </div>
           )}
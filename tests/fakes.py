@@ -0,0 +1,388 @@
+import copy
+import itertools
+
+from pymongo import DeleteOne, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+MISSING = object()
+
+
+def get_path(doc, path):
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return MISSING
+        value = value[part]
+    return value
+
+
+def set_path(doc, path, value):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+
+def unset_path(doc, path):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.get(part, {})
+    doc.pop(last, None)
+
+
+def compare(value, op, arg):
+    if op == "$in":
+        return value in arg or (isinstance(value, list) and any(v in arg for v in value))
+    if op == "$nin":
+        return value not in arg
+    if op == "$ne":
+        return value != arg
+    if op == "$exists":
+        return (value is not MISSING) == bool(arg)
+    if value is MISSING or value is None:
+        return False
+    return {"$lt": value < arg, "$lte": value <= arg, "$gt": value > arg, "$gte": value >= arg}[op]
+
+
+def matches(doc, query):
+    for key, cond in query.items():
+        if key == "$or":
+            if not any(matches(doc, q) for q in cond):
+                return False
+            continue
+        if key == "$and":
+            if not all(matches(doc, q) for q in cond):
+                return False
+            continue
+        value = get_path(doc, key)
+        if isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond):
+            if not all(compare(value, op, arg) for op, arg in cond.items()):
+                return False
+        elif isinstance(value, list) and not isinstance(cond, list):
+            if cond not in value:
+                return False
+        elif (None if value is MISSING else value) != cond:
+            return False
+    return True
+
+
+def project(doc, projection):
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    included = [k for k, v in projection.items() if v and k != "_id"]
+    if included:
+        out = {}
+        for key in included:
+            value = get_path(doc, key)
+            if value is not MISSING:
+                set_path(out, key, value)
+        if projection.get("_id", 1) and "_id" in doc:
+            out["_id"] = doc["_id"]
+        return out
+    for key, v in projection.items():
+        if not v:
+            unset_path(doc, key)
+    return doc
+
+
+def apply_update(doc, update, inserting=False):
+    for op, fields in update.items():
+        for key, arg in fields.items():
+            current = get_path(doc, key)
+            if op == "$set" or (op == "$setOnInsert" and inserting):
+                set_path(doc, key, copy.deepcopy(arg))
+            elif op == "$unset":
+                unset_path(doc, key)
+            elif op == "$inc":
+                set_path(doc, key, (0 if current is MISSING else current) + arg)
+            elif op == "$max":
+                if current is MISSING or arg > current:
+                    set_path(doc, key, arg)
+            elif op == "$min":
+                if current is MISSING or arg < current:
+                    set_path(doc, key, arg)
+            elif op == "$addToSet":
+                items = [] if current is MISSING else current
+                for item in arg["$each"] if isinstance(arg, dict) and "$each" in arg else [arg]:
+                    if item not in items:
+                        items.append(item)
+                set_path(doc, key, items)
+            elif op == "$push":
+                items = [] if current is MISSING else current
+                if isinstance(arg, dict) and "$each" in arg:
+                    items.extend(arg["$each"])
+                    if "$slice" in arg:
+                        items = items[arg["$slice"]:] if arg["$slice"] < 0 else items[:arg["$slice"]]
+                else:
+                    items.append(arg)
+                set_path(doc, key, items)
+            elif op == "$pull":
+                if current is not MISSING:
+                    set_path(doc, key, [i for i in current if i != arg])
+
+
+class FakeCursor:
+    def __init__(self, docs, projection=None):
+        self.docs = docs
+        self.projection = projection
+
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self.docs.sort(key=lambda d: (get_path(d, field) is MISSING, get_path(d, field)), reverse=order == -1)
+        return self
+
+    def skip(self, n):
+        self.docs = self.docs[n:]
+        return self
+
+    def limit(self, n):
+        if n:
+            self.docs = self.docs[:n]
+        return self
+
+    async def to_list(self, length):
+        docs = self.docs if length is None else self.docs[:length]
+        return [project(d, self.projection) for d in docs]
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for doc in self.docs:
+            yield project(doc, self.projection)
+
+
+def group_key(doc, spec):
+    if isinstance(spec, str) and spec.startswith("$"):
+        value = get_path(doc, spec[1:])
+        return None if value is MISSING else value
+    return spec
+
+
+def run_pipeline(docs, pipeline):
+    for stage in pipeline:
+        (op, arg), = stage.items()
+        if op == "$match":
+            docs = [d for d in docs if matches(d, arg)]
+        elif op == "$count":
+            docs = [{arg: len(docs)}] if docs else []
+        elif op == "$group":
+            groups = {}
+            for doc in docs:
+                key = group_key(doc, arg["_id"])
+                out = groups.setdefault(repr(key), {"_id": key})
+                for field, acc in arg.items():
+                    if field == "_id":
+                        continue
+                    (acc_op, acc_arg), = acc.items()
+                    value = acc_arg if not isinstance(acc_arg, str) else group_key(doc, acc_arg)
+                    if acc_op == "$sum":
+                        out[field] = out.get(field, 0) + (value or 0)
+                    elif acc_op == "$max":
+                        out[field] = value if field not in out else max(out[field], value)
+                    elif acc_op == "$min":
+                        out[field] = value if field not in out else min(out[field], value)
+            docs = list(groups.values())
+        elif op == "$facet":
+            docs = [{name: run_pipeline(copy.deepcopy(docs), sub) for name, sub in arg.items()}]
+        elif op == "$sort":
+            docs = FakeCursor(docs).sort(list(arg.items())).docs
+        elif op == "$limit":
+            docs = docs[:arg]
+        elif op == "$project":
+            docs = [project(d, arg) for d in docs]
+        else:
+            raise NotImplementedError(op)
+    return docs
+
+
+class FakeResult:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class FakeCollection:
+    _ids = itertools.count(1)
+
+    def __init__(self, name="fake"):
+        self.name = name
+        self.docs = []
+        self.indexes = {}
+        self.calls = []
+
+    async def create_index(self, keys, unique=False, partialFilterExpression=None, **kwargs):
+        fields = [keys] if isinstance(keys, str) else [k for k, _ in keys]
+        name = kwargs.get("name") or "_".join(fields)
+        self.indexes[name] = {"fields": fields, "unique": unique, "partial": partialFilterExpression, **kwargs}
+        return name
+
+    async def drop_index(self, name):
+        if name not in self.indexes:
+            raise OperationFailure(f"index not found with name [{name}]", 27)
+        del self.indexes[name]
+
+    def _check_unique(self, candidate, ignore=None):
+        if "_id" in candidate and any(d is not ignore and d.get("_id") == candidate["_id"] for d in self.docs):
+            raise DuplicateKeyError("duplicate key", 11000)
+        for index in self.indexes.values():
+            if not index["unique"]:
+                continue
+            if index["partial"] and not matches(candidate, index["partial"]):
+                continue
+            key = [get_path(candidate, f) for f in index["fields"]]
+            for doc in self.docs:
+                if doc is ignore:
+                    continue
+                if index["partial"] and not matches(doc, index["partial"]):
+                    continue
+                if [get_path(doc, f) for f in index["fields"]] == key:
+                    raise DuplicateKeyError("duplicate key", 11000)
+
+    async def insert_one(self, doc):
+        self.calls.append("insert_one")
+        doc.setdefault("_id", next(self._ids))
+        self._check_unique(doc)
+        self.docs.append(copy.deepcopy(doc))
+        return FakeResult(inserted_id=doc["_id"])
+
+    async def insert_many(self, docs, ordered=True):
+        self.calls.append("insert_many")
+        errors = []
+        for i, doc in enumerate(docs):
+            try:
+                doc.setdefault("_id", next(self._ids))
+                self._check_unique(doc)
+                self.docs.append(copy.deepcopy(doc))
+            except DuplicateKeyError:
+                errors.append({"index": i, "code": 11000})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(docs) - len(errors)})
+        return FakeResult(inserted_ids=[d["_id"] for d in docs])
+
+    async def find_one(self, query=None, projection=None, sort=None):
+        cursor = self.find(query or {}, projection)
+        if sort:
+            cursor.sort(sort)
+        docs = await cursor.to_list(1)
+        return docs[0] if docs else None
+
+    def find(self, query=None, projection=None):
+        self.calls.append("find")
+        return FakeCursor([copy.deepcopy(d) for d in self.docs if matches(d, query or {})], projection)
+
+    def _update(self, query, update, upsert, many):
+        matched = [d for d in self.docs if matches(d, query)]
+        if not many:
+            matched = matched[:1]
+        for doc in matched:
+            updated = copy.deepcopy(doc)
+            apply_update(updated, update)
+            self._check_unique(updated, ignore=doc)
+            doc.clear()
+            doc.update(updated)
+        upserted_id = None
+        if not matched and upsert:
+            doc = {k: v for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+            apply_update(doc, update, inserting=True)
+            doc["_id"] = upserted_id = query.get("_id", next(self._ids))
+            self._check_unique(doc)
+            self.docs.append(doc)
+        return FakeResult(matched_count=len(matched), modified_count=len(matched), upserted_id=upserted_id)
+
+    async def update_one(self, query, update, upsert=False):
+        self.calls.append("update_one")
+        return self._update(query, update, upsert, many=False)
+
+    async def update_many(self, query, update, upsert=False):
+        self.calls.append("update_many")
+        return self._update(query, update, upsert, many=True)
+
+    async def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=False, sort=None):
+        self.calls.append("find_one_and_update")
+        candidates = [d for d in self.docs if matches(d, query)]
+        if sort:
+            candidates = FakeCursor(candidates).sort(sort).docs
+        before = copy.deepcopy(candidates[0]) if candidates else None
+        if candidates:
+            apply_update(candidates[0], update)
+            after = candidates[0]
+        else:
+            self._update(query, update, upsert, many=False)
+            after = self.docs[-1] if upsert else None
+        doc = after if return_document else before
+        return project(doc, projection) if doc else None
+
+    async def delete_one(self, query):
+        self.calls.append("delete_one")
+        for doc in self.docs:
+            if matches(doc, query):
+                self.docs.remove(doc)
+                return FakeResult(deleted_count=1)
+        return FakeResult(deleted_count=0)
+
+    async def delete_many(self, query):
+        self.calls.append("delete_many")
+        before = len(self.docs)
+        self.docs = [d for d in self.docs if not matches(d, query)]
+        return FakeResult(deleted_count=before - len(self.docs))
+
+    async def count_documents(self, query):
+        self.calls.append("count_documents")
+        return sum(1 for d in self.docs if matches(d, query))
+
+    def aggregate(self, pipeline):
+        self.calls.append("aggregate")
+        return FakeCursor(run_pipeline(copy.deepcopy(self.docs), pipeline))
+
+    async def estimated_document_count(self):
+        self.calls.append("estimated_document_count")
+        return len(self.docs)
+
+    async def bulk_write(self, ops, ordered=True):
+        self.calls.append("bulk_write")
+        errors = []
+        upserted = {}
+        inserted = 0
+        for i, op in enumerate(ops):
+            try:
+                if isinstance(op, InsertOne):
+                    doc = copy.deepcopy(op._doc)
+                    doc.setdefault("_id", next(self._ids))
+                    self._check_unique(doc)
+                    self.docs.append(doc)
+                    inserted += 1
+                elif isinstance(op, UpdateOne):
+                    result = self._update(op._filter, op._doc, op._upsert, many=False)
+                    if result.upserted_id is not None:
+                        upserted[i] = result.upserted_id
+                elif isinstance(op, DeleteOne):
+                    match = next((d for d in self.docs if matches(d, op._filter)), None)
+                    if match is not None:
+                        self.docs.remove(match)
+                else:
+                    raise TypeError(op)
+            except DuplicateKeyError:
+                errors.append({"index": i, "code": 11000, "errmsg": "duplicate key"})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": inserted,
+                                  "upserted": [{"index": i, "_id": _id} for i, _id in upserted.items()]})
+        return FakeResult(bulk_api_result={}, inserted_count=inserted, upserted_ids=upserted)
+
+
+class FakeDb:
+    def __init__(self):
+        self.collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, FakeCollection(name))
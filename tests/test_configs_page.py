@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from tests.fakes import FakeDb
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def setup(monkeypatch):
+    db = FakeDb()
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "kv_cache", server.KvCache())
+    monkeypatch.setattr(server, "seen_index", server.SeenConfigIndex(db.seen_configs))
+    monkeypatch.setattr(server, "stats_counters", server.StatsCounters())
+    return db
+
+
+async def seed(db, count=120):
+    docs = []
+    for i in range(count):
+        status = "active" if i % 3 else "dead"
+        docs.append({
+            "config": f"vless://u@h{i}.example:443", "hash": f"{i:04x}", "type": "vless" if i % 2 else "trojan",
+            "host": f"h{i}.example", "port": 443, "created_at": f"2026-01-01T00:00:{i // 10:02d}",
+            "test_result": {"status": status, "message": status, "latency": i if status == "active" else -1,
+                            "dns": True, "tcp": status == "active"},
+        })
+    await db.configs.insert_many(docs)
+    await server.stats_counters.reconcile()
+    return docs
+
+
+async def all_pages(**params):
+    seen, cursor = [], None
+    while True:
+        page = await server.get_configs(user="admin", cursor=cursor, **params)
+        seen.extend(page["configs"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            return seen, page
+
+
+def test_pages_cover_every_config_once_in_order(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        docs = await seed(db)
+        seen, last = await all_pages(limit=50)
+        keys = [(c["created_at"], c["hash"]) for c in seen]
+        assert keys == sorted(((d["created_at"], d["hash"]) for d in docs), reverse=True)
+        assert len(last["configs"]) == 20
+        assert "dns" not in seen[0]["test_result"] and "latency" in seen[0]["test_result"]
+        assert "_id" not in seen[0]
+        assert last["total"] == 120 and not last["total_exact"]
+        assert "count_documents" not in db.configs.calls
+
+    run(scenario())
+
+
+def test_filters_and_totals(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        await seed(db)
+        seen, page = await all_pages(limit=7, type="vless")
+        assert len(seen) == 60 and {c["type"] for c in seen} == {"vless"}
+        assert page["total"] == 60
+        seen, page = await all_pages(status="active", min_latency=10, max_latency=20)
+        assert sorted(c["test_result"]["latency"] for c in seen) == [10, 11, 13, 14, 16, 17, 19, 20]
+        assert page["total"] is None
+        page = await server.get_configs(user="admin", status="active", min_latency=10, max_latency=20, exact=True)
+        assert page["total"] == 8 and page["total_exact"]
+        seen, page = await all_pages(status="dead", max_latency=1000)
+        assert seen == []
+
+    run(scenario())
+
+
+def test_invalid_cursor_is_rejected(monkeypatch):
+    async def scenario():
+        setup(monkeypatch)
+        with pytest.raises(HTTPException) as error:
+            await server.get_configs(user="admin", cursor="not-a-cursor")
+        assert error.value.status_code == 400
+
+    run(scenario())
+
+
+def test_sort_by_rollups(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        docs = await seed(db, count=30)
+        for i, doc in enumerate(docs):
+            if doc["test_result"]["status"] == "active":
+                rollup = {"p50": (i * 7) % 11, "uptime_24h": float(i % 4 * 25)}
+                await db.configs.update_one({"hash": doc["hash"]}, {"$set": {"rollup": rollup}})
+        seen, _ = await all_pages(limit=4, sort="latency")
+        keys = [(c["rollup"]["p50"], c["hash"]) for c in seen]
+        assert len(keys) == 20 and keys == sorted(keys)
+        seen, _ = await all_pages(limit=3, sort="uptime", type="vless")
+        keys = [(c["rollup"]["uptime_24h"], c["hash"]) for c in seen]
+        assert keys == sorted(keys, reverse=True) and {c["type"] for c in seen} == {"vless"}
+        with pytest.raises(HTTPException) as error:
+            await server.get_configs(user="admin", sort="popular")
+        assert error.value.status_code == 400
+
+    run(scenario())
@@ -0,0 +1,103 @@
+import asyncio
+
+import server
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class CountingLookup:
+    def __init__(self, answers, delay=0.05):
+        self.answers = answers
+        self.delay = delay
+        self.calls = []
+
+    async def __call__(self, host):
+        self.calls.append(host)
+        await asyncio.sleep(self.delay)
+        answer = self.answers[host]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+def test_concurrent_lookups_are_coalesced_and_cached():
+    lookup = CountingLookup({"cdn.example": (["10.0.0.1"], 300)})
+    resolver = server.DnsResolver(lookup=lookup)
+
+    async def scenario():
+        results = await asyncio.gather(*(resolver.resolve("CDN.example") for _ in range(10)))
+        results.append(await resolver.resolve("cdn.example"))
+        return results
+
+    results = run(scenario())
+    assert all(r == ["10.0.0.1"] for r in results)
+    assert lookup.calls == ["cdn.example"]
+    stats = resolver.stats()
+    assert stats["misses"] == 1 and stats["coalesced"] == 9 and stats["hits"] == 1
+    assert stats["size"] == 1 and stats["in_flight"] == 0
+    assert stats["hit_rate"] == 0.909
+
+
+def test_failures_are_negatively_cached(monkeypatch):
+    lookup = CountingLookup({"gone.example": OSError("nxdomain")}, delay=0)
+    resolver = server.DnsResolver(lookup=lookup)
+    assert run(resolver.resolve("gone.example")) == []
+    assert run(resolver.resolve("gone.example")) == []
+    assert len(lookup.calls) == 1
+    assert resolver.stats()["negative_hits"] == 1
+
+    now = server.time.monotonic()
+    monkeypatch.setattr(server.time, "monotonic", lambda: now + server.DNS_NEGATIVE_TTL + 1)
+    run(resolver.resolve("gone.example"))
+    assert len(lookup.calls) == 2
+
+
+def test_ttl_is_clamped_and_cache_is_bounded(monkeypatch):
+    lookup = CountingLookup({f"h{i}.example": ([f"10.0.0.{i}"], 1) for i in range(5)}, delay=0)
+    resolver = server.DnsResolver(lookup=lookup, max_size=3)
+    for i in range(5):
+        run(resolver.resolve(f"h{i}.example"))
+    assert list(resolver.cache) == ["h2.example", "h3.example", "h4.example"]
+    expires = resolver.cache["h4.example"][1] - server.time.monotonic()
+    assert expires > server.DNS_MIN_TTL - 1
+
+
+def test_ip_literals_skip_lookup():
+    lookup = CountingLookup({})
+    resolver = server.DnsResolver(lookup=lookup)
+    assert run(resolver.resolve("127.0.0.1")) == ["127.0.0.1"]
+    assert run(resolver.resolve("::1")) == ["::1"]
+    assert lookup.calls == []
+
+
+def test_dns_lookup_falls_back_to_system_resolver(monkeypatch):
+    async def broken_resolve(*args, **kwargs):
+        raise server.dns.resolver.NoResolverConfiguration()
+
+    async def fake_system_lookup(host):
+        return ["192.0.2.7"], server.DNS_MIN_TTL
+
+    monkeypatch.setattr(server.dns.asyncresolver, "resolve", broken_resolve)
+    monkeypatch.setattr(server, "system_lookup", fake_system_lookup)
+    assert run(server.dns_lookup("hosts-file.example")) == (["192.0.2.7"], server.DNS_MIN_TTL)
+
+
+def test_dns_lookup_keeps_negative_answers(monkeypatch):
+    async def system_lookup(host):
+        raise AssertionError("negative answers must not fall back")
+
+    async def nxdomain(*args, **kwargs):
+        raise server.dns.resolver.NXDOMAIN()
+
+    async def timeout(*args, **kwargs):
+        raise server.dns.exception.Timeout()
+
+    monkeypatch.setattr(server, "system_lookup", system_lookup)
+    monkeypatch.setattr(server.dns.asyncresolver, "resolve", nxdomain)
+    assert run(server.dns_lookup("missing.example")) == ([], server.DNS_NEGATIVE_TTL)
+    monkeypatch.setattr(server.dns.asyncresolver, "resolve", timeout)
+    resolver = server.DnsResolver()
+    assert run(resolver.resolve("slow.example")) == []
+    assert resolver.counters["failures"] == 1
@@ -0,0 +1,57 @@
+import random
+
+import server
+
+
+def sample_body(count=300, seed=7):
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        scheme = rng.choice(["vless", "vmess", "trojan", "ss"])
+        lines.append(f'<div class="cfg">{scheme}://id{i}@host{i}.example:{443 + i}?type=ws&path=%2F{i}#node-{i}</div>')
+    return "\n".join(lines)
+
+
+def test_scan_configs_tags_and_keeps_first_seen_order():
+    text = 'x trojan://b@h:2 <p>vless://a@h:1?type=ws#r</p> "ss://c@h:3" trojan://b@h:2 vmess://eyJ9'
+    assert server.scan_configs(text) == [
+        ("trojan://b@h:2", "trojan"),
+        ("vless://a@h:1?type=ws#r", "vless"),
+        ("ss://c@h:3", "ss"),
+        ("vmess://eyJ9", "vmess"),
+    ]
+    assert server.extract_configs(text) == [config for config, _ in server.scan_configs(text)]
+
+
+def test_scan_configs_ignores_other_schemes():
+    assert server.scan_configs("https://example.com/a http://b vless:/x") == []
+
+
+def test_register_config_scheme(monkeypatch):
+    monkeypatch.setattr(server, "CONFIG_SCHEMES", list(server.CONFIG_SCHEMES))
+    monkeypatch.setattr(server, "CONFIG_SCANNER", server.CONFIG_SCANNER)
+    server.register_config_scheme("hysteria2")
+    server.register_config_scheme("tuic")
+    text = "hysteria2://pw@h:443?sni=x tuic://u:p@h:8443 trojan://p@h:1"
+    assert [t for _, t in server.scan_configs(text)] == ["hysteria2", "tuic", "trojan"]
+    assert server.detect_config_type("tuic://u:p@h:8443") == "tuic"
+
+
+def test_streaming_extractor_handles_chunk_boundaries():
+    body = sample_body()
+    expected = set(server.scan_configs(body))
+    for chunk_size in (1, 7, 64, 1000):
+        extractor = server.StreamingConfigExtractor()
+        found = []
+        for i in range(0, len(body), chunk_size):
+            found.extend(extractor.feed(body[i:i + chunk_size]))
+        found.extend(extractor.close())
+        assert len(found) == len(set(found))
+        assert set(found) == expected
+
+
+def test_streaming_extractor_bounds_carry():
+    extractor = server.StreamingConfigExtractor(max_config_length=32)
+    extractor.feed("x" * 10_000)
+    assert len(extractor.carry) == 32
+    assert extractor.feed(" trojan://p@h:1 ") == [("trojan://p@h:1", "trojan")]
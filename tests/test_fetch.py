@@ -0,0 +1,212 @@
+import asyncio
+import time
+
+import httpx
+
+import server
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def use_transport(handler):
+    server.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def test_fetch_sources_runs_concurrently():
+    async def handler(request):
+        await asyncio.sleep(0.2)
+        return httpx.Response(200, text=f"trojan://pass@{request.url.host}:443#x")
+
+    async def scenario():
+        use_transport(handler)
+        links = [f"https://src{i}.example/sub" for i in range(8)]
+        start = time.monotonic()
+        results = await server.fetch_sources(links)
+        elapsed = time.monotonic() - start
+        await server.close_http_client()
+        return links, results, elapsed
+
+    links, results, elapsed = run(scenario())
+    assert elapsed < 0.8
+    assert [r["url"] for r in results] == links
+    assert all(r["status_code"] == 200 and len(r["configs"]) == 1 for r in results)
+    assert all(r["elapsed_ms"] >= 150 for r in results)
+
+
+def test_fetch_sources_respects_per_host_limit(monkeypatch):
+    monkeypatch.setattr(server, "FETCH_PER_HOST_LIMIT", 2)
+    in_flight = {"now": 0, "peak": 0}
+
+    async def handler(request):
+        in_flight["now"] += 1
+        in_flight["peak"] = max(in_flight["peak"], in_flight["now"])
+        await asyncio.sleep(0.05)
+        in_flight["now"] -= 1
+        return httpx.Response(200, text="")
+
+    async def scenario():
+        use_transport(handler)
+        await server.fetch_sources([f"https://same.example/{i}" for i in range(6)])
+        await server.close_http_client()
+
+    run(scenario())
+    assert in_flight["peak"] == 2
+
+
+def test_fetch_source_reports_errors():
+    def handler(request):
+        raise httpx.ConnectError("boom")
+
+    async def scenario():
+        use_transport(handler)
+        results = await server.fetch_sources(["https://down.example/sub"])
+        await server.close_http_client()
+        return results
+
+    [result] = run(scenario())
+    assert result["error"] == "boom"
+    assert result["configs"] == []
+    assert server.summarize_source(result)["configs"] == 0
+
+
+def test_fetch_source_sends_validators_and_skips_not_modified():
+    seen = {}
+
+    def handler(request):
+        seen.update(request.headers)
+        return httpx.Response(304)
+
+    async def scenario():
+        use_transport(handler)
+        state = {"url": "https://a.example/sub", "etag": '"v1"', "last_modified": "Mon, 01 Jan 2024 00:00:00 GMT",
+                 "bytes": 2048, "parse_ms": 3.5, "content_hash": "x"}
+        results = await server.fetch_sources(["https://a.example/sub"], {"https://a.example/sub": state})
+        await server.close_http_client()
+        return results
+
+    [result] = run(scenario())
+    assert seen["if-none-match"] == '"v1"'
+    assert seen["if-modified-since"] == "Mon, 01 Jan 2024 00:00:00 GMT"
+    assert result["skipped"] == "not_modified"
+    assert result["saved_bytes"] == 2048
+    assert result["saved_cpu_ms"] == 3.5
+    assert result["configs"] == []
+
+
+def test_fetch_source_skips_identical_body_and_records_state():
+    body = "trojan://pass@host.example:443#a"
+
+    def handler(request):
+        return httpx.Response(200, text=body, headers={"ETag": '"v2"'})
+
+    async def scenario():
+        use_transport(handler)
+        [first] = await server.fetch_sources(["https://a.example/sub"])
+        [second] = await server.fetch_sources(["https://a.example/sub"], {"https://a.example/sub": first["state"]})
+        await server.close_http_client()
+        return first, second
+
+    first, second = run(scenario())
+    assert first["skipped"] is None
+    assert first["configs"] == [(body, "trojan")]
+    assert first["state"]["etag"] == '"v2"'
+    assert first["state"]["content_hash"]
+    assert second["skipped"] == "unchanged"
+    assert second["configs"] == []
+    assert second["state"]["last_changed_at"] == first["state"]["last_changed_at"]
+    assert "state" not in server.summarize_source(second)
+
+
+def test_fetch_source_streams_and_enforces_max_bytes(monkeypatch):
+    monkeypatch.setattr(server, "FETCH_CHUNK_SIZE", 16)
+    monkeypatch.setattr(server, "FETCH_MAX_BYTES", 64)
+    body = "trojan://p@a.example:1 " + "x" * 200 + " trojan://p@b.example:2"
+
+    def handler(request):
+        return httpx.Response(200, content=body.encode())
+
+    async def scenario():
+        use_transport(handler)
+        results = await server.fetch_sources(["https://big.example/sub"])
+        await server.close_http_client()
+        return results
+
+    [result] = run(scenario())
+    assert result["truncated"] is True
+    assert result["bytes"] <= 64
+    assert result["configs"] == [("trojan://p@a.example:1", "trojan")]
+    assert result["state"]["content_hash"] is None
+
+
+def test_truncation_inside_a_uri_drops_the_partial_config(monkeypatch):
+    monkeypatch.setattr(server, "FETCH_CHUNK_SIZE", 16)
+    monkeypatch.setattr(server, "FETCH_MAX_BYTES", 40)
+    body = "trojan://password@averylonghost.example.com:443 trojan://p@b.example:2"
+
+    def handler(request):
+        return httpx.Response(200, content=body.encode())
+
+    async def scenario():
+        use_transport(handler)
+        results = await server.fetch_sources(["https://big.example/sub"])
+        await server.close_http_client()
+        return results
+
+    [result] = run(scenario())
+    assert result["truncated"] is True
+    assert result["configs"] == []
+
+
+def test_iter_sources_yields_in_completion_order():
+    async def handler(request):
+        await asyncio.sleep(0.2 if request.url.host == "slow.example" else 0.01)
+        return httpx.Response(200, text="")
+
+    async def scenario():
+        use_transport(handler)
+        order = [src["url"] async for src in server.iter_sources(["https://slow.example/", "https://fast.example/"])]
+        await server.close_http_client()
+        return order
+
+    assert run(scenario()) == ["https://fast.example/", "https://slow.example/"]
+
+
+def test_sink_gets_configs_chunk_by_chunk_and_unchanged_chunks_are_skipped(monkeypatch):
+    monkeypatch.setattr(server, "FETCH_CHUNK_SIZE", 64)
+    lines = [f"trojan://p@h{i:03d}.example:443" for i in range(40)]
+    bodies = ["\n".join(lines), "\n".join(lines[:30] + ["trojan://p@changed.example:443"] + lines[31:])]
+    first_size = len(bodies[0])
+
+    def handler(request):
+        return httpx.Response(200, text=bodies.pop(0) if len(bodies) > 1 else bodies[0])
+
+    async def fetch(state):
+        batches = []
+
+        async def sink(configs):
+            batches.append([config for config, _ in configs])
+
+        global_limit = asyncio.Semaphore(1)
+        result = await server.fetch_source("https://a.example/sub", global_limit, {}, state, sink)
+        return result, batches
+
+    async def scenario():
+        use_transport(handler)
+        first, first_batches = await fetch(None)
+        second, second_batches = await fetch(first["state"])
+        third, third_batches = await fetch(second["state"])
+        await server.close_http_client()
+        return first, first_batches, second, second_batches, third, third_batches
+
+    first, first_batches, second, second_batches, third, third_batches = run(scenario())
+    assert first["configs"] == [] and first["found"] == 40
+    assert len(first_batches) > 10 and max(len(b) for b in first_batches) <= 3
+    assert [c for batch in first_batches for c in batch] == lines
+    assert len(first["state"]["chunk_hashes"]) == -(-first_size // 64)
+    # Only the chunks from the change onwards are scanned again.
+    rescanned = [c for batch in second_batches for c in batch]
+    assert "trojan://p@changed.example:443" in rescanned and lines[0] not in rescanned
+    assert set(rescanned) <= set(lines[28:]) | {"trojan://p@changed.example:443"}
+    assert third["skipped"] == "unchanged" and third_batches == []
@@ -0,0 +1,126 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import server
+from tests.fakes import FakeDb
+
+START = datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def setup(monkeypatch):
+    db = FakeDb()
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "stats_counters", server.StatsCounters())
+    monkeypatch.setattr(server, "subscriptions", server.SubscriptionCache())
+    return db
+
+
+def probe(latency):
+    return {"status": "active", "latency": latency} if latency >= 0 else {"status": "failed", "latency": -1}
+
+
+def replay(latencies, step=timedelta(minutes=30), start=START, history=None):
+    now = start
+    for i, latency in enumerate(latencies):
+        now = start + i * step
+        history = server.apply_history(history, probe(latency), now)
+    return history, server.compute_rollup(history, now)[0]
+
+
+def test_percentiles_over_successful_samples():
+    _, rollup = replay([10, 20, 30, 40, -1, 50, 60, 70, 80, 90, 100])
+    assert rollup["p50"] == 50 and rollup["p95"] == 100
+    assert rollup["samples"] == 11
+    _, rollup = replay([-1, -1])
+    assert rollup["p50"] == -1 and rollup["uptime_7d"] == 0
+
+
+def test_uptime_windows():
+    # A day of failures a week ago, then 23 hours of successes, then an outage of the last hour.
+    history, _ = replay([-1] * 24, step=timedelta(hours=1))
+    history, _ = replay([40] * 23, step=timedelta(hours=1), start=START + timedelta(days=6), history=history)
+    now = START + timedelta(days=6, hours=23)
+    history, rollup = replay([-1, -1], start=now, history=history)
+    assert rollup["uptime_1h"] == round(100 * 1 / 3, 1)
+    assert rollup["uptime_24h"] == round(100 * 23 / 25, 1)
+    assert rollup["uptime_7d"] < rollup["uptime_24h"]
+    _, expired = server.compute_rollup(history, now + timedelta(days=1))
+    assert expired == [str(server.hour_index(START + timedelta(hours=h))) for h in range(24)]
+
+
+def test_history_is_bounded(monkeypatch):
+    monkeypatch.setattr(server, "PROBE_HISTORY_SAMPLES", 8)
+    history, rollup = replay(list(range(200)), step=timedelta(minutes=1))
+    assert history["latencies"] == list(range(192, 200))
+    assert history["count"] == 200 and rollup["samples"] == 8
+    assert sorted(history["probes"].values()) == [20, 60, 60, 60]
+
+
+def test_writes_fold_rollups_and_record_buckets(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        parsed = server.ParsedConfig("vless://u@a.example:443")
+        for latency in (30, -1, 50):
+            await server.upsert_config(parsed, probe(latency))
+        doc = await db.configs.find_one({"hash": parsed.hash})
+        assert doc["rollup"]["p50"] == 30 and doc["rollup"]["p95"] == 50
+        assert doc["rollup"]["uptime_24h"] == round(200 / 3, 1)
+        assert doc["history"]["latencies"] == [30, -1, 50] and doc["history"]["count"] == 3
+        assert (await db.stats.find_one({"_id": "counters"}))["configs_total"] == 1
+        bucket = await db.probe_history.find_one({"hash": parsed.hash})
+        assert bucket["count"] == 3 and bucket["ok"] == 2
+        assert [s[1] for s in bucket["samples"]] == [30, -1, 50]
+
+        batcher = server.ConfigWriteBatcher(max_size=10)
+        await asyncio.gather(batcher.add_config(parsed, probe(70)),
+                             batcher.add_config(server.ParsedConfig("trojan://p@b.example:443"), probe(20)))
+        doc = await db.configs.find_one({"hash": parsed.hash})
+        assert doc["rollup"]["samples"] == 4 and doc["rollup"]["p95"] == 70
+        assert db.probe_history.calls.count("bulk_write") == 4
+        assert (await db.probe_history.find_one({"hash": parsed.hash}))["count"] == 4
+
+        body = await server.get_config_history(parsed.hash, user="admin")
+        assert body["rollup"]["samples"] == 4 and body["days"][0]["count"] == 4
+
+    run(scenario())
+
+
+def test_stale_rollup_writes_are_dropped(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        parsed = server.ParsedConfig("vless://u@a.example:443")
+        # Two writers race: both probes land, but the slower writer's rollup was computed from one
+        # probe and must not overwrite the rollup covering both.
+        await asyncio.gather(server.upsert_config(parsed, probe(30)), server.upsert_config(parsed, probe(60)))
+        doc = await db.configs.find_one({"hash": parsed.hash})
+        assert sorted(doc["history"]["latencies"]) == [30, 60]
+        assert doc["rollup"]["samples"] == 2
+        assert (await db.stats.find_one({"_id": "counters"}))["configs_total"] == 1
+        await server.write_rollups([server.rollup_update(
+            parsed.hash, server.apply_history(None, probe(10), START), START)])
+        assert (await db.configs.find_one({"hash": parsed.hash}))["rollup"]["samples"] == 2
+
+    run(scenario())
+
+
+def test_subscription_ranks_by_uptime_then_latency(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        await db.configs.insert_many([
+            {"config": "vless://u@flaky.example:443", "type": "vless", "test_result": {"status": "active", "latency": 5},
+             "rollup": {"p50": 5, "uptime_24h": 60.0}},
+            {"config": "vless://u@steady.example:443", "type": "vless", "test_result": {"status": "active", "latency": 90},
+             "rollup": {"p50": 80, "uptime_24h": 100.0}},
+            {"config": "vless://u@quick.example:443", "type": "vless", "test_result": {"status": "active", "latency": 40},
+             "rollup": {"p50": 30, "uptime_24h": 100.0}},
+        ])
+        blob = await server.subscriptions.get()
+        assert server.base64.b64decode(blob["body"]).decode().split("\n") == [
+            "vless://u@quick.example:443", "vless://u@steady.example:443", "vless://u@flaky.example:443"]
+        assert (await server.subscriptions.get(min_uptime=99))["count"] == 2
+
+    run(scenario())
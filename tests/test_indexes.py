@@ -0,0 +1,103 @@
+import asyncio
+import os
+import re
+import uuid
+from pathlib import Path
+
+import pytest
+from pymongo.errors import OperationFailure
+
+import server
+from tests.fakes import FakeDb
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def use_fake_db(monkeypatch):
+    db = FakeDb()
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "seen_index", server.SeenConfigIndex(db.seen_configs))
+    return db
+
+
+def leading_field(keys):
+    return keys if isinstance(keys, str) else keys[0][0]
+
+
+def test_ensure_indexes_creates_every_spec_and_is_idempotent(monkeypatch):
+    async def scenario():
+        db = use_fake_db(monkeypatch)
+        await server.ensure_indexes()
+        await server.ensure_indexes()
+        for name, specs in server.INDEX_SPECS.items():
+            assert len(db[name].indexes) == len(specs)
+        assert db.kv_store.indexes["key"]["unique"]
+        assert db.configs.indexes["hash"]["unique"]
+        assert "h" in db.seen_configs.indexes
+
+    run(scenario())
+
+
+def test_index_failures_do_not_stop_startup(monkeypatch):
+    async def scenario():
+        db = use_fake_db(monkeypatch)
+
+        async def conflict(keys, **options):
+            raise OperationFailure("E11000 duplicate key", 11000)
+
+        monkeypatch.setattr(db.configs, "create_index", conflict)
+        await server.ensure_indexes()
+        assert db.submissions.indexes
+
+    run(scenario())
+
+
+def test_every_query_shape_has_a_leading_index():
+    indexed = {name: [leading_field(keys) for keys, _ in specs] for name, specs in server.INDEX_SPECS.items()}
+    indexed["seen_configs"] = ["h", "seen_at"]
+    for name, query, sort in server.QUERY_SHAPES:
+        # Every branch of an $or needs its own index.
+        for branch in query.get("$or", [query]):
+            usable = set(branch) | ({sort[0][0]} if sort else set())
+            assert usable & set(indexed[name]), (name, query, sort)
+
+
+def test_every_query_in_server_has_a_shape():
+    # Literal filters in server.py; a new query on an unlisted field needs a QUERY_SHAPES entry (and index).
+    source = Path(server.__file__).read_text()
+    queried = set(re.findall(
+        r'db\.(\w+)\.(?:find|find_one|find_one_and_update|count_documents|update_one|update_many|delete_one|delete_many)'
+        r'\(\s*\{"([\w.]+)"', source))
+    shapes = {(name, field) for name, query, _ in server.QUERY_SHAPES
+              for branch in query.get("$or", [query]) for field in branch}
+    assert queried and {(name, field) for name, field in queried if field != "_id"} <= shapes
+
+
+def test_plan_stages_finds_nested_collscan():
+    plan = {"stage": "LIMIT", "inputStage": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}}
+    assert "COLLSCAN" in server.plan_stages(plan)
+    plan = {"queryPlan": {"stage": "FETCH", "inputStages": [{"stage": "IXSCAN"}]}}
+    assert list(server.plan_stages(plan)) == ["FETCH", "IXSCAN"]
+
+
+@pytest.mark.skipif(not os.environ.get("EXPLAIN_MONGO_URL"), reason="set EXPLAIN_MONGO_URL to explain against a real server")
+def test_no_query_scans_a_collection(monkeypatch):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def scenario():
+        mongo = AsyncIOMotorClient(os.environ["EXPLAIN_MONGO_URL"])
+        db = mongo[f"explain_{uuid.uuid4().hex[:8]}"]
+        monkeypatch.setattr(server, "db", db)
+        monkeypatch.setattr(server, "seen_index", server.SeenConfigIndex(db.seen_configs))
+        try:
+            await server.ensure_indexes()
+            for name, _, _ in server.QUERY_SHAPES:
+                await db[name].insert_one({"placeholder": True})
+            assert await server.explain_queries() == []
+        finally:
+            await mongo.drop_database(db.name)
+            mongo.close()
+
+    run(scenario())
@@ -0,0 +1,111 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import server
+from tests.fakes import FakeDb
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def setup(monkeypatch, gate):
+    db = FakeDb()
+    sent = []
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "seen_index", server.SeenConfigIndex(db.seen_configs))
+    monkeypatch.setattr(server, "FETCH_JOB_REPORT_INTERVAL", 0)
+
+    async def fake_fetch(report=None):
+        await report({"stage": "fetch", "sources_done": 0})
+        await gate.wait()
+        return {"new_configs": 2, "total_checked": 5, "timings": {"fetch_ms": 1, "probe_ms": 2, "deliver_ms": 3, "total_ms": 6}}
+
+    async def fake_send(chat_id, text, reply_markup=None):
+        sent.append((chat_id, text))
+
+    monkeypatch.setattr(server, "fetch_and_distribute", fake_fetch)
+    monkeypatch.setattr(server, "send_telegram", fake_send)
+    return db, sent
+
+
+def test_second_trigger_attaches_to_running_job(monkeypatch):
+    async def scenario():
+        gate = asyncio.Event()
+        db, sent = setup(monkeypatch, gate)
+        await server.ensure_indexes()
+        first, attached_first = await server.start_fetch_job("dashboard:admin")
+        second, attached_second = await server.start_fetch_job("telegram:/check", "42")
+        await asyncio.sleep(0)
+        assert not attached_first and attached_second
+        assert second["job_id"] == first["job_id"]
+        running = await db.fetch_runs.find_one({"job_id": first["job_id"]})
+        assert running["status"] == "running" and running["progress"]["stage"] == "fetch"
+
+        gate.set()
+        await server.fetch_tasks[first["job_id"]]
+        done = await db.fetch_runs.find_one({"job_id": first["job_id"]})
+        assert done["status"] == "done"
+        assert done["timings"]["total_ms"] == 6
+        assert done["finished_at"]
+        assert await db.fetch_runs.count_documents({}) == 1
+        assert [chat for chat, _ in sent] == ["42"]
+
+        third, attached = await server.start_fetch_job("dashboard:admin")
+        assert not attached and third["job_id"] != first["job_id"]
+        await server.fetch_tasks[third["job_id"]]
+
+    run(scenario())
+
+
+def test_stale_running_job_is_replaced(monkeypatch):
+    async def scenario():
+        gate = asyncio.Event()
+        gate.set()
+        db, _ = setup(monkeypatch, gate)
+        await server.ensure_indexes()
+        old = (datetime.now(timezone.utc) - timedelta(seconds=server.FETCH_JOB_STALE_SECONDS + 5)).isoformat()
+        await db.fetch_runs.insert_one({"job_id": "dead", "lock": "fetch", "status": "running", "started_at": old, "heartbeat_at": old})
+        job, attached = await server.start_fetch_job("dashboard:admin")
+        assert not attached and job["job_id"] != "dead"
+        await server.fetch_tasks[job["job_id"]]
+        dead = await db.fetch_runs.find_one({"job_id": "dead"})
+        assert dead["status"] == "failed" and dead["error"] == "stale"
+
+    run(scenario())
+
+
+def test_failed_job_records_error(monkeypatch):
+    async def scenario():
+        db, sent = setup(monkeypatch, asyncio.Event())
+
+        async def broken(report=None):
+            raise RuntimeError("mongo down")
+
+        monkeypatch.setattr(server, "fetch_and_distribute", broken)
+        job, _ = await server.start_fetch_job("telegram:/check", "7")
+        await server.fetch_tasks[job["job_id"]]
+        stored = await db.fetch_runs.find_one({"job_id": job["job_id"]})
+        assert stored["status"] == "failed" and stored["error"] == "mongo down"
+        assert sent == [("7", "❌ Fetch failed: mongo down")]
+
+    run(scenario())
+
+
+def test_cancelled_job_releases_the_lock(monkeypatch):
+    async def scenario():
+        db, sent = setup(monkeypatch, asyncio.Event())
+        await server.ensure_indexes()
+        job, _ = await server.start_fetch_job("dashboard:admin", "42")
+        await asyncio.sleep(0.01)
+        task = server.fetch_tasks[job["job_id"]]
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        cancelled = await db.fetch_runs.find_one({"job_id": job["job_id"]})
+        assert cancelled["status"] == "failed" and cancelled["error"] == "cancelled"
+        assert cancelled["finished_at"] and job["job_id"] not in server.fetch_tasks
+        fresh, attached = await server.start_fetch_job("dashboard:admin")
+        assert not attached and fresh["job_id"] != job["job_id"]
+        server.fetch_tasks[fresh["job_id"]].cancel()
+
+    run(scenario())
@@ -0,0 +1,161 @@
+import asyncio
+
+from pymongo.errors import OperationFailure
+
+import server
+from tests.fakes import FakeCollection, FakeDb
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class FakeChangeStream:
+    def __init__(self, events):
+        self.events = events
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.events.get()
+
+
+class WatchedCollection(FakeCollection):
+    def __init__(self, name, error=None):
+        super().__init__(name)
+        self.events = asyncio.Queue()
+        self.error = error
+
+    def watch(self, full_document=None):
+        if self.error:
+            raise self.error
+        return FakeChangeStream(self.events)
+
+
+def setup(monkeypatch, kv_store=None):
+    db = FakeDb()
+    if kv_store is not None:
+        db.collections["kv_store"] = kv_store
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "kv_cache", server.KvCache())
+    return db
+
+
+def finds(db):
+    return db.kv_store.calls.count("find")
+
+
+def test_hot_settings_are_read_once(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        await db.kv_store.insert_one({"key": "source_links", "value": ["https://a"]})
+        assert await server.kv_get("source_links", []) == ["https://a"]
+        links = await server.kv_get("source_links", [])
+        links.append("https://mutated")
+        assert await server.kv_get("source_links", []) == ["https://a"]
+        assert finds(db) == 1
+        assert await server.kv_get("message_templates", {}) == {}
+        assert await server.kv_get("message_templates", {}) == {}
+        assert finds(db) == 2
+
+    run(scenario())
+
+
+def test_kv_set_writes_through(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        await server.kv_set("channel_ids", ["@one"])
+        assert await server.kv_get("channel_ids", []) == ["@one"]
+        assert finds(db) == 0
+        stored = await db.kv_store.find_one({"key": "channel_ids"})
+        assert stored["value"] == ["@one"]
+
+    run(scenario())
+
+
+def test_uncached_keys_always_hit_mongo(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        await server.kv_set("user_state_1", "awaiting_config")
+        assert await server.kv_get("user_state_1") == "awaiting_config"
+        assert await server.kv_get("user_state_1") == "awaiting_config"
+        assert finds(db) == 2
+
+    run(scenario())
+
+
+def test_wrong_type_falls_back_to_default(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        await db.kv_store.insert_one({"key": "channel_ids", "value": "@oops"})
+        assert await server.kv_get("channel_ids", ["@default"]) == ["@default"]
+
+    run(scenario())
+
+
+def test_change_stream_updates_other_workers(monkeypatch):
+    async def scenario():
+        kv_store = WatchedCollection("kv_store")
+        db = setup(monkeypatch, kv_store)
+        await db.kv_store.insert_one({"key": "source_links", "value": ["https://a"]})
+        watcher = asyncio.create_task(server.watch_kv_changes())
+        await asyncio.sleep(0)
+        assert server.kv_cache.watching
+        assert server.kv_cache.ttl() == server.KV_CACHE_WATCH_TTL
+        assert await server.kv_get("source_links") == ["https://a"]
+
+        await db.kv_store.update_one({"key": "source_links"}, {"$set": {"value": ["https://b"]}})
+        await kv_store.events.put({"operationType": "update", "fullDocument": {"key": "source_links", "value": ["https://b"]}})
+        await asyncio.sleep(0)
+        assert await server.kv_get("source_links") == ["https://b"]
+        assert finds(db) == 1
+
+        await kv_store.events.put({"operationType": "delete", "documentKey": {"_id": 1}})
+        await asyncio.sleep(0)
+        assert not server.kv_cache.cache
+        watcher.cancel()
+        await asyncio.gather(watcher, return_exceptions=True)
+        assert not server.kv_cache.watching
+
+    run(scenario())
+
+
+def test_standalone_server_falls_back_to_ttl(monkeypatch):
+    async def scenario():
+        error = OperationFailure("The $changeStream stage is only supported on replica sets", 40573)
+        setup(monkeypatch, WatchedCollection("kv_store", error))
+        await asyncio.wait_for(server.watch_kv_changes(), 1)
+        assert server.kv_cache.ttl() == server.KV_CACHE_TTL
+
+    run(scenario())
+
+
+def test_write_racing_a_load_wins(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        await db.kv_store.insert_one({"key": "channel_ids", "value": ["@old"]})
+        gate, loaded = asyncio.Event(), asyncio.Event()
+        original = server.kv_load
+
+        async def slow_load(key):
+            result = await original(key)
+            loaded.set()
+            await gate.wait()
+            return result
+
+        monkeypatch.setattr(server, "kv_load", slow_load)
+        reader = asyncio.create_task(server.kv_get("channel_ids"))
+        await loaded.wait()
+        await server.kv_set("channel_ids", ["@new"])
+        gate.set()
+        assert await reader == ["@old"]
+        assert await server.kv_get("channel_ids") == ["@new"]
+
+    run(scenario())
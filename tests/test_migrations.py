@@ -0,0 +1,73 @@
+import asyncio
+import hashlib
+
+import server
+from tests.fakes import FakeDb
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def setup(monkeypatch):
+    db = FakeDb()
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "stats_counters", server.StatsCounters())
+    monkeypatch.setattr(server, "subscriptions", server.SubscriptionCache())
+    monkeypatch.setattr(server, "seen_index", server.SeenConfigIndex(db.seen_configs))
+    return db
+
+
+def legacy_doc(raw, status="active"):
+    return {"config": raw, "type": server.detect_config_type(raw), "hash": hashlib.md5(raw.encode()).hexdigest(),
+            "test_result": {"status": status}}
+
+
+def test_rehash_keeps_legacy_buttons_working_and_merges_duplicates(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        await server.ensure_indexes()
+        first = "vless://u@a.example:443?security=tls&type=ws#one"
+        same = "vless://u@a.example:443?type=ws&security=tls#two"
+        other = "trojan://p@b.example:443#x"
+        await db.configs.insert_many([legacy_doc(first), legacy_doc(same), legacy_doc(other)])
+        current = server.ParsedConfig("ss://YWVzLTI1Ni1nY206cHc@c.example:8388#y")
+        await db.configs.insert_one({"config": current.raw, "type": "ss", "hash": current.hash})
+
+        await server.run_migration("config_identity_hash", server.rehash_configs)
+        result = (await db.migrations.find_one({"_id": "config_identity_hash"}))["result"]
+        assert result == {"rehashed": 2, "merged": 1}
+        hashes = sorted(doc["hash"] for doc in db.configs.docs)
+        assert hashes == sorted(server.get_config_hash(c) for c in (first, other, current.raw))
+        merged = await db.configs.find_one({"hash": server.get_config_hash(first)})
+        assert merged["config"] == first and len(merged["legacy_hashes"]) == 2
+
+        for raw in (first, same, other):
+            cfg = await server.find_config_for_button(hashlib.md5(raw.encode()).hexdigest())
+            assert cfg["config"] == (first if raw == same else raw)
+        counters = await db.stats.find_one({"_id": "counters"})
+        assert counters["configs_total"] == 3
+
+        # A second start finds the marker and leaves the collection alone.
+        db.configs.calls.clear()
+        await server.run_migration("config_identity_hash", server.rehash_configs)
+        assert db.configs.calls == []
+
+    run(scenario())
+
+
+def test_seen_index_is_seeded_from_stored_configs(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        await server.ensure_indexes()
+        stored = [f"trojan://p@h{i}.example:443#x" for i in range(5)]
+        await db.configs.insert_many([{"config": raw, "type": "trojan", "hash": server.get_config_hash(raw)}
+                                      for raw in stored])
+        await server.run_migration("seen_index_seed", server.seed_seen_index)
+        assert (await db.migrations.find_one({"_id": "seen_index_seed"}))["result"] == {"recorded": 5}
+        # A stored config seen again under another remark is not new; an unseen one is.
+        digests = [server.get_config_digest("trojan://p@h3.example:443#renamed"),
+                   server.get_config_digest("trojan://p@fresh.example:443")]
+        assert await server.seen_index.filter_new(digests) == {digests[1]}
+
+    run(scenario())
@@ -0,0 +1,89 @@
+import asyncio
+import base64
+import json
+
+import server
+
+
+def vmess(data):
+    return "vmess://" + base64.b64encode(json.dumps(data).encode()).decode()
+
+
+def same_identity(a, b):
+    return server.get_config_hash(a) == server.get_config_hash(b)
+
+
+def test_remark_query_order_and_encoding_are_cosmetic():
+    base = "vless://0F1E2D3C-0000-4000-8000-000000000000@Host.Example:443?type=ws&path=%2Fws&security=tls#first"
+    assert same_identity(base, "vless://0f1e2d3c-0000-4000-8000-000000000000@host.example:443?security=tls&path=/ws&type=ws#second")
+    assert same_identity(base, base.split("#")[0] + "&sni=")
+    assert not same_identity(base, base.replace(":443", ":8443"))
+    assert not same_identity(base, base.replace("%2Fws", "%2Fother"))
+
+
+def test_trojan_password_is_case_sensitive():
+    assert not same_identity("trojan://Secret@h.example:443", "trojan://secret@h.example:443")
+
+
+def test_vmess_json_serialization_is_cosmetic():
+    fields = {"v": "2", "ps": "node A", "add": "h.example", "port": "443", "id": "ABC", "aid": "0", "net": "ws"}
+    reordered = {"net": "ws", "aid": 0, "id": "abc", "port": 443, "add": "H.example", "ps": "node B", "host": ""}
+    assert same_identity(vmess(fields), vmess(reordered))
+    payload = base64.urlsafe_b64encode(json.dumps({**fields, "ps": "ünïcode ~~~ ???"}).encode()).decode()
+    urlsafe = "vmess://" + payload.rstrip("=")
+    assert "-" in payload or "_" in payload
+    assert same_identity(vmess(fields), urlsafe)
+    assert not same_identity(vmess(fields), vmess({**fields, "port": "8443"}))
+
+
+def test_shadowsocks_encodings_share_identity():
+    userinfo = base64.urlsafe_b64encode(b"aes-256-gcm:pass").decode().rstrip("=")
+    sip002 = f"ss://{userinfo}@1.2.3.4:8388#a"
+    plain = "ss://AES-256-GCM:pass@1.2.3.4:8388#b"
+    legacy = "ss://" + base64.b64encode(b"aes-256-gcm:pass@1.2.3.4:8388").decode() + "#c"
+    assert same_identity(sip002, plain)
+    assert same_identity(sip002, legacy)
+
+
+def test_unparseable_configs_fall_back_to_raw_without_remark():
+    assert server.normalize_config("vless://garbage#x") == "vless://garbage"
+    assert server.normalize_config("vmess://!!!#x") == "vmess://!!!"
+
+
+def test_parsed_config_fields():
+    parsed = server.ParsedConfig("vless://ID@Host.Example:8443?type=ws&path=%2Fws#name")
+    assert (parsed.type, parsed.host, parsed.port) == ("vless", "host.example", 8443)
+    assert parsed.params == {"path": "/ws", "type": "ws"}
+    assert parsed.hash == server.get_config_hash(parsed.raw)
+    assert parsed.server == "host.example:8443"
+    assert not hasattr(parsed, "__dict__")
+
+    parsed = server.ParsedConfig(vmess({"add": "V.example", "port": "2053", "id": "x", "net": "grpc", "ps": "n"}))
+    assert (parsed.type, parsed.host, parsed.port, parsed.params) == ("vmess", "v.example", 2053, {"net": "grpc"})
+
+    parsed = server.ParsedConfig("trojan://nohost#x")
+    assert (parsed.host, parsed.port, parsed.server) == (None, None, "Unknown")
+
+
+def test_vmess_is_decoded_once_through_the_pipeline(monkeypatch):
+    calls = []
+    decode = server.b64decode_loose
+
+    def counting_decode(data):
+        calls.append(data)
+        return decode(data)
+
+    async def templates(key, default=None):
+        return {}
+
+    monkeypatch.setattr(server, "b64decode_loose", counting_decode)
+    monkeypatch.setattr(server, "kv_get", templates)
+    parsed = server.ParsedConfig(vmess({"add": "h.example", "port": 443, "id": "abc"}), "vmess")
+    result = {"status": "active", "message": "Online - 5ms"}
+    msg = asyncio.run(server.format_config_message(parsed, result))
+    keyboard = server.create_inline_keyboard(parsed)
+    doc = server.config_document(parsed, result)
+    assert "h.example:443" in msg
+    assert keyboard["inline_keyboard"][0][0]["callback_data"] == f"copy_{parsed.hash}"
+    assert (doc["hash"], doc["host"], doc["port"]) == (parsed.hash, "h.example", 443)
+    assert len(calls) == 1
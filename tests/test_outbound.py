@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+import server
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class FakeTelegram:
+    def __init__(self, delay=0.0, throttle=None):
+        self.delay = delay
+        self.throttle = dict(throttle or {})
+        self.sent = []
+
+    async def send_message(self, chat_id, text, reply_markup=None, parse_mode="Markdown"):
+        await asyncio.sleep(self.delay)
+        if self.throttle.get(chat_id):
+            self.throttle[chat_id] -= 1
+            return server.TelegramResult(ok=False, error_code=429, retry_after=0.2)
+        self.sent.append((chat_id, text, time.monotonic()))
+        return server.TelegramResult(ok=True, result={"chat": chat_id})
+
+
+def test_token_bucket_limits_rate():
+    async def scenario():
+        bucket = server.TokenBucket(rate=20, capacity=2)
+        start = time.monotonic()
+        for _ in range(6):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    assert 0.15 < run(scenario()) < 0.4
+
+
+def test_chats_are_sent_in_parallel_and_in_order(monkeypatch):
+    monkeypatch.setattr(server, "TELEGRAM_CHAT_BURST", 10)
+    fake = FakeTelegram(delay=0.05)
+
+    async def scenario():
+        scheduler = server.OutboundScheduler(client=fake)
+        start = time.monotonic()
+        futures = [scheduler.submit(chat, f"m{i}") for i in range(3) for chat in ("-100a", "-100b", "-100c", "-100d")]
+        results = await asyncio.gather(*futures)
+        return scheduler, results, time.monotonic() - start
+
+    scheduler, results, elapsed = run(scenario())
+    assert all(r.ok for r in results)
+    assert elapsed < 0.4
+    for chat in ("-100a", "-100b", "-100c", "-100d"):
+        assert [text for c, text, _ in fake.sent if c == chat] == ["m0", "m1", "m2"]
+    stats = scheduler.stats()
+    assert stats["sent"] == 12 and stats["queued"] == 0 and stats["active_chats"] == 0
+
+
+def test_retry_after_is_honoured(monkeypatch):
+    monkeypatch.setattr(server, "TELEGRAM_GROUP_RATE_PER_MIN", 600)
+    fake = FakeTelegram(throttle={"-100a": 1})
+
+    async def scenario():
+        scheduler = server.OutboundScheduler(client=fake)
+        start = time.monotonic()
+        results = await scheduler.fan_out(["-100a", "-100b"], "hello")
+        return scheduler, results, time.monotonic() - start
+
+    scheduler, results, elapsed = run(scenario())
+    assert [r.ok for r in results] == [True, True]
+    sent_at = {chat: t for chat, _, t in fake.sent}
+    assert sent_at["-100a"] - sent_at["-100b"] >= 0.15
+    assert scheduler.counters["throttled"] == 1
+
+
+def test_queue_depth_is_reported(monkeypatch):
+    monkeypatch.setattr(server, "TELEGRAM_CHAT_BURST", 1)
+    fake = FakeTelegram()
+
+    async def scenario():
+        scheduler = server.OutboundScheduler(client=fake)
+        futures = [scheduler.submit("42", str(i)) for i in range(3)]
+        await asyncio.sleep(0.1)
+        depth = scheduler.stats()["queue_depths"]
+        await scheduler.aclose()
+        await asyncio.gather(*futures, return_exceptions=True)
+        return depth
+
+    assert run(scenario()) == {"42": 1}
+
+
+def test_channel_usernames_use_group_rate():
+    assert server.chat_bucket("@mychannel").rate == server.TELEGRAM_GROUP_RATE_PER_MIN / 60
+    assert server.chat_bucket("-1001").rate == server.TELEGRAM_GROUP_RATE_PER_MIN / 60
+    assert server.chat_bucket("42").rate == server.TELEGRAM_CHAT_RATE
+
+
+def test_idle_buckets_are_dropped(monkeypatch):
+    monkeypatch.setattr(server, "TELEGRAM_CHAT_RATE", 100)
+    monkeypatch.setattr(server, "TELEGRAM_MAX_BUCKETS", 3)
+    fake = FakeTelegram()
+
+    async def scenario():
+        scheduler = server.OutboundScheduler(client=fake)
+        for i in range(10):
+            await scheduler.send(str(i), "hi")
+            await asyncio.sleep(0.02)
+        return scheduler
+
+    scheduler = run(scenario())
+    assert len(scheduler.buckets) <= 1
@@ -0,0 +1,102 @@
+import base64
+import json
+import random
+
+import pytest
+
+import server
+
+
+def b64(text, urlsafe=False, pad=True):
+    encoded = (base64.urlsafe_b64encode if urlsafe else base64.b64encode)(text.encode()).decode()
+    return encoded if pad else encoded.rstrip("=")
+
+
+def vmess_body(**fields):
+    return json.dumps({"v": "2", "ps": "node", "id": "abc", "aid": "0", "net": "ws", **fields})
+
+
+CORPUS = [
+    # (uri, host, port)
+    ("vless://uuid@example.com:443?security=tls&type=ws#n", "example.com", 443),
+    ("vless://uuid@[2001:db8::1]:8443?type=grpc#v6", "2001:db8::1", 8443),
+    ("vless://uuid@Example.COM:443", "example.com", 443),
+    ("trojan://p%40ss@t.example:443?sni=t.example#n", "t.example", 443),
+    ("trojan://pass@[::1]:2053", "::1", 2053),
+    ("ss://" + b64("aes-256-gcm:pw") + "@ss.example:8388#sip002", "ss.example", 8388),
+    ("ss://" + b64("chacha20-ietf-poly1305:p/w+", urlsafe=True, pad=False) + "@ss.example:8388", "ss.example", 8388),
+    ("ss://aes-256-gcm:pw@ss.example:8388", "ss.example", 8388),
+    ("ss://" + b64("aes-256-gcm:pw") + "@ss.example:8388/?plugin=obfs-local%3Bobfs%3Dhttp#p", "ss.example", 8388),
+    ("ss://" + b64("aes-256-gcm:pw@legacy.example:8388") + "#legacy", "legacy.example", 8388),
+    ("ss://" + b64("aes-256-gcm:p@ss@legacy.example:8388", pad=False), "legacy.example", 8388),
+    ("ss://" + b64("aes-256-gcm:pw@2001:db8::2:8388"), "2001:db8::2", 8388),
+    ("vmess://" + b64(vmess_body(add="v.example", port="443")), "v.example", 443),
+    ("vmess://" + b64(vmess_body(add="v.example", port=8080), urlsafe=True, pad=False), "v.example", 8080),
+    ("vmess://" + "\n  ".join(b64(vmess_body(add="v.example", port="2096"))[i:i + 20] for i in range(0, 200, 20)), "v.example", 2096),
+    ("vmess://" + b64(vmess_body(add="v.example")) + "#remark", "v.example", 443),
+    ("vmess://uuid@aead.example:443?encryption=auto#aead", "aead.example", 443),
+]
+
+BROKEN = [
+    ("vless://uuid@example.com", "bad_port"),
+    ("vless://uuid@example.com:99999", "bad_port"),
+    ("vless://uuid@example.com:abc", "bad_port"),
+    ("vless://example.com:443", "missing_credentials"),
+    ("trojan://pass@:443", "missing_host"),
+    ("ss://" + b64("aes-256-gcm") + "@ss.example:8388", "missing_credentials"),
+    ("ss://!!!notbase64", "bad_encoding"),
+    ("vmess://" + b64("not json"), "bad_json"),
+    ("vmess://" + b64("[1, 2]"), "bad_json"),
+    ("vmess://" + b64(vmess_body(port="443")), "missing_host"),
+    ("vmess://" + b64(vmess_body(add="v.example", port="http")), "bad_port"),
+    ("vmess://" + b64("\xff\xfe"), "bad_json"),
+    ("socks://x@h:1", "unknown_scheme"),
+]
+
+
+@pytest.mark.parametrize("uri,host,port", CORPUS)
+def test_corpus_parses(uri, host, port):
+    parsed = server.ParsedConfig(uri)
+    assert parsed.error is None
+    assert (parsed.host, parsed.port) == (host, port)
+
+
+@pytest.mark.parametrize("uri,reason", BROKEN)
+def test_broken_configs_report_a_reason(uri, reason):
+    parsed = server.ParsedConfig(uri)
+    assert parsed.error == reason
+    assert (parsed.host, parsed.port) == (None, None)
+
+
+def test_batch_parser_keeps_order_and_counts_reasons():
+    items = [uri for uri, _, _ in CORPUS] + [uri for uri, _ in BROKEN]
+    parsed, errors = server.parse_configs(items)
+    assert [p.raw for p in parsed] == items
+    assert sum(errors.values()) == len(BROKEN)
+    assert errors["bad_port"] == 4
+    assert set(errors) <= set(server.PARSE_ERRORS)
+    pairs, _ = server.parse_configs([("vless://u@h.example:1", "vless")])
+    assert pairs[0].type == "vless" and pairs[0].error is None
+
+
+def test_fuzzed_configs_never_raise():
+    rng = random.Random(7)
+    alphabet = "abc:/@?#=&[]%+-_=.0123456789\n "
+    seeds = [uri for uri, _, _ in CORPUS]
+    for _ in range(3000):
+        uri = rng.choice(seeds)
+        for _ in range(rng.randint(1, 4)):
+            pos = rng.randrange(len(uri) or 1)
+            action = rng.random()
+            if action < 0.4:
+                uri = uri[:pos] + uri[pos + 1:]
+            elif action < 0.8:
+                uri = uri[:pos] + rng.choice(alphabet) + uri[pos:]
+            else:
+                uri = uri[:pos]
+        parsed = server.ParsedConfig(uri)
+        assert parsed.error in (None,) + server.PARSE_ERRORS
+        if parsed.error is None:
+            assert parsed.host and 0 < parsed.port < 65536
+        else:
+            assert (parsed.host, parsed.port) == (None, None)
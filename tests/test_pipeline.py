@@ -0,0 +1,151 @@
+import asyncio
+
+import pytest
+
+import server
+from tests.fakes import FakeDb
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class FakeSeenIndex:
+    def __init__(self):
+        self.seen = set()
+
+    async def filter_new(self, digests):
+        new = set(digests) - self.seen
+        self.seen |= new
+        return new
+
+
+class FakeOutbound:
+    def __init__(self):
+        self.sent = []
+
+    def submit(self, chat_id, text, reply_markup=None, parse_mode="Markdown"):
+        self.sent.append((chat_id, text))
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(server.TelegramResult(ok=True))
+        return future
+
+
+def setup_pipeline(monkeypatch, sources):
+    db = FakeDb()
+    probed = []
+    outbound = FakeOutbound()
+
+    async def fake_sources(links, states=None, sink=None):
+        for configs in sources:
+            await sink(configs)
+            yield {"url": links[0], "configs": [], "found": len(configs), "skipped": None, "saved_bytes": 0,
+                   "saved_cpu_ms": 0, "state": None, "status_code": 200, "error": None}
+
+    async def no_states(links):
+        return {}
+
+    async def fake_probe(parsed):
+        probed.append(parsed.raw)
+        return {"status": "active", "message": "Online - 1ms", "host": parsed.host, "port": parsed.port}
+
+    async def quiet(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "kv_cache", server.KvCache())
+    monkeypatch.setattr(server, "iter_sources", fake_sources)
+    monkeypatch.setattr(server, "load_source_states", no_states)
+    monkeypatch.setattr(server, "save_source_states", quiet)
+    monkeypatch.setattr(server, "seen_index", FakeSeenIndex())
+    monkeypatch.setattr(server.prober, "probe", fake_probe)
+    monkeypatch.setattr(server, "outbound", outbound)
+    monkeypatch.setattr(server, "send_telegram", quiet)
+    monkeypatch.setattr(server, "stats_counters", server.StatsCounters())
+    monkeypatch.setattr(server, "config_writes", server.ConfigWriteBatcher())
+    return db, probed, outbound
+
+
+def test_unparseable_configs_never_reach_probing(monkeypatch):
+    async def scenario():
+        db, probed, outbound = setup_pipeline(monkeypatch, [[
+            ("vless://u@good.example:443#a", "vless"),
+            ("vless://u@no-port.example#b", "vless"),
+            ("vmess://bm90IGpzb24=", "vmess"),
+            ("trojan://p@good.example:443#c", "trojan"),
+        ]])
+        await server.kv_set("source_links", ["https://src"])
+        await server.kv_set("channel_ids", ["@chan"])
+        result = await server.fetch_and_distribute()
+        assert sorted(probed) == ["trojan://p@good.example:443#c", "vless://u@good.example:443#a"]
+        assert result["parse_errors"] == {"bad_port": 1, "bad_json": 1}
+        assert result["total_checked"] == 2
+        assert len(outbound.sent) == 2
+        assert await db.configs.count_documents({}) == 2
+        assert db.configs.calls.count("bulk_write") == 2 and "update_one" not in db.configs.calls
+        assert result["write_errors"] == 0
+
+    run(scenario())
+
+
+def test_probes_start_during_fetch_and_only_published_configs_are_formatted(monkeypatch):
+    async def scenario():
+        db, probed, outbound = setup_pipeline(monkeypatch, [])
+        formatted = []
+
+        async def slow_sources(links, states=None, sink=None):
+            await sink([("vless://u@first.example:443#a", "vless")])
+            # The second source only arrives once the first one's config has been probed.
+            for _ in range(100):
+                if probed:
+                    break
+                await asyncio.sleep(0.01)
+            assert probed == ["vless://u@first.example:443#a"]
+            await sink([("trojan://p@second.example:443#b", "trojan"), ("trojan://p@third.example:443#c", "trojan")])
+            yield {"url": links[0], "configs": [], "found": 3, "skipped": None, "saved_bytes": 0,
+                   "saved_cpu_ms": 0, "state": None, "status_code": 200, "error": None}
+
+        async def format_message(parsed, test_result):
+            formatted.append(parsed.raw)
+            return parsed.raw
+
+        monkeypatch.setattr(server, "iter_sources", slow_sources)
+        monkeypatch.setattr(server, "format_config_message", format_message)
+        monkeypatch.setattr(server, "PUBLISH_LIMIT", 1)
+        await server.kv_set("source_links", ["https://src"])
+        await server.kv_set("channel_ids", ["@chan"])
+        result = await server.fetch_and_distribute()
+        assert len(probed) == 3 and result["total_checked"] == 3
+        assert formatted == ["vless://u@first.example:443#a"] and len(outbound.sent) == 1
+        assert await db.configs.count_documents({}) == 3
+
+    run(scenario())
+
+
+def test_unparseable_submissions_are_not_approved(monkeypatch):
+    async def scenario():
+        db, probed, outbound = setup_pipeline(monkeypatch, [])
+        replies = []
+
+        async def send_telegram(chat_id, text, reply_markup=None):
+            replies.append(text)
+
+        async def answer_callback(*args):
+            pass
+
+        monkeypatch.setattr(server, "send_telegram", send_telegram)
+        monkeypatch.setattr(server, "answer_callback", answer_callback)
+        monkeypatch.setattr(server, "ADMIN_CHAT_ID", "1")
+        bad = "vless://u@no-port.example#b"
+        await db.submissions.insert_one({"config": bad, "type": "vless", "status": "pending"})
+
+        with pytest.raises(server.HTTPException) as e:
+            await server.handle_submission("approve", server.ConfigSubmission(config=bad), user="admin")
+        assert e.value.status_code == 400
+        await server.handle_callback({"id": "c", "message": {"chat": {"id": 1}},
+                                      "data": f"approve_{server.get_config_hash(bad)}"})
+        assert "bad_port" in replies[-1]
+        assert probed == [] and outbound.sent == [] and await db.configs.count_documents({}) == 0
+        assert (await db.submissions.find_one({}))["status"] == "pending"
+
+    run(scenario())
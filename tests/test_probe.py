@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+import server
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def start_listener():
+    srv = await asyncio.start_server(lambda r, w: w.close(), "127.0.0.1", 0)
+    return srv, srv.sockets[0].getsockname()[1]
+
+
+def test_probe_against_local_listener():
+    async def scenario():
+        srv, port = await start_listener()
+        async with srv:
+            prober = server.ConfigProber()
+            return await prober.probe(f"trojan://p@127.0.0.1:{port}#x"), port
+
+    result, port = run(scenario())
+    assert result["status"] == "active"
+    assert result["port"] == port
+
+
+def test_probe_reports_unparseable_config():
+    result = run(server.ConfigProber().probe("vless://garbage"))
+    assert result["status"] == "error"
+
+
+def test_probe_many_streams_in_completion_order_with_limits(monkeypatch):
+    in_flight = {"total": 0, "peak": 0, "per_host": {}, "host_peak": 0}
+
+    async def fake_probe_endpoint(host, port):
+        in_flight["total"] += 1
+        in_flight["per_host"][host] = in_flight["per_host"].get(host, 0) + 1
+        in_flight["peak"] = max(in_flight["peak"], in_flight["total"])
+        in_flight["host_peak"] = max(in_flight["host_peak"], in_flight["per_host"][host])
+        await asyncio.sleep(0.5 if host == "slow.example" else 0.05)
+        in_flight["total"] -= 1
+        in_flight["per_host"][host] -= 1
+        return {"host": host, "port": port, "status": "active"}
+
+    monkeypatch.setattr(server, "probe_endpoint", fake_probe_endpoint)
+    configs = ["trojan://p@slow.example:1"] + [f"trojan://p@h{i % 3}.example:{i}" for i in range(12)]
+
+    async def scenario():
+        prober = server.ConfigProber(concurrency=4, per_host_limit=1)
+        start = time.monotonic()
+        order = []
+        async for config, result in prober.probe_many(configs):
+            order.append((config, time.monotonic() - start))
+        return prober, order
+
+    prober, order = run(scenario())
+    assert {c for c, _ in order} == set(configs)
+    assert order[0][0] != configs[0]
+    assert order[0][1] < 0.3
+    assert order[-1][0] == configs[0]
+    assert in_flight["peak"] <= 4
+    assert in_flight["host_peak"] == 1
+    assert prober.host_limits == {}
+
+
+def test_probe_results_are_shared_per_endpoint(monkeypatch):
+    monkeypatch.setattr(server, "probe_cache", server.ProbeCache())
+
+    async def scenario():
+        srv, port = await start_listener()
+        async with srv:
+            prober = server.ConfigProber()
+            first = await prober.probe(f"trojan://a@127.0.0.1:{port}#one")
+            second = await prober.probe(f"vless://b@127.0.0.1:{port}?type=ws#two")
+            return first, second
+
+    first, second = run(scenario())
+    assert first["status"] == second["status"] == "active"
+    assert first["cached"] is False
+    assert second["cached"] is True
+    assert second["latency"] == first["latency"]
+
+
+def test_probe_cache_coalesces_and_uses_status_ttls(monkeypatch):
+    calls = []
+
+    async def fake_tcp_probe(addresses, port):
+        calls.append((addresses[0], port))
+        await asyncio.sleep(0.05)
+        return {"tcp": port == 1, "latency": 10 if port == 1 else -1}
+
+    monkeypatch.setattr(server, "tcp_probe", fake_tcp_probe)
+    monkeypatch.setattr(server, "PROBE_CACHE_DEAD_TTL", 0)
+    cache = server.ProbeCache()
+
+    async def scenario():
+        alive = await asyncio.gather(*(cache.probe(["10.0.0.1"], 1) for _ in range(5)))
+        dead = [await cache.probe(["10.0.0.1"], 2), await cache.probe(["10.0.0.1"], 2)]
+        return alive, dead
+
+    alive, dead = run(scenario())
+    assert [cached for _, cached in alive].count(False) == 1
+    assert all(outcome["tcp"] for outcome, _ in alive)
+    assert [cached for _, cached in dead] == [False, False]
+    assert calls == [("10.0.0.1", 1), ("10.0.0.1", 2), ("10.0.0.1", 2)]
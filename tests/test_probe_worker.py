@@ -0,0 +1,188 @@
+import asyncio
+import os
+import subprocess
+import sys
+import uuid
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+import server
+from tests.fakes import FakeDb
+
+BACKEND = Path(__file__).resolve().parent.parent / "backend"
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def setup(monkeypatch):
+    db = FakeDb()
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "stats_counters", server.StatsCounters())
+    monkeypatch.setattr(server, "subscriptions", server.SubscriptionCache())
+    monkeypatch.setattr(server, "probe_cache", server.ProbeCache())
+    return db
+
+
+async def start_listeners(count):
+    servers = [await asyncio.start_server(lambda r, w: w.close(), "127.0.0.1", 0) for _ in range(count)]
+    return servers, [srv.sockets[0].getsockname()[1] for srv in servers]
+
+
+def config_docs(ports, dead_ports=()):
+    docs = []
+    for port in list(ports) + list(dead_ports):
+        parsed = server.ParsedConfig(f"trojan://p@127.0.0.1:{port}#w")
+        doc = server.config_document(parsed, {"status": "active", "latency": 1})
+        docs.append({**doc, "next_test_at": ""})
+    return docs
+
+
+def test_ring_spreads_shards_and_moves_few_on_join():
+    shards = [server.shard_lease(s) for s in range(1024)]
+    three = server.HashRing(["a", "b", "c"])
+    four = server.HashRing(["a", "b", "c", "d"])
+    before = {key: three.owner(key) for key in shards}
+    after = {key: four.owner(key) for key in shards}
+    assert min(Counter(before.values()).values()) > 1024 / 3 * 0.6
+    moved = [key for key in shards if before[key] != after[key]]
+    assert all(after[key] == "d" for key in moved)
+    assert len(moved) < 1024 / 4 * 1.5
+    assert server.shard_of("Example.com", 443) == server.shard_of("example.com", 443)
+
+
+def test_workers_split_the_queue_and_take_over_dead_ones(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        listeners, ports = await start_listeners(40)
+        await db.configs.insert_many(config_docs(ports))
+        workers = [server.ProbeWorker(f"w{i}", batch_size=100) for i in range(3)]
+        for worker in workers:
+            await worker.heartbeat()
+        for worker in workers:
+            await worker.rebalance()
+        held = [worker.shards for worker in workers]
+        assert set().union(*held) == set(range(server.PROBE_SHARDS))
+        assert sum(len(h) for h in held) == server.PROBE_SHARDS
+
+        probed = await asyncio.gather(*(worker.step() for worker in workers))
+        assert sum(probed) == 40
+        buckets = await db.probe_history.find({}).to_list(None)
+        assert sorted(b["count"] for b in buckets) == [1] * 40
+        assert all(doc["test_result"]["status"] == "active" for doc in db.configs.docs)
+        assert db.configs.calls.count("bulk_write") == 2 * sum(1 for n in probed if n)
+
+        # w0 dies: its heartbeat and leases lapse, and the others pick up its shards.
+        await db.probe_workers.update_one({"_id": "w0"}, {"$set": {"expires_at": ""}})
+        await db.leases.update_many({"owner": "w0"}, {"$set": {"expires_at": ""}})
+        for worker in workers[1:]:
+            await worker.rebalance()
+        assert workers[1].shards | workers[2].shards == set(range(server.PROBE_SHARDS))
+        assert not workers[1].shards & workers[2].shards
+
+        # A returning worker gets shards back once the current holders release them.
+        await workers[0].rebalance()
+        assert not workers[0].shards
+        for worker in workers[1:]:
+            await worker.rebalance()
+        await workers[0].rebalance()
+        assert workers[0].shards == held[0]
+        for srv in listeners:
+            srv.close()
+
+    run(scenario())
+
+
+def test_stop_releases_shards(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        worker = server.ProbeWorker("solo")
+        await worker.rebalance()
+        assert len(worker.shards) == server.PROBE_SHARDS
+        assert await server.live_probe_workers() == ["solo"]
+        await worker.stop()
+        assert await server.live_probe_workers() == [] and await db.leases.count_documents({}) == 0
+
+    run(scenario())
+
+
+def test_leases_are_renewed_during_a_long_batch(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        monkeypatch.setattr(server, "PROBE_LEASE_SECONDS", 0.3)
+        worker, rival = server.ProbeWorker("slow"), server.ProbeWorker("rival")
+
+        async def slow_tick(query=None, limit=None):
+            await asyncio.sleep(1)
+            # Well past the lease length, the shards and the heartbeat are still this worker's.
+            assert await server.live_probe_workers() == ["slow"]
+            await rival.rebalance()
+            assert rival.shards == set()
+            return 0
+
+        monkeypatch.setattr(worker, "tick", slow_tick)
+        await worker.step()
+        assert await db.leases.count_documents({"owner": "slow"}) == server.PROBE_SHARDS
+
+    run(scenario())
+
+
+def test_backfill_assigns_shards(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        await db.configs.insert_many([{"config": "trojan://p@h.example:443", "hash": "h", "type": "trojan"}])
+        await server.ProbeWorker("w").backfill()
+        doc = await db.configs.find_one({"hash": "h"})
+        assert doc["shard"] == server.shard_of("h.example", 443) and doc["next_test_at"] == ""
+
+    run(scenario())
+
+
+@pytest.mark.skipif(not os.environ.get("WORKER_MONGO_URL"), reason="set WORKER_MONGO_URL to run workers against a real server")
+def test_worker_processes_probe_every_config_once():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def scenario():
+        mongo = AsyncIOMotorClient(os.environ["WORKER_MONGO_URL"])
+        name = f"workers_{uuid.uuid4().hex[:8]}"
+        db = mongo[name]
+        listeners, ports = await start_listeners(200)
+        env = {**os.environ, "MONGO_URL": os.environ["WORKER_MONGO_URL"], "DB_NAME": name,
+               "PROBE_WORKER_IDLE": "0.2", "PROBE_WORKER_BATCH": "25", "PROBE_LEASE_SECONDS": "5"}
+
+        async def probed():
+            return [w.get("probed", 0) for w in await db.probe_workers.find({}).to_list(None)]
+
+        async def wait_for(condition):
+            for _ in range(300):
+                if condition(await probed()):
+                    return
+                await asyncio.sleep(0.1)
+            raise AssertionError(f"timed out, workers report {await probed()}")
+
+        procs = [subprocess.Popen([sys.executable, "probe_worker.py"], cwd=BACKEND, env=env) for _ in range(3)]
+        try:
+            # Let all three join and settle their shards before there is work to take.
+            await wait_for(lambda counts: len(counts) == 3)
+            await asyncio.sleep(1)
+            await db.configs.insert_many(config_docs(ports))
+            await wait_for(lambda counts: sum(counts) == 200)
+            assert all(n > 0 for n in await probed())
+            assert await db.configs.count_documents({"next_test_at": ""}) == 0
+            counts = [b["count"] async for b in db.probe_history.find({})]
+            assert sorted(counts) == [1] * 200
+        finally:
+            for proc in procs:
+                proc.terminate()
+            for proc in procs:
+                proc.wait(10)
+            for srv in listeners:
+                srv.close()
+            assert await db.probe_workers.count_documents({}) == 0
+            await mongo.drop_database(name)
+            mongo.close()
+
+    run(scenario())
@@ -0,0 +1,118 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import server
+from tests.fakes import FakeDb
+
+VLESS = "vless://uuid@{host}:443?security=tls#{n}"
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def iso(minutes):
+    return (datetime.now(timezone.utc) + timedelta(minutes=minutes)).isoformat()
+
+
+class FakeProber:
+    def __init__(self, down=()):
+        self.down = set(down)
+        self.probed = []
+
+    async def probe(self, parsed):
+        self.probed.append(parsed.host)
+        if parsed.host in self.down:
+            return {"status": "failed", "latency": -1}
+        return {"status": "active", "latency": 50}
+
+
+def setup(monkeypatch, down=()):
+    db = FakeDb()
+    fake = FakeProber(down)
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "prober", fake)
+    monkeypatch.setattr(server, "stats_counters", server.StatsCounters())
+    monkeypatch.setattr(server, "subscriptions", server.SubscriptionCache())
+    return db, fake
+
+
+def add_config(db, host, next_test_at, status="active", failures=0, popularity=0):
+    db.configs.docs.append({"config": VLESS.format(host=host, n=host), "hash": host, "type": "vless",
+                            "test_result": {"status": status}, "failures": failures,
+                            "popularity": popularity, "next_test_at": next_test_at})
+
+
+def test_next_test_time_backs_off_and_favours_popular():
+    now = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    delay = lambda **kw: (datetime.fromisoformat(server.next_test_time(now, **kw)) - now).total_seconds()
+    assert delay(failures=0) == server.RETEST_INTERVAL
+    assert delay(failures=0, popularity=15) == server.RETEST_INTERVAL / 5
+    assert delay(failures=3) == server.RETEST_INTERVAL * 4
+    assert delay(failures=30) == server.RETEST_MAX_BACKOFF
+
+
+def test_tick_takes_most_overdue_then_popular_within_budget(monkeypatch):
+    async def scenario():
+        db, fake = setup(monkeypatch)
+        monkeypatch.setattr(server, "RETEST_PER_MINUTE", 12)
+        monkeypatch.setattr(server, "RETEST_TICK_SECONDS", 15)
+        due = iso(-5)
+        add_config(db, "late.example", due)
+        add_config(db, "old.example", iso(-60))
+        add_config(db, "legacy.example", "")
+        add_config(db, "later.example", iso(60))
+        add_config(db, "popular.example", due, popularity=9)
+        retester = server.RetestScheduler()
+        assert await retester.tick() == 3
+        assert fake.probed == ["legacy.example", "old.example", "popular.example"]
+        # One bulk for the probes, one for the rollups.
+        assert db.configs.calls.count("bulk_write") == 2
+        tested = {d["hash"]: d for d in db.configs.docs}
+        assert tested["old.example"]["next_test_at"] > iso(60)
+        assert tested["late.example"]["next_test_at"] == due
+
+    run(scenario())
+
+
+def test_failures_back_off_then_expire(monkeypatch):
+    async def scenario():
+        db, fake = setup(monkeypatch, down={"down.example"})
+        monkeypatch.setattr(server, "RETEST_MAX_FAILURES", 3)
+        add_config(db, "down.example", "")
+        add_config(db, "up.example", "", status="failed", failures=2)
+        await db.stats.insert_one({"_id": "counters", "configs_total": 2, "configs_active": 1,
+                                   "types": {"vless": 2}, "configs_version": 0})
+        retester = server.RetestScheduler()
+        await retester.tick()
+        down = await db.configs.find_one({"hash": "down.example"})
+        up = await db.configs.find_one({"hash": "up.example"})
+        assert down["failures"] == 1 and down["test_result"]["status"] == "failed"
+        assert up["failures"] == 0 and up["test_result"]["status"] == "active"
+        assert retester.stats()["recovered"] == 1
+        counters = await db.stats.find_one({"_id": "counters"})
+        assert counters["configs_active"] == 1
+
+        for failures in (2, 3):
+            await db.configs.update_one({"hash": "down.example"}, {"$set": {"next_test_at": ""}})
+            await retester.tick()
+        assert await db.configs.find_one({"hash": "down.example"}) is None
+        counters = await db.stats.find_one({"_id": "counters"})
+        assert counters["configs_total"] == 1 and counters["types"]["vless"] == 1
+        assert counters["configs_version"] == 4
+        assert retester.stats()["expired"] == 1
+
+    run(scenario())
+
+
+def test_lease_has_a_single_holder_until_it_expires(monkeypatch):
+    async def scenario():
+        db, _ = setup(monkeypatch)
+        assert await server.acquire_lease("retest", "a", 60)
+        assert not await server.acquire_lease("retest", "b", 60)
+        assert await server.acquire_lease("retest", "a", 60)
+        await db.leases.update_one({"_id": "retest"}, {"$set": {"expires_at": iso(-1)}})
+        assert await server.acquire_lease("retest", "b", 60)
+        assert not await server.acquire_lease("retest", "a", 60)
+
+    run(scenario())
@@ -0,0 +1,100 @@
+import asyncio
+import hashlib
+
+from pymongo.errors import BulkWriteError
+
+import server
+
+
+def digest(i):
+    return hashlib.md5(str(i).encode()).digest()
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, length):
+        return self.docs
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for doc in self.docs:
+            yield doc
+
+
+class FakeSeenCollection:
+    def __init__(self):
+        self.docs = {}
+        self.finds = 0
+
+    def find(self, query, projection=None):
+        wanted = query.get("h", {}).get("$in")
+        if wanted is not None:
+            self.finds += 1
+        hashes = self.docs if wanted is None else [h for h in wanted if h in self.docs]
+        return FakeCursor([{"h": h} for h in hashes])
+
+    async def update_many(self, query, update):
+        for h in query["h"]["$in"]:
+            self.docs[h] = update["$set"]["seen_at"]
+
+    async def insert_many(self, docs, ordered=True):
+        errors = []
+        for i, doc in enumerate(docs):
+            if doc["h"] in self.docs:
+                errors.append({"index": i, "code": 11000})
+            else:
+                self.docs[doc["h"]] = doc["seen_at"]
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+
+def test_bloom_filter_has_no_false_negatives_and_bounded_false_positives():
+    bloom = server.BloomFilter(10_000, 0.01)
+    for i in range(10_000):
+        bloom.add(digest(i))
+    assert all(digest(i) in bloom for i in range(10_000))
+    false_positives = sum(digest(i) in bloom for i in range(10_000, 20_000))
+    assert false_positives < 300
+
+
+def test_seen_index_filters_and_records(monkeypatch):
+    monkeypatch.setattr(server, "SEEN_BATCH_SIZE", 3)
+    collection = FakeSeenCollection()
+    index = server.SeenConfigIndex(collection)
+    first = [digest(i) for i in range(5)]
+    second = [digest(i) for i in range(3, 8)]
+
+    new_first = asyncio.run(index.filter_new(first))
+    new_second = asyncio.run(index.filter_new(second))
+
+    assert new_first == set(first)
+    assert new_second == {digest(5), digest(6), digest(7)}
+    assert set(collection.docs) == {digest(i) for i in range(8)}
+
+
+def test_seen_index_bloom_skips_lookups_for_definitely_new():
+    collection = FakeSeenCollection()
+    index = server.SeenConfigIndex(collection)
+    asyncio.run(index.filter_new([digest(1)]))
+    index = server.SeenConfigIndex(collection)
+    asyncio.run(index.warm())
+    assert index.bloom_ready
+
+    collection.finds = 0
+    assert asyncio.run(index.filter_new([digest(i) for i in range(100, 150)])) == {digest(i) for i in range(100, 150)}
+    assert collection.finds <= 1
+    assert index.stats["bloom_new"] >= 49
+    assert asyncio.run(index.filter_new([digest(1)])) == set()
+
+
+def test_seen_index_treats_duplicate_key_as_seen():
+    collection = FakeSeenCollection()
+    index = server.SeenConfigIndex(collection)
+    index.bloom_ready = True
+    # Another worker recorded the digest, but this process's bloom filter has never heard of it.
+    collection.docs[digest(9)] = None
+    assert asyncio.run(index.filter_new([digest(9), digest(10)])) == {digest(10)}
@@ -0,0 +1,55 @@
+import asyncio
+
+import server
+from tests.fakes import FakeDb
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def setup(monkeypatch):
+    db = FakeDb()
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "kv_cache", server.KvCache())
+    return db
+
+
+def test_add_and_remove_are_single_atomic_updates(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        await server.kv_set("source_links", ["https://a"])
+        db.kv_store.calls.clear()
+        assert await server.kv_add_item("source_links", "https://b") == (True, ["https://a", "https://b"])
+        assert await server.kv_add_item("source_links", "https://b") == (False, ["https://a", "https://b"])
+        assert await server.kv_remove_item("source_links", "https://a") == (True, ["https://b"])
+        assert await server.kv_remove_item("source_links", "https://a") == (False, ["https://b"])
+        assert db.kv_store.calls == ["find_one_and_update"] * 4
+        assert await server.kv_get("source_links") == ["https://b"]
+        assert "find" not in db.kv_store.calls
+
+    run(scenario())
+
+
+def test_add_creates_missing_setting(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        assert await server.kv_add_item("channel_ids", "@new") == (True, ["@new"])
+        stored = await db.kv_store.find_one({"key": "channel_ids"})
+        assert stored["value"] == ["@new"]
+        assert await server.kv_remove_item("channel_ids", "@gone") == (False, ["@new"])
+
+    run(scenario())
+
+
+def test_concurrent_admins_do_not_lose_updates(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        await server.kv_set("source_links", [])
+        urls = [f"https://source-{i}" for i in range(300)]
+        await asyncio.gather(*(server.kv_add_item("source_links", url) for url in urls))
+        await asyncio.gather(*(server.kv_remove_item("source_links", url) for url in urls[::2]))
+        stored = await db.kv_store.find_one({"key": "source_links"})
+        assert sorted(stored["value"]) == sorted(urls[1::2])
+
+    run(scenario())
@@ -0,0 +1,82 @@
+import asyncio
+
+import server
+from tests.fakes import FakeDb
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def setup(monkeypatch):
+    db = FakeDb()
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "kv_cache", server.KvCache())
+    monkeypatch.setattr(server, "seen_index", server.SeenConfigIndex(db.seen_configs))
+    monkeypatch.setattr(server, "stats_counters", server.StatsCounters())
+    return db
+
+
+def active(status="active"):
+    return {"status": status, "message": status}
+
+
+def test_counters_follow_writes(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        await server.stats_counters.reconcile()
+        vless = server.ParsedConfig("vless://u@a.example:443")
+        trojan = server.ParsedConfig("trojan://p@b.example:443")
+        await server.upsert_config(vless, active())
+        await server.upsert_config(trojan, active("dead"))
+        await server.upsert_config(trojan, active())
+        await server.upsert_config(vless, active("dns_only"))
+        await db.submissions.insert_many([{"config": "c1", "status": "pending"}, {"config": "c2", "status": "pending"}])
+        await server.stats_counters.submissions_added(2)
+        await server.resolve_submission({"config": "c1"}, "approved")
+        await server.resolve_submission({"config": "c1"}, "approved")
+
+        counters = await db.stats.find_one({"_id": "counters"}, {"_id": 0})
+        recount = await server.stats_counters.reconcile()
+        for key in ("configs_total", "configs_active", "types", "submissions_pending"):
+            assert counters[key] == recount[key]
+        assert recount["configs_total"] == 2 and recount["configs_active"] == 1
+        assert recount["types"] == {"vless": 1, "trojan": 1}
+        assert recount["submissions_pending"] == 1
+
+    run(scenario())
+
+
+def test_snapshot_is_cached_and_does_not_touch_collections(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        await server.kv_set("source_links", ["https://a", "https://b"])
+        for i in range(50):
+            await server.upsert_config(server.ParsedConfig(f"vless://u@h{i}.example:443"), active())
+        first = await server.stats_counters.snapshot()
+        assert first["total_configs"] == 50 and first["active_configs"] == 50
+        assert first["source_links"] == 2 and first["configs_by_type"] == {"vless": 50}
+        db.configs.calls.clear()
+        db.stats.calls.clear()
+        snapshots = await asyncio.gather(*(server.stats_counters.snapshot() for _ in range(20)))
+        assert all(s["total_configs"] == 50 for s in snapshots)
+        assert db.configs.calls == [] and db.stats.calls == []
+
+    run(scenario())
+
+
+def test_first_snapshot_reconciles_missing_counters(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        await db.configs.insert_many([
+            {"hash": "a", "type": "ss", "test_result": {"status": "active"}},
+            {"hash": "b", "type": "ss", "test_result": {"status": "dead"}},
+        ])
+        await db.submissions.insert_one({"config": "x", "status": "pending"})
+        snapshot = await server.stats_counters.snapshot()
+        assert snapshot["total_configs"] == 2 and snapshot["active_configs"] == 1
+        assert snapshot["pending_submissions"] == 1
+        assert snapshot["reconciled_at"]
+        assert db.configs.calls.count("aggregate") == 1
+
+    run(scenario())
@@ -0,0 +1,93 @@
+import asyncio
+import base64
+import gzip
+
+import httpx
+
+import server
+from tests.fakes import FakeDb
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def setup(monkeypatch):
+    db = FakeDb()
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "stats_counters", server.StatsCounters())
+    monkeypatch.setattr(server, "subscriptions", server.SubscriptionCache())
+    return db
+
+
+async def add(config, status="active", latency=50):
+    await server.upsert_config(server.ParsedConfig(config), {"status": status, "message": status, "latency": latency})
+
+
+def decode(response):
+    return base64.b64decode(response.content).decode().split("\n")
+
+
+def client():
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test")
+
+
+def test_subscription_serves_active_configs_sorted_by_latency(monkeypatch):
+    async def scenario():
+        setup(monkeypatch)
+        await add("vless://u@slow.example:443", latency=300)
+        await add("trojan://p@fast.example:443", latency=20)
+        await add("vless://u@dead.example:443", status="dead", latency=-1)
+        async with client() as http:
+            response = await http.get("/api/sub", headers={"Accept-Encoding": "identity"})
+            assert response.status_code == 200
+            assert decode(response) == ["trojan://p@fast.example:443", "vless://u@slow.example:443"]
+            assert decode(await http.get("/api/sub", params={"type": "vless"})) == ["vless://u@slow.example:443"]
+            assert decode(await http.get("/api/sub", params={"max_latency": 100})) == ["trojan://p@fast.example:443"]
+            assert decode(await http.get("/api/sub", params={"limit": 1})) == ["trojan://p@fast.example:443"]
+
+    run(scenario())
+
+
+def test_etag_gzip_and_no_mongo_per_request(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        await add("vless://u@a.example:443")
+        async with client() as http:
+            first = await http.get("/api/sub", headers={"Accept-Encoding": "gzip"})
+            assert first.headers["content-encoding"] == "gzip"
+            raw = await http.get("/api/sub", headers={"Accept-Encoding": "identity"})
+            assert gzip.decompress(server.subscriptions.blobs[(None, None, None, server.SUB_MAX_LIMIT)]["gzip"]) == raw.content
+            etag = first.headers["etag"]
+            db.configs.calls.clear()
+            db.stats.calls.clear()
+            for _ in range(50):
+                again = await http.get("/api/sub", headers={"If-None-Match": etag})
+                assert again.status_code == 304 and again.content == b""
+            assert db.configs.calls == [] and db.stats.calls == []
+            assert server.subscriptions.stats()["rebuilds"] == 1
+
+    run(scenario())
+
+
+def test_body_is_rebuilt_when_the_config_set_changes(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        await add("vless://u@a.example:443")
+        async with client() as http:
+            etag = (await http.get("/api/sub")).headers["etag"]
+            await add("vless://u@b.example:443", latency=10)
+            response = await http.get("/api/sub", headers={"If-None-Match": etag, "Accept-Encoding": "identity"})
+            assert response.status_code == 200 and response.headers["etag"] != etag
+            assert decode(response) == ["vless://u@b.example:443", "vless://u@a.example:443"]
+
+            # Another worker's write is picked up once the version is re-read.
+            monkeypatch.setattr(server, "SUB_CHECK_SECONDS", 0)
+            await db.configs.insert_one({"config": "trojan://p@c.example:443", "type": "trojan",
+                                         "test_result": {"status": "active", "latency": 5}})
+            await db.stats.update_one({"_id": "counters"}, {"$inc": {"configs_version": 1}})
+            server.subscriptions.version_check.clear()
+            response = await http.get("/api/sub", headers={"Accept-Encoding": "identity"})
+            assert decode(response)[0] == "trojan://p@c.example:443"
+
+    run(scenario())
@@ -0,0 +1,80 @@
+import asyncio
+import json
+
+import httpx
+
+import server
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def make_client(handler):
+    return server.TelegramClient(api_url="https://api.telegram.test/botTOKEN", transport=httpx.MockTransport(handler))
+
+
+def test_send_message_reuses_one_client_and_parses_result():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json={"ok": True, "result": {"message_id": len(requests)}})
+
+    async def scenario():
+        tg = make_client(handler)
+        first = await tg.send_message("1", "hi", {"inline_keyboard": []})
+        http = tg.http
+        second = await tg.send_message("1", "again")
+        same_client = tg.http is http
+        await tg.aclose()
+        return first, second, same_client
+
+    first, second, same_client = run(scenario())
+    assert same_client
+    assert first.ok and first.result == {"message_id": 1}
+    assert second.result == {"message_id": 2}
+    assert str(requests[0].url) == "https://api.telegram.test/botTOKEN/sendMessage"
+    body = json.loads(requests[0].content)
+    assert body["parse_mode"] == "Markdown"
+    assert json.loads(body["reply_markup"]) == {"inline_keyboard": []}
+    assert "reply_markup" not in json.loads(requests[1].content)
+
+
+def test_errors_are_typed():
+    def handler(request):
+        return httpx.Response(429, json={"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 7",
+                                         "parameters": {"retry_after": 7}})
+
+    result = run(make_client(handler).send_message("1", "x"))
+    assert not result.ok
+    assert result.error_code == 429
+    assert result.retry_after == 7
+
+
+def test_transport_failures_do_not_raise():
+    def handler(request):
+        raise httpx.ConnectError("down")
+
+    result = run(make_client(handler).call("answerCallbackQuery", {}))
+    assert not result.ok
+    assert result.description == "down"
+
+
+def test_send_many_runs_in_parallel_and_keeps_order():
+    async def handler(request):
+        chat_id = json.loads(request.content)["chat_id"]
+        await asyncio.sleep(0.1 if chat_id == "a" else 0.01)
+        return httpx.Response(200, json={"ok": True, "result": {"chat": chat_id}})
+
+    async def scenario():
+        tg = make_client(handler)
+        start = asyncio.get_running_loop().time()
+        results = await tg.send_many([{"chat_id": c, "text": "x"} for c in ["a", "b", "c", "d"]])
+        elapsed = asyncio.get_running_loop().time() - start
+        await tg.aclose()
+        return results, elapsed
+
+    results, elapsed = run(scenario())
+    assert [r.result["chat"] for r in results] == ["a", "b", "c", "d"]
+    assert elapsed < 0.3
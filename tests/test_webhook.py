@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import httpx
+
+import server
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def message(update_id, chat_id, text="hi"):
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "text": text}}
+
+
+def test_updates_are_ordered_per_chat_and_parallel_across_chats():
+    async def scenario():
+        handled = []
+
+        async def handler(update):
+            await asyncio.sleep(0.05)
+            handled.append((server.update_chat_id(update), update["update_id"]))
+
+        queue = server.UpdateQueue(handler)
+        start = time.monotonic()
+        for i in range(5):
+            for chat in (1, 2, 3):
+                assert queue.submit(message(i * 10 + chat, chat)) == "accepted"
+        await queue.join()
+        elapsed = time.monotonic() - start
+        for chat in ("1", "2", "3"):
+            assert [u for c, u in handled if c == chat] == sorted(u for c, u in handled if c == chat)
+        assert len(handled) == 15
+        assert elapsed < 0.5
+        assert queue.stats()["queued"] == 0 and not queue.queues
+
+    run(scenario())
+
+
+def test_redelivered_update_ids_are_dropped():
+    async def scenario():
+        handled = []
+
+        async def handler(update):
+            handled.append(update["update_id"])
+
+        queue = server.UpdateQueue(handler)
+        assert queue.submit(message(1, 5)) == "accepted"
+        assert queue.submit(message(1, 5)) == "duplicate"
+        await queue.join()
+        assert queue.submit(message(1, 5)) == "duplicate"
+        await queue.join()
+        assert handled == [1]
+        assert queue.stats()["duplicates"] == 2
+
+    run(scenario())
+
+
+def test_handler_errors_do_not_stop_the_chat_queue():
+    async def scenario():
+        handled = []
+
+        async def handler(update):
+            if update["update_id"] == 1:
+                raise RuntimeError("boom")
+            handled.append(update["update_id"])
+
+        queue = server.UpdateQueue(handler)
+        queue.submit(message(1, 9))
+        queue.submit(message(2, 9))
+        await queue.join()
+        assert handled == [2]
+        assert queue.stats()["failed"] == 1
+
+    run(scenario())
+
+
+def test_webhook_acks_before_handling(monkeypatch):
+    async def scenario():
+        async def slow_handler(update):
+            await asyncio.sleep(0.5)
+
+        queue = server.UpdateQueue(slow_handler)
+        monkeypatch.setattr(server, "updates", queue)
+        transport = httpx.ASGITransport(app=server.app)
+        latencies = []
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            for i in range(200):
+                start = time.monotonic()
+                response = await client.post("/api/webhook", json=message(i, i % 20))
+                latencies.append(time.monotonic() - start)
+                assert response.json() == {"ok": True}
+            bad = await client.post("/api/webhook", json={"message": {}})
+            assert bad.json()["ok"] is False
+            monkeypatch.setattr(server, "WEBHOOK_MAX_QUEUED", queue.queued)
+            full = await client.post("/api/webhook", json=message(1000, 1))
+            assert full.status_code == 503
+        latencies.sort()
+        assert latencies[int(len(latencies) * 0.99)] < 0.05
+        await queue.aclose()
+
+    run(scenario())
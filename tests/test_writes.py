@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+from pymongo import InsertOne, UpdateOne
+
+import server
+from tests.fakes import FakeDb
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def setup(monkeypatch):
+    db = FakeDb()
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "stats_counters", server.StatsCounters())
+    return db
+
+
+def test_full_batch_flushes_at_once(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        batcher = server.WriteBatcher("items", max_size=10, max_delay=60)
+        futures = [batcher.add(InsertOne({"n": i})) for i in range(25)]
+        results = await asyncio.wait_for(asyncio.gather(*futures[:20]), 1)
+        assert all(r["ok"] for r in results)
+        assert db.items.calls == ["bulk_write", "bulk_write"]
+        assert batcher.stats()["pending"] == 5
+        await batcher.aclose()
+        assert await asyncio.gather(*futures[20:])
+        assert len(db.items.docs) == 25 and db.items.calls.count("bulk_write") == 3
+
+    run(scenario())
+
+
+def test_partial_batch_flushes_after_delay(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        batcher = server.WriteBatcher("items", max_size=100, max_delay=0.05)
+        start = time.monotonic()
+        results = await asyncio.gather(*(batcher.add(InsertOne({"n": i})) for i in range(3)))
+        assert 0.04 < time.monotonic() - start < 0.5
+        assert [r["ok"] for r in results] == [True] * 3
+        assert db.items.calls == ["bulk_write"]
+
+    run(scenario())
+
+
+def test_errors_are_reported_per_item(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        await db.items.create_index("key", unique=True)
+        batcher = server.WriteBatcher("items", max_size=4)
+        ops = [InsertOne({"key": "a"}), InsertOne({"key": "a"}), UpdateOne({"key": "b"}, {"$set": {"v": 1}}, upsert=True),
+               InsertOne({"key": "c"})]
+        results = await asyncio.gather(*(batcher.add(op) for op in ops))
+        assert [r["ok"] for r in results] == [True, False, True, True]
+        assert "duplicate" in results[1]["error"]
+        assert results[2]["upserted"]
+        assert sorted(d["key"] for d in db.items.docs) == ["a", "b", "c"]
+        assert batcher.stats()["errors"] == 1
+
+    run(scenario())
+
+
+def test_config_batches_keep_counters_exact(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        await server.stats_counters.reconcile()
+        existing = server.ParsedConfig("vless://u@old.example:443")
+        await server.upsert_config(existing, {"status": "active"})
+        batcher = server.ConfigWriteBatcher(max_size=50)
+        futures = [batcher.add_config(existing, {"status": "dead"})]
+        futures += [batcher.add_config(server.ParsedConfig(f"trojan://p@h{i}.example:443"), {"status": "active"}) for i in range(5)]
+        await batcher.flush()
+        assert all(r["ok"] for r in await asyncio.gather(*futures))
+        counters = await db.stats.find_one({"_id": "counters"}, {"_id": 0})
+        recount = await server.stats_counters.reconcile()
+        for key in ("configs_total", "configs_active", "types"):
+            assert counters[key] == recount[key]
+        assert recount["configs_active"] == 5
+
+    run(scenario())
+
+
+def test_pasted_configs_are_stored_in_one_round_trip(monkeypatch):
+    async def scenario():
+        db = setup(monkeypatch)
+        monkeypatch.setattr(server, "submission_writes", server.WriteBatcher("submissions"))
+        configs = [(f"vless://u@h{i}.example:443", "vless") for i in range(40)]
+        assert await server.submit_configs(configs, "7", "alice") == 40
+        assert db.submissions.calls == ["bulk_write"]
+        assert await db.submissions.count_documents({"status": "pending", "submitted_by": "7"}) == 40
+        counters = await db.stats.find_one({"_id": "counters"})
+        assert counters["submissions_pending"] == 40
+
+    run(scenario())